@@ -6,15 +6,40 @@
 # The full license is in the file LICENSE, distributed with this software.
 # ----------------------------------------------------------------------------
 
-from ._decontamination import decontam_identify, decontam_remove
+from ._decontamination import (decontam_identify, decontam_remove,
+                               decontam_recombine)
+from ._batch import decontam_identify_batch
+from ._approximate import decontam_identify_approximate
+from ._similarity import decontam_control_similarity
+from ._leakage import decontam_well_leakage
+from ._mixing import decontam_contaminant_fraction
+from ._kmers import decontam_build_kmer_index
 from ._version import get_versions
-from ._stats import DecontamScore, DecontamScoreDirFmt, DecontamScoreFormat
+from ._stats import (DecontamScore, DecontamScoreDirFmt, DecontamScoreFormat,
+                     ControlSimilarity, ControlSimilarityFormat,
+                     ControlSimilarityDirFmt, WellLeakage, WellLeakageFormat,
+                     WellLeakageDirFmt, ContaminantFraction,
+                     ContaminantFractionFormat, ContaminantFractionDirFmt,
+                     ContaminantKmerIndex, ContaminantKmerIndexFormat,
+                     ContaminantKmerIndexDirFmt)
 from ._threshold_graph import (decontam_score_viz)
+from ._progress import (ProgressEvent, add_progress_listener,
+                        remove_progress_listener)
 
 
 __version__ = get_versions()['version']
 del get_versions
 
-__all__ = ['decontam_identify','decontam_remove',
+__all__ = ['decontam_identify','decontam_remove', 'decontam_identify_batch',
+           'decontam_identify_approximate', 'decontam_recombine',
+           'decontam_control_similarity', 'ControlSimilarity',
+           'ControlSimilarityFormat', 'ControlSimilarityDirFmt',
+           'decontam_well_leakage', 'WellLeakage', 'WellLeakageFormat',
+           'WellLeakageDirFmt', 'decontam_contaminant_fraction',
+           'ContaminantFraction', 'ContaminantFractionFormat',
+           'ContaminantFractionDirFmt', 'decontam_build_kmer_index',
+           'ContaminantKmerIndex', 'ContaminantKmerIndexFormat',
+           'ContaminantKmerIndexDirFmt',
            'DecontamScore', 'DecontamScoreFormat', 'DecontamScoreDirFmt',
-           'decontam_score_viz']
+           'decontam_score_viz', 'ProgressEvent', 'add_progress_listener',
+           'remove_progress_listener']
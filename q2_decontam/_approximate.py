@@ -0,0 +1,157 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2016-2022, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import logging
+import warnings
+
+import qiime2
+import numpy as np
+import pandas as pd
+from qiime2.plugin.util import transform
+
+from ._stats import DecontamScoreFormat
+from ._scoring import _scoring_inputs, _score_counts, _scores_frame
+from ._report import RunReport, _stage, _table_info
+from ._decontamination import _UNUSED_COLUMNS, _label_method_columns
+
+logger = logging.getLogger('q2_decontam')
+
+# Library-size strata the non-control samples are drawn from.
+_N_STRATA = 10
+# Central bootstrap interval reported as p.lower / p.upper.
+_INTERVAL = (5, 95)
+
+
+def _library_size_strata(library_sizes, n_strata=_N_STRATA):
+    """Stratum (0 .. n_strata - 1) of every sample by library-size rank."""
+    n = len(library_sizes)
+    n_strata = max(min(n_strata, n), 1)
+    ranks = np.argsort(np.argsort(library_sizes, kind='stable'),
+                       kind='stable')
+    return ranks * n_strata // max(n, 1)
+
+
+def _stratified_subsample(library_sizes, neg, fraction, rng):
+    """Sorted column indices of every control plus `fraction` of the others.
+
+    The other samples are drawn evenly from library-size strata, at least
+    one from each, so shallow and deep samples stay represented.
+    """
+    samples = np.flatnonzero(~neg)
+    strata = _library_size_strata(library_sizes[samples])
+    chosen = [np.flatnonzero(neg)]
+    for stratum in np.unique(strata):
+        members = samples[strata == stratum]
+        n_draw = max(int(round(len(members) * fraction)), 1)
+        chosen.append(rng.choice(members, n_draw, replace=False))
+    return np.sort(np.concatenate(chosen))
+
+
+def _bootstrap_pvalues(counts, totals, conc, neg, decon_method,
+                       n_bootstraps, rng):
+    """p of every feature in `n_bootstraps` resamples of the samples.
+
+    Controls and other samples are resampled separately, so every replicate
+    keeps the number of controls the prevalence test relies on.
+    """
+    groups = [np.flatnonzero(neg), np.flatnonzero(~neg)]
+    pvalues = np.empty((n_bootstraps, counts.shape[0]))
+    for replicate in range(n_bootstraps):
+        idx = np.concatenate([rng.choice(group, len(group), replace=True)
+                              for group in groups if len(group)])
+        scores = _score_counts(
+            counts[:, idx], totals[idx],
+            None if conc is None else conc[idx],
+            neg[idx] if neg.any() else None, decon_method)
+        pvalues[replicate] = scores[:, -1]
+    return pvalues
+
+
+def _score_approximate(table, metadata, decon_method,
+                       freq_concentration_column,
+                       prev_control_or_exp_sample_column,
+                       prev_control_sample_indicator, sample_fraction,
+                       n_bootstraps, threshold, rng):
+    counts, totals, conc, neg = _scoring_inputs(
+        table, metadata, decon_method, freq_concentration_column,
+        prev_control_or_exp_sample_column, prev_control_sample_indicator)
+    control = np.zeros(len(totals), dtype=bool) if neg is None else neg
+
+    with _stage('subsample'):
+        idx = _stratified_subsample(totals, control, sample_fraction, rng)
+        counts, totals = counts[:, idx], totals[idx]
+        conc = None if conc is None else conc[idx]
+        control = control[idx]
+        neg = None if neg is None else control
+    with _stage('score_subsample'):
+        scores = _scores_frame(
+            _score_counts(counts, totals, conc, neg, decon_method),
+            table.index)
+    with _stage('bootstrap'):
+        pvalues = _bootstrap_pvalues(counts, totals, conc, control,
+                                     decon_method, n_bootstraps, rng)
+        with warnings.catch_warnings():
+            # features absent from every replicate have no interval
+            warnings.simplefilter('ignore', RuntimeWarning)
+            lower, upper = np.nanpercentile(pvalues, _INTERVAL, axis=0)
+
+    df = scores.drop(columns=_UNUSED_COLUMNS.get(decon_method, []))
+    df = _label_method_columns(df, decon_method)
+    df['p.lower'] = lower
+    df['p.upper'] = upper
+    # the call flips somewhere inside the interval, or cannot be made
+    df['unstable'] = ~((upper <= threshold) | (lower > threshold))
+    return df, len(idx), int(control.sum())
+
+
+def decontam_identify_approximate(asv_or_otu_table: pd.DataFrame,
+                                  meta_data: qiime2.Metadata,
+                                  decon_method: str = 'prevalence',
+                                  freq_concentration_column: str = 'NULL',
+                                  prev_control_or_exp_sample_column: str =
+                                  'NULL',
+                                  prev_control_sample_indicator: str = 'NULL',
+                                  sample_fraction: float = 0.05,
+                                  n_bootstraps: int = 20,
+                                  threshold: float = 0.1,
+                                  random_seed: int = 0
+                                  ) -> DecontamScoreFormat:
+    """Triage scores from a stratified subsample of the samples.
+
+    Every control is kept; `sample_fraction` of the other samples is drawn
+    across library-size strata and scored with the native kernel, then
+    bootstrapped for an interval around p. Features whose interval straddles
+    `threshold`, or that are missing from the subsample, are flagged in an
+    `unstable` column.
+    """
+    if not 0 < sample_fraction <= 1:
+        raise ValueError('sample_fraction must be in (0, 1], not %r.'
+                         % sample_fraction)
+    if n_bootstraps < 1:
+        raise ValueError('n_bootstraps must be at least 1.')
+    rng = np.random.default_rng(random_seed)
+    with RunReport('decontam_identify_approximate',
+                   decon_method=decon_method,
+                   sample_fraction=sample_fraction,
+                   n_bootstraps=n_bootstraps,
+                   matrix=_table_info(asv_or_otu_table)) as report:
+        df, n_samples, n_controls = _score_approximate(
+            asv_or_otu_table, meta_data.to_dataframe(), decon_method,
+            freq_concentration_column, prev_control_or_exp_sample_column,
+            prev_control_sample_indicator, sample_fraction, n_bootstraps,
+            threshold, rng)
+        n_unstable = int(df['unstable'].sum())
+        report.update(samples_scored=n_samples, controls=n_controls,
+                      unstable=n_unstable)
+        logger.info('Scored %d of %d samples (%d controls); %d of %d '
+                    'features are unstable at threshold %g', n_samples,
+                    asv_or_otu_table.shape[1], n_controls, n_unstable,
+                    len(df), threshold)
+        with report.stage('transform'):
+            return transform(df, from_type=pd.DataFrame,
+                             to_type=DecontamScoreFormat)
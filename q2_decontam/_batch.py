@@ -0,0 +1,113 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2016-2022, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import os
+import time
+import tempfile
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import qiime2
+import pandas as pd
+from qiime2.plugin.util import transform
+
+from ._stats import DecontamScoreFormat
+from ._report import RunReport, _table_info, _stage_prefix
+from ._decontamination import (_score_with_r, _score_with_native,
+                               _score_prefiltered)
+
+
+def _named_tables(tables):
+    if isinstance(tables, dict):
+        return {str(name): table for name, table in tables.items()}
+    return {str(index): table for index, table in enumerate(tables)}
+
+
+def _score_batch(tables, meta_data, decon_method, freq_concentration_column,
+                 prev_control_or_exp_sample_column,
+                 prev_control_sample_indicator, scoring_backend, n_workers,
+                 report):
+    """Score every table on a pool of `n_workers` threads.
+
+    The metadata is converted (and, for R, written out) once for the whole
+    batch. Threads suffice: the R backend waits on run_decontam.R and the
+    native kernel spends its time in NumPy/SciPy, both outside the GIL.
+    Stages the backends record land in `report` as ``<table>:<stage>``;
+    with several workers their peak RSS overlaps and is approximate.
+    """
+    args = (meta_data, decon_method, freq_concentration_column,
+            prev_control_or_exp_sample_column, prev_control_sample_indicator)
+    with tempfile.TemporaryDirectory() as temp_dir_name:
+        with report.stage('prepare_metadata'):
+            metadata = meta_data.to_dataframe()
+            if scoring_backend == 'r':
+                metadata_fp = os.path.join(temp_dir_name, 'metadata.csv')
+                metadata.to_csv(metadata_fp)
+                shared = {'metadata_fp': metadata_fp}
+            else:
+                shared = {'metadata': metadata}
+        score_backend = {'r': _score_with_r,
+                         'native': _score_with_native}[scoring_backend]
+
+        def score(name):
+            # runs in a copy of the submitting context, so the backend's
+            # stages reach the batch report, named after the table
+            _stage_prefix.set('%s:' % name)
+            start = time.perf_counter()
+            df = _score_prefiltered(score_backend, tables[name], *args,
+                                    **shared)
+            return name, df, time.perf_counter() - start
+
+        results = {}
+        with ThreadPoolExecutor(max_workers=n_workers) as pool:
+            futures = {pool.submit(contextvars.copy_context().run, score,
+                                   name): name
+                       for name in tables}
+            for future in as_completed(futures):
+                try:
+                    name, df, seconds = future.result()
+                except Exception as e:
+                    for pending in futures:
+                        pending.cancel()
+                    raise ValueError('Scoring table %r of the batch failed: '
+                                     '%s' % (futures[future], e)) from e
+                report.add_stage('score:%s' % name, seconds)
+                results[name] = df
+    # keep the input order, whatever order the tables finished in
+    return {name: results[name] for name in tables}
+
+
+def decontam_identify_batch(asv_or_otu_tables: dict,
+                            meta_data: qiime2.Metadata,
+                            decon_method: str = 'prevalence',
+                            freq_concentration_column: str = 'NULL',
+                            prev_control_or_exp_sample_column: str = 'NULL',
+                            prev_control_sample_indicator: str = 'NULL',
+                            scoring_backend: str = 'r',
+                            n_workers: int = 1) -> dict:
+    """Run identify on many tables that share metadata and parameters.
+
+    Returns one score table per input table, keyed like the input (by
+    position for a list).
+    """
+    tables = _named_tables(asv_or_otu_tables)
+    if not tables:
+        raise ValueError('The batch does not contain any tables.')
+    info = {name: _table_info(table) for name, table in tables.items()}
+    with RunReport('decontam_identify_batch', decon_method=decon_method,
+                   scoring_backend=scoring_backend, n_workers=n_workers,
+                   tables=info) as report:
+        scores = _score_batch(tables, meta_data, decon_method,
+                              freq_concentration_column,
+                              prev_control_or_exp_sample_column,
+                              prev_control_sample_indicator, scoring_backend,
+                              n_workers, report)
+        with report.stage('transform'):
+            return {name: transform(df, from_type=pd.DataFrame,
+                                    to_type=DecontamScoreFormat)
+                    for name, df in scores.items()}
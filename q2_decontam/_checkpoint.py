@@ -0,0 +1,93 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2016-2022, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import os
+import json
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+from ._scoring import _score_counts
+from ._progress import _feature_ranges
+
+MANIFEST = 'checkpoint.json'
+
+# Checkpointed runs always persist this many chunks, whatever the table size.
+_CHECKPOINT_CHUNKS = 100
+
+
+def _checkpoint_chunk_size(n_features):
+    return max(-(-n_features // _CHECKPOINT_CHUNKS), 1)
+
+
+def _input_hash(table, metadata, **params):
+    """Digest of everything that determines the scores of a run."""
+    digest = hashlib.sha256()
+    for frame in (table, metadata):
+        digest.update(json.dumps([str(c) for c in frame.columns]).encode())
+        digest.update(pd.util.hash_pandas_object(frame, index=True)
+                      .to_numpy().tobytes())
+    digest.update(json.dumps(params, sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+def _chunk_path(checkpoint_dir, index, suffix):
+    return os.path.join(checkpoint_dir, 'chunk-%05d%s' % (index, suffix))
+
+
+def _open_checkpoint(checkpoint_dir, input_hash, n_features, chunk_size):
+    """Create or resume `checkpoint_dir`, refusing one from another run."""
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    manifest_fp = os.path.join(checkpoint_dir, MANIFEST)
+    manifest = {'input_hash': input_hash, 'n_features': n_features,
+                'chunk_size': chunk_size}
+    if os.path.exists(manifest_fp):
+        with open(manifest_fp) as fh:
+            existing = json.load(fh)
+        if existing != manifest:
+            raise ValueError(
+                'Checkpoint directory %r holds chunks of a run with different '
+                'inputs or parameters; use a new directory or remove it to '
+                'start over.' % checkpoint_dir)
+    else:
+        tmp = manifest_fp + '.tmp'
+        with open(tmp, 'w') as fh:
+            json.dump(manifest, fh)
+        os.replace(tmp, manifest_fp)
+
+
+def _completed_chunks(checkpoint_dir, n_chunks, suffix):
+    return sum(os.path.exists(_chunk_path(checkpoint_dir, index, suffix))
+               for index in range(n_chunks))
+
+
+def _score_checkpointed(counts, totals, conc, neg, decon_method,
+                        checkpoint_dir, chunk_size, progress=None):
+    """Score row chunks, persisting each and reusing those already saved.
+
+    Returns the scores and the number of chunks resumed from disk.
+    """
+    scores, resumed = [], 0
+    for index, (start, stop) in enumerate(
+            _feature_ranges(counts.shape[0], chunk_size)):
+        chunk_fp = _chunk_path(checkpoint_dir, index, '.npy')
+        if os.path.exists(chunk_fp):
+            chunk = np.load(chunk_fp)
+            resumed += 1
+        else:
+            chunk = _score_counts(counts[start:stop], totals, conc, neg,
+                                  decon_method)
+            tmp = chunk_fp + '.tmp'
+            with open(tmp, 'wb') as fh:
+                np.save(fh, chunk)
+            os.replace(tmp, chunk_fp)
+        scores.append(chunk)
+        if progress is not None:
+            progress(stop)
+    return np.concatenate(scores), resumed
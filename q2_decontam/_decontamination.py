@@ -10,11 +10,35 @@
 # ----------------------------------------------------------------------------
 
 import os
+import logging
+import collections
+import resource
 import tempfile
 import hashlib
 import subprocess
 from qiime2.plugin.util import transform
 from ._stats import DecontamScore, DecontamScoreDirFmt, DecontamScoreFormat
+from ._scoring import (_scoring_inputs, _score_chunks, _scores_frame,
+                       _combine_pvalues, _feature_matrix, _SCORE_COLUMNS)
+from ._parallel import _score_parallel
+from ._sharding import _score_sharded
+from ._checkpoint import (_checkpoint_chunk_size, _input_hash,
+                          _open_checkpoint, _completed_chunks,
+                          _score_checkpointed)
+from ._planner import (_parse_memory, _plan, _describe_plan,
+                       _R_WRITE_BLOCK_SAMPLES)
+from ._prefilter import (SCORED, _REMAINDER, _control_samples,
+                         _feature_counts, _prefilter_status,
+                         _profile_representatives, _merge_prefiltered)
+from ._grouping import _group_labels, _collapse_features, _expand_groups
+from ._presence import (_presence_inputs, _score_presence, _any_indicator,
+                        _control_type_scores)
+from ._mixing import _subtract_contaminants
+from ._kmers import KmerIndex, _attach_kmer_flags
+from ._report import (RunReport, _stage, _current_report, _update_report,
+                      _table_info, _rusage_peak_bytes)
+from ._progress import (_ProgressTracker, _ProgressFileWatcher,
+                        _progress_chunk_size, _feature_ranges)
 
 import biom
 import skbio
@@ -31,21 +55,29 @@ from q2_types.per_sample_sequences import (
     SingleLanePerSamplePairedEndFastqDirFmt)
 from q2_types.feature_table import FeatureTable, Frequency
 
+logger = logging.getLogger(__name__)
+
 
 def run_commands(cmds, verbose=True):
     if verbose:
-        print("Running external command line application(s). This may print "
-              "messages to stdout and/or stderr.")
-        print("The command(s) being run are below. These commands cannot "
-              "be manually re-run as they will depend on temporary files that "
-              "no longer exist.")
+        logger.info("Running external command line application(s). This may "
+                    "print messages to stdout and/or stderr. These commands "
+                    "cannot be manually re-run as they will depend on "
+                    "temporary files that no longer exist.")
     for cmd in cmds:
         if verbose:
-            print("\nCommand:", end=' ')
-            print(" ".join(cmd), end='\n\n')
+            logger.info("Command: %s", " ".join(cmd))
         subprocess.run(cmd, check=True)
 
 
+def _read_r_timings(timing_fp):
+    if not os.path.exists(timing_fp):
+        return {}
+    timings = pd.read_csv(timing_fp, sep='\t', index_col=0,
+                          dtype=str)['value']
+    return timings.to_dict()
+
+
 def _check_featureless_table(fp):
     with open(fp) as fh:
         # There is a header before the feature data
@@ -60,8 +92,9 @@ _WHOLE_NUM = (lambda x: x >= 0, 'non-negative')
 _PER_NUM = (lambda x: 1 >= x >= 0, 'between 0 and 1')
 _COL_STR = (lambda x: x in { 'column_name', 'column_number'},
              'sample_name or column_name or column_number')
-_DECON_METHOD_STR = (lambda x: x in {'frequency', 'prevalence', 'combined'},
-             'freqeuncy, prevalence, combined')
+_DECON_METHOD_STR = (lambda x: x in {'frequency', 'prevalence', 'combined',
+                                    'all', 'not-contaminant'},
+             'freqeuncy, prevalence, combined, all, not-contaminant')
 _BOOLEAN = (lambda x: type(x) is bool, 'True or False')
 # Better to choose to skip, than to implicitly ignore things that KeyError
 _SKIP = (lambda x: True, '')
@@ -92,38 +125,147 @@ def _filepath_to_sample(fp):
 # the bulk of the functionality to this helper util. Typechecking is assumed
 # to have occurred in the calling functions, this is primarily for making
 # sure that DADA2 is able to do what it needs to do.
-def _decontam_identify_helper(track_fp, decon_method):
+def _decontam_identify_helper(track_fp, decon_method, feature_ids=None):
 
     df = pd.read_csv(track_fp, sep='\t', index_col=0)
+    if feature_ids is not None:
+        # R writes one row per feature in input order
+        df.index = pd.Index(feature_ids)
     df.index.name = '#OTU ID'
     #removes last column containing true/false information from the dataframe
     df=df.drop(df.columns[[(len(df.columns)-1)]], axis=1)
+    df = df.drop(index=[_REMAINDER], errors='ignore')
+
+    return _finalize_scores(df, decon_method)
 
-    if(decon_method=='combined'):
+
+def _finalize_scores(df, decon_method):
+    if(decon_method in ('combined', 'all')):
         df = df.fillna(0)
 
     #removes all columns that are completely empty
-    temp_transposed_table = df.transpose()
-    temp_transposed_table = temp_transposed_table.dropna()
-    df = temp_transposed_table.transpose()
+    df = df.dropna(axis='columns', how='all')
 
-    metadata = transform(df, from_type=pd.DataFrame, to_type=DecontamScoreFormat)
+    return _label_method_columns(df, decon_method)
 
-    return metadata
 
-def decontam_identify(asv_or_otu_table: pd.DataFrame, meta_data: qiime2.Metadata, decon_method: str='prevalence',
-             freq_concentration_column: str = 'NULL',prev_control_or_exp_sample_column: str = 'NULL', prev_control_sample_indicator: str='NULL'
-                   ) -> (DecontamScoreFormat):
-    #_check_inputs(**locals())
+def _label_method_columns(df, decon_method):
+    """Add or rename the score columns specific to `decon_method`.
+
+    'all' names the combined p-value explicitly, next to p.freq and p.prev;
+    'not-contaminant' calls its prevalence test p.not. Either way `p` stays
+    the score remove and the visualizer use.
+    """
+    if decon_method == 'all':
+        df = df.copy()
+        df.insert(df.columns.get_loc('p'), 'p.combined', df['p'])
+    elif decon_method == 'not-contaminant':
+        df = df.rename(columns={'p.prev': 'p.not'})
+    return df
+
+
+# Score columns a method leaves empty, which _finalize_scores drops.
+_UNUSED_COLUMNS = {'prevalence': ['p.freq'], 'frequency': ['p.prev'],
+                   'not-contaminant': ['p.freq']}
+
+
+def _empty_scores(decon_method):
+    """Header-only score table with the columns `decon_method` produces."""
+    df = _scores_frame(np.empty((0, len(_SCORE_COLUMNS))), [])
+    df = df.drop(columns=_UNUSED_COLUMNS.get(decon_method, []))
+    return _label_method_columns(df, decon_method)
+
+
+def _start_checkpoint(checkpoint_dir, scoring_backend, asv_or_otu_table,
+                      metadata, decon_method, freq_concentration_column,
+                      prev_control_or_exp_sample_column,
+                      prev_control_sample_indicator, n_features, rows=None):
+    """Open `checkpoint_dir` for this run and return its chunk size.
+
+    `n_features` is the number of features the backend scores, `rows` the
+    table's features it was given (all of them when None).
+    """
+    chunk_size = _checkpoint_chunk_size(n_features)
+    params = {}
+    if rows is not None:
+        params['rows'] = hashlib.sha256(
+            np.asarray(rows, dtype=np.int64).tobytes()).hexdigest()
+    with _stage('hash_inputs'):
+        input_hash = _input_hash(
+            asv_or_otu_table, metadata, scoring_backend=scoring_backend,
+            decon_method=decon_method,
+            freq_concentration_column=freq_concentration_column,
+            prev_control_or_exp_sample_column=prev_control_or_exp_sample_column,
+            prev_control_sample_indicator=prev_control_sample_indicator,
+            **params)
+    _open_checkpoint(checkpoint_dir, input_hash, n_features, chunk_size)
+    return chunk_size
+
+
+def _write_r_table(asv_or_otu_table, fp, rows=None):
+    """Write the samples x features CSV run_decontam.R reads.
+
+    The table is transposed a block of samples at a time rather than as a
+    whole. With `rows` only those features are written, plus a remainder
+    feature holding the rest of every sample's reads so R normalizes by the
+    full table's totals. Returns the ids of the written features, in order.
+    """
+    feature_ids = asv_or_otu_table.index
+    if rows is not None:
+        feature_ids = feature_ids[rows].append(pd.Index([_REMAINDER]))
+        excluded = np.ones(asv_or_otu_table.shape[0], dtype=bool)
+        excluded[rows] = False
+    with open(fp, 'w') as fh:
+        for start, stop in _feature_ranges(asv_or_otu_table.shape[1],
+                                           _R_WRITE_BLOCK_SAMPLES):
+            block = asv_or_otu_table.iloc[:, start:stop]
+            values = block.to_numpy()
+            if rows is not None:
+                values = np.vstack([values[rows],
+                                    values[excluded].sum(axis=0)])
+            pd.DataFrame(values.T, index=block.columns,
+                         columns=feature_ids).to_csv(fh, header=start == 0)
+    return feature_ids
+
+
+def _score_with_r(asv_or_otu_table, meta_data, decon_method,
+                  freq_concentration_column, prev_control_or_exp_sample_column,
+                  prev_control_sample_indicator, chunk_size=None,
+                  checkpoint_dir=None, metadata_fp=None, rows=None):
+    if decon_method == 'not-contaminant':
+        raise ValueError("decon_method 'not-contaminant' is only implemented "
+                         "by scoring_backend='native'.")
+    # the scored rows and, with rows, the remainder feature
+    n_features = (asv_or_otu_table.shape[0] if rows is None
+                  else len(rows) + 1)
+    if checkpoint_dir is not None:
+        chunk_size = _start_checkpoint(
+            checkpoint_dir, 'r', asv_or_otu_table, meta_data.to_dataframe(),
+            decon_method, freq_concentration_column,
+            prev_control_or_exp_sample_column, prev_control_sample_indicator,
+            n_features, rows)
+        n_chunks = -(-n_features // chunk_size)
+        _update_report(checkpoint_chunks_resumed=_completed_chunks(
+            checkpoint_dir, n_chunks, '.tsv'))
+    elif chunk_size is None:
+        chunk_size = _progress_chunk_size(n_features)
     with tempfile.TemporaryDirectory() as temp_dir_name:
         track_fp = os.path.join(temp_dir_name,'track.tsv')
+        timing_fp = os.path.join(temp_dir_name, 'timing.tsv')
+        progress_fp = os.path.join(temp_dir_name, 'progress.tsv')
         ASV_dest = os.path.join(temp_dir_name,'temp_ASV_table.csv')
-        transposed_table =  asv_or_otu_table.transpose()
-        transposed_table.to_csv(os.path.join(ASV_dest))
+        with _stage('write_table'):
+            feature_ids = _write_r_table(asv_or_otu_table, ASV_dest, rows)
 
-        metadata = meta_data.to_dataframe()
-        meta_dest = os.path.join(temp_dir_name,'temp_metadata.csv')
-        metadata.to_csv(os.path.join(meta_dest))
+        if metadata_fp is not None:
+            # already written once for a whole batch of tables
+            meta_dest = metadata_fp
+        else:
+            meta_dest = os.path.join(temp_dir_name,'temp_metadata.csv')
+            with _stage('write_metadata'):
+                metadata = meta_data.to_dataframe()
+                metadata.to_csv(os.path.join(meta_dest))
+                del metadata
 
         cmd = ['run_decontam.R',
                    '--asv_table_path', str(ASV_dest),
@@ -133,9 +275,22 @@ def decontam_identify(asv_or_otu_table: pd.DataFrame, meta_data: qiime2.Metadata
                    '--meta_table_path', str(meta_dest),
                    '--freq_con_column', str(freq_concentration_column),
                    '--prev_control_or_exp_sample_column', str(prev_control_or_exp_sample_column),
-                   '--prev_control_sample_indicator', str(prev_control_sample_indicator)]
+                   '--prev_control_sample_indicator', str(prev_control_sample_indicator),
+                   '--timing_path', timing_fp,
+                   '--progress_path', progress_fp,
+                   '--chunk_size', str(chunk_size)]
+        report = _current_report()
+        rprof_fp = None if report is None else report.rprof_path
+        if rprof_fp is not None:
+            cmd += ['--rprof_path', rprof_fp]
+        if checkpoint_dir is not None:
+            cmd += ['--checkpoint_dir', os.path.abspath(checkpoint_dir)]
+        tracker = _ProgressTracker('decontam_identify', n_features)
+        watcher = _ProgressFileWatcher(progress_fp, tracker)
+        watcher.start()
         try:
-            run_commands([cmd])
+            with _stage('run_decontam.R'):
+                run_commands([cmd])
         except subprocess.CalledProcessError as e:
             if e.returncode == 2:
                 raise ValueError(
@@ -144,21 +299,410 @@ def decontam_identify(asv_or_otu_table: pd.DataFrame, meta_data: qiime2.Metadata
                 raise Exception("An error was encountered while running Decontam"
                                     " in R (return code %d), please inspect stdout"
                                     " and stderr to learn more." % e.returncode)
-        return _decontam_identify_helper(track_fp, decon_method)
+        finally:
+            watcher.stop()
+        _record_r_timings(_read_r_timings(timing_fp))
+        if rprof_fp is not None:
+            report.add_rprof(rprof_fp)
+        with _stage('parse_track'):
+            return _decontam_identify_helper(track_fp, decon_method,
+                                             feature_ids)
+
+
+def _record_r_timings(timings):
+    report = _current_report()
+    if report is None:
+        return
+    r_version = timings.pop('r_version', None)
+    for name, seconds in timings.items():
+        report.add_stage(name, float(seconds))
+    report.update(r_version=r_version,
+                  r_peak_rss_mb=_rusage_peak_bytes(
+                      resource.RUSAGE_CHILDREN) / 1e6)
+
+
+# Methods that only need presence/absence, scored from a bit-packed matrix
+# unless the run is checkpointed, sharded or spread over processes.
+_PRESENCE_METHODS = {'prevalence', 'not-contaminant'}
+
+
+def _score_with_native(asv_or_otu_table, meta_data, decon_method,
+                       freq_concentration_column,
+                       prev_control_or_exp_sample_column,
+                       prev_control_sample_indicator, chunk_size=None,
+                       n_jobs=1, shard_dir=None, shard_workers=0,
+                       checkpoint_dir=None, block_rows=None,
+                       metadata=None, rows=None, control_indicators=None):
+    """Score the features of a table, or only `rows` of them.
+
+    Features left out by `rows` still count towards the sample totals.
+    """
+    if metadata is None:
+        metadata = meta_data.to_dataframe()
+    if rows is None:
+        feature_ids = asv_or_otu_table.index
+    else:
+        feature_ids = asv_or_otu_table.index[rows]
+    if control_indicators is not None:
+        with _stage('pack_presence'):
+            presence, freq, _ = _presence_inputs(
+                asv_or_otu_table, metadata, decon_method,
+                prev_control_or_exp_sample_column,
+                prev_control_sample_indicator, block_rows=block_rows,
+                rows=rows)
+            _update_report(presence_bytes=presence.nbytes)
+        with _stage('score_control_types'):
+            return _control_type_scores(presence, freq, metadata,
+                                        prev_control_or_exp_sample_column,
+                                        control_indicators)
+    if checkpoint_dir is not None:
+        chunk_size = _start_checkpoint(
+            checkpoint_dir, 'native', asv_or_otu_table, metadata,
+            decon_method, freq_concentration_column,
+            prev_control_or_exp_sample_column, prev_control_sample_indicator,
+            len(feature_ids), rows)
+    elif chunk_size is None:
+        chunk_size = _progress_chunk_size(len(feature_ids))
+    tracker = _ProgressTracker('decontam_identify', len(feature_ids))
+    if (decon_method in _PRESENCE_METHODS and checkpoint_dir is None
+            and shard_dir is None and n_jobs <= 1):
+        with _stage('pack_presence'):
+            presence, freq, neg = _presence_inputs(
+                asv_or_otu_table, metadata, decon_method,
+                prev_control_or_exp_sample_column,
+                prev_control_sample_indicator, block_rows=block_rows,
+                rows=rows)
+            _update_report(presence_bytes=presence.nbytes)
+        with _stage('score_presence'):
+            scores = _score_presence(presence, neg, freq, decon_method)
+            tracker.update(len(feature_ids))
+        df = _scores_frame(scores, feature_ids)
+        return _finalize_scores(df, decon_method)
+    with _stage('prepare_inputs'):
+        counts, totals, conc, neg = _scoring_inputs(
+            asv_or_otu_table, metadata, decon_method,
+            freq_concentration_column, prev_control_or_exp_sample_column,
+            prev_control_sample_indicator, block_rows=block_rows,
+            stream=shard_dir is not None, rows=rows)
+    with _stage('score_native'):
+        if checkpoint_dir is not None:
+            scores, resumed = _score_checkpointed(
+                counts, totals, conc, neg, decon_method, checkpoint_dir,
+                chunk_size, progress=tracker.update)
+            _update_report(checkpoint_chunks_resumed=resumed)
+        elif shard_dir is not None:
+            scores = _score_sharded(counts, totals, conc, neg, decon_method,
+                                    shard_dir, local_workers=shard_workers,
+                                    progress=tracker.update)
+        elif n_jobs > 1:
+            scores = _score_parallel(counts, totals, conc, neg, decon_method,
+                                     n_jobs, progress=tracker.update)
+        else:
+            scores = _score_chunks(counts, totals, conc, neg, decon_method,
+                                   chunk_size, progress=tracker.update)
+        df = _scores_frame(scores, feature_ids)
+        return _finalize_scores(df, decon_method)
+
+
+_SCORING_BACKENDS = {
+    'r': _score_with_r,
+    'native': _score_with_native,
+}
+
+
+def _score_prefiltered(score_backend, asv_or_otu_table, meta_data,
+                       decon_method, freq_concentration_column,
+                       prev_control_or_exp_sample_column,
+                       prev_control_sample_indicator, min_prevalence=0,
+                       min_reads=0, exclude_control_only=False,
+                       **backend_kwargs):
+    """Score the features that pass the prefilter, then reinsert the rest.
+
+    The prefilter only runs when one of its options is set. Excluded
+    features are labelled in a `status` column, which is only added when at
+    least one feature was excluded. Of features sharing an identical count
+    profile only the first is scored; the others get its scores. Both read
+    the table in the backend's `block_rows`, where it has them.
+    """
+    n_features = asv_or_otu_table.shape[0]
+    block_rows = backend_kwargs.get('block_rows')
+    status = None
+    if min_prevalence > 0 or min_reads > 0 or exclude_control_only:
+        with _stage('prefilter'):
+            neg = None
+            if exclude_control_only:
+                neg = _control_samples(meta_data.to_dataframe(),
+                                       asv_or_otu_table.columns,
+                                       prev_control_or_exp_sample_column,
+                                       prev_control_sample_indicator)
+            counts = _feature_counts(asv_or_otu_table, neg, block_rows)
+            status = _prefilter_status(counts, min_prevalence, min_reads)
+            _update_report(prefilter=dict(collections.Counter(status)))
+    scored = (np.ones(n_features, dtype=bool) if status is None
+              else status == SCORED)
+    with _stage('deduplicate'):
+        # identical profiles get the same status, so every scored feature's
+        # representative is scored too
+        representative = _profile_representatives(asv_or_otu_table,
+                                                  block_rows)
+        keep = scored & (representative == np.arange(n_features))
+        n_scored, n_unique = int(scored.sum()), int(keep.sum())
+        _update_report(dedup={'features': n_scored, 'profiles': n_unique,
+                              'ratio': n_scored / max(n_unique, 1)})
+        if n_unique < n_scored:
+            logger.info('Scoring %d unique profiles for %d features '
+                        '(dedup ratio %.2f)', n_unique, n_scored,
+                        n_scored / n_unique)
+    if n_scored > 0:
+        if not keep.all():
+            backend_kwargs['rows'] = np.flatnonzero(keep)
+        df = score_backend(asv_or_otu_table, meta_data, decon_method,
+                           freq_concentration_column,
+                           prev_control_or_exp_sample_column,
+                           prev_control_sample_indicator, **backend_kwargs)
+        if n_unique < n_scored:
+            # rows of df follow the kept features; fan them out by position
+            df = df.iloc[np.searchsorted(np.flatnonzero(keep),
+                                         representative[scored])]
+            df.index = pd.Index(asv_or_otu_table.index[scored],
+                                name='#OTU ID')
+    else:
+        df = _empty_scores(decon_method)
+    if status is None:
+        return df
+    return _merge_prefiltered(df, asv_or_otu_table.index, counts, status)
+
+
+def decontam_identify(asv_or_otu_table: pd.DataFrame, meta_data: qiime2.Metadata, decon_method: str='prevalence',
+             freq_concentration_column: str = 'NULL',prev_control_or_exp_sample_column: str = 'NULL', prev_control_sample_indicator: str='NULL',
+             scoring_backend: str = 'r', n_jobs: int = 1,
+             shard_dir: str = None, shard_workers: int = 0,
+             checkpoint_dir: str = None, max_memory: str = None,
+             dry_run: bool = False, min_prevalence: int = 0,
+             min_reads: int = 0, exclude_control_only: bool = False,
+             feature_groups: qiime2.CategoricalMetadataColumn = None,
+             prev_control_sample_indicators: list = None,
+             representative_sequences: DNAIterator = None,
+             contaminant_index: KmerIndex = None,
+             kmer_min_fraction: float = 0.5
+             ) -> (DecontamScoreFormat):
+    #_check_inputs(**locals())
+    if (representative_sequences is None) != (contaminant_index is None):
+        raise ValueError('Prior contaminant flags need both '
+                         'representative_sequences and contaminant_index.')
+    backend_kwargs = {}
+    if prev_control_sample_indicators:
+        if prev_control_sample_indicator != 'NULL':
+            raise ValueError('Give either prev_control_sample_indicator or '
+                             'prev_control_sample_indicators, not both.')
+        if decon_method != 'prevalence' or scoring_backend != 'native':
+            raise ValueError("prev_control_sample_indicators requires "
+                             "decon_method='prevalence' and "
+                             "scoring_backend='native'.")
+        if n_jobs > 1 or shard_dir is not None or checkpoint_dir is not None:
+            raise ValueError('prev_control_sample_indicators cannot be '
+                             'combined with n_jobs greater than 1, '
+                             'shard_dir or checkpoint_dir.')
+        # every control type is a control for the prefilter and the checks
+        prev_control_sample_indicator = _any_indicator(
+            prev_control_sample_indicators)
+        backend_kwargs['control_indicators'] = list(
+            prev_control_sample_indicators)
+    if n_jobs > 1:
+        if scoring_backend != 'native':
+            raise ValueError("n_jobs greater than 1 requires "
+                             "scoring_backend='native'.")
+        backend_kwargs['n_jobs'] = n_jobs
+    if shard_dir is not None:
+        if scoring_backend != 'native':
+            raise ValueError("shard_dir requires scoring_backend='native'.")
+        if n_jobs > 1:
+            raise ValueError("Sharded runs are scaled with shard_workers "
+                             "(and remote workers), not n_jobs.")
+        backend_kwargs.update(shard_dir=shard_dir,
+                              shard_workers=shard_workers)
+    elif shard_workers > 0:
+        raise ValueError("shard_workers requires a shard_dir.")
+    if checkpoint_dir is not None:
+        if n_jobs > 1 or shard_dir is not None:
+            raise ValueError("checkpoint_dir cannot be combined with n_jobs "
+                             "greater than 1 or with shard_dir.")
+        backend_kwargs['checkpoint_dir'] = checkpoint_dir
+    planned = max_memory is not None or dry_run
+    if planned and (n_jobs > 1 or shard_dir is not None):
+        raise ValueError("max_memory and dry_run plan single-process runs; "
+                         "they cannot be combined with n_jobs greater than 1 "
+                         "or with shard_dir.")
+    budget_bytes = None if max_memory is None else _parse_memory(max_memory)
+    with RunReport('decontam_identify', decon_method=decon_method,
+                   scoring_backend=scoring_backend, n_jobs=n_jobs,
+                   sharded=shard_dir is not None,
+                   matrix=_table_info(asv_or_otu_table)) as report:
+        if planned:
+            with report.stage('plan'):
+                plan = _plan(asv_or_otu_table, scoring_backend, budget_bytes,
+                             chunk_size=_checkpoint_chunk_size(
+                                 asv_or_otu_table.shape[0])
+                             if checkpoint_dir is not None else None)
+            report.update(plan=plan._asdict(), dry_run=dry_run)
+            if dry_run:
+                logger.info('%s', _describe_plan(plan))
+                return transform(_empty_scores(decon_method),
+                                 from_type=pd.DataFrame,
+                                 to_type=DecontamScoreFormat)
+            if checkpoint_dir is None:
+                backend_kwargs['chunk_size'] = plan.chunk_size
+            if plan.handling == 'sparse':
+                backend_kwargs['block_rows'] = plan.block_rows
+        score_table = asv_or_otu_table
+        if feature_groups is not None:
+            with report.stage('collapse_groups'):
+                labels = _group_labels(asv_or_otu_table.index,
+                                       feature_groups.to_series())
+                score_table = _collapse_features(asv_or_otu_table, labels)
+            report.update(groups=score_table.shape[0])
+        df = _score_prefiltered(_SCORING_BACKENDS[scoring_backend],
+                                score_table, meta_data, decon_method,
+                                freq_concentration_column,
+                                prev_control_or_exp_sample_column,
+                                prev_control_sample_indicator,
+                                min_prevalence, min_reads,
+                                exclude_control_only, **backend_kwargs)
+        if feature_groups is not None:
+            with report.stage('expand_groups'):
+                df = _expand_groups(df, labels)
+        if contaminant_index is not None:
+            with report.stage('kmer_lookup'):
+                df = _attach_kmer_flags(df, contaminant_index,
+                                        representative_sequences,
+                                        kmer_min_fraction)
+            report.update(prior_contaminants=int(
+                df['prior_contaminant'].sum()))
+        with report.stage('transform'):
+            return transform(df, from_type=pd.DataFrame,
+                             to_type=DecontamScoreFormat)
+
+def _untested_as_missing(pvalues):
+    """p-values with the tests that were not run back as NaN.
+
+    _finalize_scores writes a test that could not be run (e.g. p.freq of a
+    feature in fewer than two true samples) as 0 in combined and 'all'
+    tables; a test that ran does not come out as exactly 0.
+    """
+    pvalues = pvalues.to_numpy(dtype=float, copy=True)
+    pvalues[pvalues == 0] = np.nan
+    return pvalues
+
+
+def decontam_recombine(decon_identify_table: pd.DataFrame,
+                       combination: str = 'combined'
+                       ) -> (DecontamScoreFormat):
+    """Recompute p from the p.freq and p.prev of an existing score table."""
+    with RunReport('decontam_recombine', combination=combination,
+                   features=len(decon_identify_table)) as report:
+        missing = [column for column in ['p.freq', 'p.prev']
+                   if column not in decon_identify_table.columns]
+        if missing:
+            raise ValueError('Recombining needs both p.freq and p.prev, but '
+                             'the score table has no %s column. Score with '
+                             "decon_method 'combined' or 'all'."
+                             % ' or '.join(missing))
+        with report.stage('combine'):
+            df = decon_identify_table.copy()
+            p_freq = _untested_as_missing(df['p.freq'])
+            p_prev = _untested_as_missing(df['p.prev'])
+            p = _combine_pvalues(p_freq, p_prev, combination)
+            if combination == 'combined':
+                # as identify reports it
+                p = np.nan_to_num(p, nan=0)
+            df['p'] = p
+            df.index.name = '#OTU ID'
+        report.update(untested=int((np.isnan(p_freq)
+                                    | np.isnan(p_prev)).sum()))
+        with report.stage('transform'):
+            return transform(df, from_type=pd.DataFrame,
+                             to_type=DecontamScoreFormat)
+
+
+_REMOVAL_MODES = ['remove', 'subtract']
+# Features converted to sparse at a time when subtracting reads.
+_REMOVE_BLOCK_ROWS = 4096
+
 
 def decontam_remove(decon_identify_table: qiime2.Metadata, asv_or_otu_table: pd.DataFrame, threshold: float=0.1,
+                   removal_mode: str='remove', meta_data: qiime2.Metadata=None,
+                   prev_control_or_exp_sample_column: str='NULL',
+                   prev_control_sample_indicator: str='NULL'
                    ) -> (biom.Table):
-    with tempfile.TemporaryDirectory() as temp_dir_name:
-        df = decon_identify_table.to_dataframe()
-        df.loc[(df['p'].astype(float) <= threshold), 'contaminant_seq'] = 'True'
-        df.loc[(df['p'].astype(float) > threshold), 'contaminant_seq'] = 'False'
-        df = df[df.contaminant_seq == 'True']
-        remove_these = df.index
-        for bad_seq in list(remove_these):
-            asv_or_otu_table = asv_or_otu_table[asv_or_otu_table.index != bad_seq]
+    if removal_mode not in _REMOVAL_MODES:
+        raise ValueError('Unknown removal mode %r, expected one of %s.'
+                         % (removal_mode, ', '.join(_REMOVAL_MODES)))
+    if removal_mode == 'subtract':
+        return _subtract_remove(decon_identify_table, asv_or_otu_table,
+                                threshold, meta_data,
+                                prev_control_or_exp_sample_column,
+                                prev_control_sample_indicator)
+    with RunReport('decontam_remove', threshold=threshold,
+                   matrix=_table_info(asv_or_otu_table)) as report, \
+            tempfile.TemporaryDirectory() as temp_dir_name:
+        with report.stage('select_contaminants'):
+            df = decon_identify_table.to_dataframe()
+            df.loc[(df['p'].astype(float) <= threshold), 'contaminant_seq'] = 'True'
+            df.loc[(df['p'].astype(float) > threshold), 'contaminant_seq'] = 'False'
+            df = df[df.contaminant_seq == 'True']
+            remove_these = df.index
+        with report.stage('filter_table'):
+            for bad_seq in list(remove_these):
+                asv_or_otu_table = asv_or_otu_table[asv_or_otu_table.index != bad_seq]
+        report.update(features_removed=len(remove_these))
         output = os.path.join(temp_dir_name, 'temp.tsv.biom')
-        temp_transposed_table = asv_or_otu_table.transpose()
-        temp_transposed_table.to_csv(output, sep="\t")
-        with open(output) as fh:
-            no_contam_table = biom.Table.from_tsv(fh, None, None, None)
-        return no_contam_table
\ No newline at end of file
+        with report.stage('write_table'):
+            temp_transposed_table = asv_or_otu_table.transpose()
+            temp_transposed_table.to_csv(output, sep="\t")
+        with report.stage('parse_biom'):
+            with open(output) as fh:
+                no_contam_table = biom.Table.from_tsv(fh, None, None, None)
+        return no_contam_table
+
+
+def _subtract_remove(decon_identify_table, asv_or_otu_table, threshold,
+                     meta_data, prev_control_or_exp_sample_column,
+                     prev_control_sample_indicator):
+    """decontam_remove's 'subtract' mode.
+
+    Contaminant features are kept, but every sample loses the reads its
+    estimated control fraction accounts for, so true signal shared with the
+    controls survives.
+    """
+    if meta_data is None or 'NULL' in (prev_control_or_exp_sample_column,
+                                       prev_control_sample_indicator):
+        raise ValueError("removal_mode 'subtract' needs meta_data, "
+                         "prev_control_or_exp_sample_column and "
+                         "prev_control_sample_indicator to locate the "
+                         "negative controls.")
+    with RunReport('decontam_remove', threshold=threshold,
+                   removal_mode='subtract',
+                   matrix=_table_info(asv_or_otu_table)) as report:
+        with report.stage('select_contaminants'):
+            p = decon_identify_table.to_dataframe()['p'].astype(float)
+            candidates = p.reindex(asv_or_otu_table.index) <= threshold
+            candidates = candidates.to_numpy(dtype=bool)
+            neg = _control_samples(meta_data.to_dataframe(),
+                                   asv_or_otu_table.columns,
+                                   prev_control_or_exp_sample_column,
+                                   prev_control_sample_indicator)
+        if not neg.any() or neg.all():
+            raise ValueError('Indicator %r must match some, but not all, of '
+                             'the samples in column %r.'
+                             % (prev_control_sample_indicator,
+                                prev_control_or_exp_sample_column))
+        with report.stage('subtract'):
+            counts = _feature_matrix(asv_or_otu_table,
+                                     block_rows=_REMOVE_BLOCK_ROWS)
+            counts, subtracted = _subtract_contaminants(counts, candidates,
+                                                        neg)
+        report.update(features_subtracted=int(candidates.sum()),
+                      reads_subtracted=float(subtracted))
+        # same orientation as the 'remove' output: samples as observations
+        return biom.Table(counts.T, observation_ids=asv_or_otu_table.columns,
+                          sample_ids=asv_or_otu_table.index)
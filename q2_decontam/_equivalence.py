@@ -0,0 +1,208 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2016-2022, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+"""Differential equivalence harness for the decontam_identify backends.
+
+Generates randomized tables and metadata, scores them with every available
+backend and reports, per score column, the worst disagreement with the
+reference backend (run_decontam.R when it is installed) alongside the
+timing ratio. Run it with ``python -m q2_decontam._equivalence``.
+"""
+
+import sys
+import time
+import shutil
+import argparse
+
+import numpy as np
+import pandas as pd
+import qiime2
+
+from ._decontamination import _SCORING_BACKENDS
+from ._scoring import _SCORE_COLUMNS
+
+
+# Largest absolute difference from the reference that still counts as
+# agreement; p-values go through different F/hypergeometric implementations.
+_TOLERANCES = {
+    'freq': 1e-9,
+    'prev': 0,
+    'p.freq': 1e-6,
+    'p.prev': 1e-6,
+    'p': 1e-6,
+}
+
+_CONTROL_COLUMN = 'Sample_or_Control'
+_CONTROL_INDICATOR = 'Control'
+_CONCENTRATION_COLUMN = 'quant_reading'
+
+_METHOD_PARAMS = {
+    'frequency': {'freq_concentration_column': _CONCENTRATION_COLUMN},
+    'prevalence': {
+        'prev_control_or_exp_sample_column': _CONTROL_COLUMN,
+        'prev_control_sample_indicator': _CONTROL_INDICATOR},
+    'combined': {
+        'freq_concentration_column': _CONCENTRATION_COLUMN,
+        'prev_control_or_exp_sample_column': _CONTROL_COLUMN,
+        'prev_control_sample_indicator': _CONTROL_INDICATOR},
+}
+_METHOD_PARAMS['all'] = _METHOD_PARAMS['combined']
+
+
+def _available_backends():
+    backends = dict(_SCORING_BACKENDS)
+    if shutil.which('run_decontam.R') is None:
+        del backends['r']
+    return backends
+
+
+def _random_inputs(n_features, n_samples, n_controls, seed=None):
+    """Random features x samples table and matching sample metadata.
+
+    About a fifth of the features behave like contaminants: their expected
+    abundance is inversely proportional to sample concentration and they
+    are enriched in the control samples.
+    """
+    rng = np.random.default_rng(seed)
+    conc = rng.uniform(1, 100, n_samples)
+    is_control = np.zeros(n_samples, dtype=bool)
+    is_control[rng.choice(n_samples, n_controls, replace=False)] = True
+
+    base = rng.lognormal(2, 1.5, n_features)
+    contaminant = rng.random(n_features) < 0.2
+    scale = np.where(contaminant[:, None], 20 / conc[None, :], 1.0)
+    scale[:, is_control] *= np.where(contaminant, 5.0, 0.2)[:, None]
+    density = rng.uniform(0.05, 0.6, n_features)[:, None]
+    present = rng.random((n_features, n_samples)) < density
+    # sparse features end up in one sample or none, which decontam leaves
+    # untested
+    counts = rng.poisson(base[:, None] * scale * present)
+
+    sample_ids = ['S%d' % i for i in range(n_samples)]
+    table = pd.DataFrame(counts, index=['F%d' % i for i in range(n_features)],
+                         columns=sample_ids)
+    metadata = pd.DataFrame(
+        {_CONTROL_COLUMN: np.where(is_control, 'Control Sample',
+                                   'True Sample'),
+         _CONCENTRATION_COLUMN: conc},
+        index=pd.Index(sample_ids, name='sampleid'))
+    return table, qiime2.Metadata(metadata)
+
+
+def _worst_disagreement(reference, observed, column):
+    if column not in reference.columns or column not in observed.columns:
+        if column in reference.columns or column in observed.columns:
+            return np.inf, None
+        return 0.0, None
+    ref = reference[column].astype(float)
+    obs = observed[column].astype(float).reindex(ref.index)
+    diff = (obs - ref).abs()
+    diff[ref.isna() & obs.isna()] = 0.0
+    diff[ref.isna() != obs.isna()] = np.inf
+    if diff.empty:
+        return 0.0, None
+    worst = diff.idxmax()
+    return float(diff[worst]), worst
+
+
+def compare_backends(table, meta_data, decon_method, backends=None,
+                     reference=None):
+    """Score one table with each backend and compare against the reference.
+
+    Returns one row per (backend, score column) with the largest absolute
+    difference, the feature where it occurred, whether it is within
+    tolerance, and the backend's runtime relative to the reference.
+    """
+    if backends is None:
+        backends = _available_backends()
+    if reference is None:
+        reference = 'r' if 'r' in backends else next(iter(backends))
+
+    scores, seconds = {}, {}
+    for name, score_backend in backends.items():
+        start = time.perf_counter()
+        scores[name] = score_backend(table, meta_data, decon_method,
+                                     **_method_params(decon_method))
+        seconds[name] = time.perf_counter() - start
+
+    rows = []
+    for name in backends:
+        for column in _SCORE_COLUMNS:
+            worst, feature = _worst_disagreement(scores[reference],
+                                                 scores[name], column)
+            rows.append({
+                'decon_method': decon_method,
+                'backend': name,
+                'reference': reference,
+                'column': column,
+                'max_abs_diff': worst,
+                'worst_feature': feature,
+                'within_tolerance': worst <= _TOLERANCES[column],
+                'seconds': seconds[name],
+                'time_ratio': seconds[name] / seconds[reference],
+            })
+    return pd.DataFrame(rows)
+
+
+def _method_params(decon_method):
+    params = {'freq_concentration_column': 'NULL',
+              'prev_control_or_exp_sample_column': 'NULL',
+              'prev_control_sample_indicator': 'NULL'}
+    params.update(_METHOD_PARAMS[decon_method])
+    return params
+
+
+def run_harness(n_trials=5, n_features=300, n_samples=80, n_controls=12,
+                decon_methods=tuple(_METHOD_PARAMS), backends=None,
+                reference=None, seed=0):
+    """Compare backends over `n_trials` randomized inputs per method."""
+    seeds = np.random.SeedSequence(seed).generate_state(n_trials)
+    reports = []
+    for trial, trial_seed in enumerate(seeds):
+        table, meta_data = _random_inputs(n_features, n_samples, n_controls,
+                                          seed=int(trial_seed))
+        for decon_method in decon_methods:
+            report = compare_backends(table, meta_data, decon_method,
+                                      backends=backends, reference=reference)
+            report.insert(0, 'trial', trial)
+            reports.append(report)
+    return pd.concat(reports, ignore_index=True)
+
+
+def summarize(report):
+    """Worst disagreement and median timing ratio per method/backend/column."""
+    grouped = report.groupby(['decon_method', 'backend', 'column'], sort=False)
+    summary = grouped.agg(max_abs_diff=('max_abs_diff', 'max'),
+                          within_tolerance=('within_tolerance', 'all'),
+                          time_ratio=('time_ratio', 'median'))
+    worst = report.loc[grouped['max_abs_diff'].idxmax(),
+                       ['decon_method', 'backend', 'column', 'trial',
+                        'worst_feature']]
+    return summary.join(worst.set_index(['decon_method', 'backend',
+                                         'column']))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--trials', type=int, default=5)
+    parser.add_argument('--features', type=int, default=300)
+    parser.add_argument('--samples', type=int, default=80)
+    parser.add_argument('--controls', type=int, default=12)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    report = run_harness(n_trials=args.trials, n_features=args.features,
+                         n_samples=args.samples, n_controls=args.controls,
+                         seed=args.seed)
+    summary = summarize(report)
+    print(summary.to_string())
+    return 0 if summary['within_tolerance'].all() else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,46 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2016-2022, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import numpy as np
+import pandas as pd
+import scipy.sparse
+
+
+def _group_labels(feature_ids, groups):
+    """Group of every feature, from a Series indexed by feature id."""
+    labels = groups.reindex(feature_ids)
+    missing = labels.index[labels.isna()]
+    if len(missing) > 0:
+        raise ValueError('feature_groups has no group for %d of the features '
+                         'in the table, e.g. %r.' % (len(missing), missing[0]))
+    return labels.astype(str)
+
+
+def _collapse_features(table, labels):
+    """Sum the rows of a features x samples table per group.
+
+    The sum is a sparse (groups x features) indicator matrix times the
+    sparse count matrix, so it costs O(nnz) whatever the number of groups.
+    """
+    codes, groups = pd.factorize(labels.to_numpy())
+    n_features = table.shape[0]
+    indicator = scipy.sparse.csr_matrix(
+        (np.ones(n_features), (codes, np.arange(n_features))),
+        shape=(len(groups), n_features))
+    counts = indicator @ scipy.sparse.csr_matrix(table.to_numpy(dtype=float))
+    return pd.DataFrame(counts.toarray(),
+                        index=pd.Index(groups, name=table.index.name),
+                        columns=table.columns)
+
+
+def _expand_groups(scores, labels):
+    """Give every feature the scores of its group, plus a `group` column."""
+    df = scores.reindex(labels.to_numpy())
+    df.index = pd.Index(labels.index, name=scores.index.name)
+    df['group'] = labels.to_numpy()
+    return df
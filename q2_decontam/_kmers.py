@@ -0,0 +1,184 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2016-2022, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import numpy as np
+import pandas as pd
+from q2_types.feature_data import DNAIterator
+
+from ._progress import _feature_ranges
+from ._report import RunReport
+
+# Sequences k-merized at a time, bounding the per-base working arrays.
+_SEQUENCE_BLOCK = 10000
+# 2 bits per base, so a k-mer fits a uint64 up to this length.
+_MAX_KMER_SIZE = 32
+
+# 2-bit code of every byte: A, C, G, T (either case) are 0-3, anything else,
+# including the separator between sequences, breaks a k-mer.
+_INVALID = 4
+_BASE_CODES = np.full(256, _INVALID, dtype=np.uint8)
+for _code, _bases in enumerate(['Aa', 'Cc', 'Gg', 'Tt']):
+    for _base in _bases:
+        _BASE_CODES[ord(_base)] = _code
+
+
+def _canonical_kmers(sequences, k):
+    """Canonical k-mers of every sequence, as (kmers, owner) arrays.
+
+    All sequences are joined into one code array so every k-mer is computed
+    by k vectorized shifts over it rather than per sequence. A k-mer and its
+    reverse complement encode to the same (smaller) value, so hits do not
+    depend on orientation. Windows holding a non-ACGT base are dropped.
+    """
+    lengths = np.array([len(sequence) + 1 for sequence in sequences])
+    joined = ''.join(sequence + '-' for sequence in sequences)
+    codes = _BASE_CODES[np.frombuffer(joined.encode('ascii'),
+                                      dtype=np.uint8)]
+    n_windows = len(codes) - k + 1
+    if n_windows <= 0:
+        return np.empty(0, dtype=np.uint64), np.empty(0, dtype=np.int64)
+    forward = np.zeros(n_windows, dtype=np.uint64)
+    reverse = np.zeros(n_windows, dtype=np.uint64)
+    wide = codes.astype(np.uint64)
+    for j in range(k):
+        forward = (forward << np.uint64(2)) | wide[j:j + n_windows]
+        # complement of base j lands at position j of the reversed k-mer
+        reverse |= (np.uint64(3) - np.minimum(wide[j:j + n_windows], 3)) \
+            << np.uint64(2 * j)
+    invalid = np.concatenate([[0], np.cumsum(codes == _INVALID)])
+    valid = (invalid[k:] - invalid[:-k]) == 0
+    owner = np.repeat(np.arange(len(sequences)), lengths)[:n_windows]
+    return np.minimum(forward, reverse)[valid], owner[valid]
+
+
+def _distinct_pairs(kmers, owner):
+    """(kmers, owner) with duplicate k-mers of one owner removed."""
+    order = np.lexsort((kmers, owner))
+    kmers, owner = kmers[order], owner[order]
+    keep = np.ones(len(kmers), dtype=bool)
+    keep[1:] = (kmers[1:] != kmers[:-1]) | (owner[1:] != owner[:-1])
+    return kmers[keep], owner[keep]
+
+
+def _sequence_strings(sequences):
+    """Ids and strings of an iterable of skbio sequences."""
+    ids, strings = [], []
+    for sequence in sequences:
+        ids.append(sequence.metadata['id'])
+        strings.append(str(sequence))
+    return ids, strings
+
+
+class KmerIndex:
+    """Sorted canonical k-mers of a set of reference contaminant sequences.
+
+    Each k-mer keeps the first reference (in input order) it was seen in.
+    Lookups are one binary search per query k-mer, so matching 100k+
+    features is a handful of vectorized passes rather than an alignment.
+    """
+
+    def __init__(self, kmers, references, reference_ids, k):
+        self.kmers = kmers
+        self.references = references
+        self.reference_ids = pd.Index(reference_ids)
+        self.k = int(k)
+
+    @classmethod
+    def from_sequences(cls, reference_ids, sequences, k):
+        if not 1 <= k <= _MAX_KMER_SIZE:
+            raise ValueError('kmer_size must be between 1 and %d, not %d.'
+                             % (_MAX_KMER_SIZE, k))
+        kmers, owner = _canonical_kmers(sequences, k)
+        order = np.lexsort((owner, kmers))
+        kmers, owner = kmers[order], owner[order]
+        first = np.ones(len(kmers), dtype=bool)
+        first[1:] = kmers[1:] != kmers[:-1]
+        return cls(kmers[first], owner[first].astype(np.int32),
+                   reference_ids, k)
+
+    def __len__(self):
+        return len(self.kmers)
+
+    def lookup(self, feature_ids, sequences, block_size=None):
+        """Share of each sequence's distinct k-mers found in the index, and
+        the reference holding most of them ('' without hits)."""
+        fraction = np.zeros(len(sequences))
+        best = np.full(len(sequences), -1)
+        for start, stop in _feature_ranges(len(sequences),
+                                           block_size or _SEQUENCE_BLOCK):
+            kmers, owner = _distinct_pairs(
+                *_canonical_kmers(sequences[start:stop], self.k))
+            position = np.searchsorted(self.kmers, kmers)
+            position[position == len(self.kmers)] = 0
+            hit = (self.kmers[position] == kmers) if len(self.kmers) \
+                else np.zeros(len(kmers), dtype=bool)
+            n = stop - start
+            total = np.bincount(owner, minlength=n)
+            hits = np.bincount(owner[hit], minlength=n)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                fraction[start:stop] = np.where(total > 0, hits / total, 0)
+            best[start:stop] = self._best_references(
+                owner[hit], self.references[position[hit]], n)
+        references = np.append(np.asarray(self.reference_ids, dtype=object),
+                               '')
+        return pd.DataFrame({'kmer_fraction': fraction,
+                             'kmer_reference': references[best]},
+                            index=pd.Index(feature_ids, name='#OTU ID'))
+
+    def _best_references(self, owner, references, n):
+        pairs, counts = np.unique(
+            owner.astype(np.int64) * len(self.reference_ids) + references,
+            return_counts=True)
+        owner, references = np.divmod(pairs, len(self.reference_ids))
+        # most hits first within each owner; ties go to the earlier reference
+        order = np.lexsort((references, -counts, owner))
+        owner, references = owner[order], references[order]
+        first = np.ones(len(owner), dtype=bool)
+        first[1:] = owner[1:] != owner[:-1]
+        best = np.full(n, -1)
+        best[owner[first]] = references[first]
+        return best
+
+    def save(self, file):
+        np.savez(file, kmers=self.kmers, references=self.references,
+                 reference_ids=np.asarray(self.reference_ids, dtype=str),
+                 k=self.k)
+
+    @classmethod
+    def load(cls, file):
+        with np.load(file) as data:
+            return cls(data['kmers'], data['references'],
+                       data['reference_ids'], data['k'])
+
+
+def _attach_kmer_flags(df, index, sequences, min_fraction):
+    """Add the prior contaminant columns of `index` to a score table.
+
+    Features without a representative sequence get no hits.
+    """
+    feature_ids, strings = _sequence_strings(sequences)
+    hits = index.lookup(feature_ids, strings)
+    hits = hits[~hits.index.duplicated()].reindex(df.index)
+    df['kmer_fraction'] = hits['kmer_fraction'].fillna(0).to_numpy()
+    df['kmer_reference'] = hits['kmer_reference'].fillna('').to_numpy()
+    df['prior_contaminant'] = df['kmer_fraction'] >= min_fraction
+    return df
+
+
+def decontam_build_kmer_index(reference_sequences: DNAIterator,
+                              kmer_size: int = 21) -> KmerIndex:
+    """Index the k-mers of known kit and reagent contaminant sequences."""
+    with RunReport('decontam_build_kmer_index',
+                   kmer_size=kmer_size) as report:
+        with report.stage('read_sequences'):
+            reference_ids, strings = _sequence_strings(reference_sequences)
+        with report.stage('build_index'):
+            index = KmerIndex.from_sequences(reference_ids, strings,
+                                             kmer_size)
+        report.update(references=len(reference_ids), kmers=len(index))
+        return index
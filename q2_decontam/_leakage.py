@@ -0,0 +1,158 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2016-2022, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import qiime2
+import numpy as np
+import pandas as pd
+import scipy.sparse
+from scipy import stats
+
+from ._scoring import _metadata_column, _feature_matrix
+from ._report import RunReport, _table_info
+
+# Features converted to sparse at a time, so the table is never densified.
+_BLOCK_ROWS = 4096
+# The 8 wells around a well (row, column offsets).
+_NEIGHBOR_OFFSETS = [(dr, dc) for dr in (-1, 0, 1) for dc in (-1, 0, 1)
+                     if (dr, dc) != (0, 0)]
+
+
+def _parse_wells(wells):
+    """Row and column index of wells such as 'A1', 'H09' or 'AA12'.
+
+    Wells that do not parse get -1 for both.
+    """
+    parts = pd.Series(wells, dtype=str).str.strip().str.upper() \
+        .str.extract(r'^([A-Z]+)0*(\d+)$')
+    rows = np.full(len(parts), -1)
+    columns = np.full(len(parts), -1)
+    valid = parts.notna().all(axis=1).to_numpy()
+    for i in np.flatnonzero(valid):
+        letters = parts.iat[i, 0]
+        row = 0
+        for letter in letters:
+            row = row * 26 + ord(letter) - ord('A') + 1
+        rows[i] = row - 1
+        columns[i] = int(parts.iat[i, 1]) - 1
+    return rows, columns
+
+
+def _well_adjacency(plates, wells):
+    """Samples x samples sparse matrix linking samples in neighbouring wells.
+
+    Samples on different plates, or with a missing plate or unparseable
+    well, have no neighbours.
+    """
+    rows, columns = _parse_wells(wells)
+    layout = pd.DataFrame({'plate': pd.Series(plates, dtype=str).to_numpy(),
+                           'row': rows, 'column': columns,
+                           'sample': np.arange(len(rows))})
+    layout = layout[(layout['row'] >= 0)
+                    & pd.notna(pd.Series(plates)).to_numpy()]
+    edges = []
+    for dr, dc in _NEIGHBOR_OFFSETS:
+        shifted = layout.assign(row=layout['row'] + dr,
+                                column=layout['column'] + dc)
+        pairs = shifted.merge(layout, on=['plate', 'row', 'column'],
+                              suffixes=('', '_neighbor'))
+        edges.append(pairs[['sample', 'sample_neighbor']]
+                     .to_numpy(dtype=np.int64))
+    edges = np.concatenate(edges)
+    n = len(rows)
+    adjacency = scipy.sparse.csr_matrix(
+        (np.ones(len(edges)), (edges[:, 0], edges[:, 1])), shape=(n, n))
+    # two samples in one well would count twice
+    adjacency.data[:] = 1
+    return adjacency
+
+
+def _leakage_scores(counts, adjacency, totals):
+    """Per-feature spatial co-occurrence statistics.
+
+    `counts` is features x samples and `totals` the per-sample reads of the
+    whole table, so a row subset gets the same relative abundances as in
+    the full table. A feature leaking between wells turns up next to wells
+    that hold it more often than its prevalence explains; the one-sided
+    hypergeometric p.leak tests that over the samples that have at least
+    one neighbour on the plate.
+    """
+    rel = counts @ scipy.sparse.diags(1 / np.where(totals > 0, totals, 1))
+    present = counts.copy()
+    present.data = np.ones_like(present.data)
+
+    # neighbour presence / abundance of every feature in every sample
+    neighbor_present = (present @ adjacency).tocsr()
+    neighbor_abundance = (rel @ adjacency).tocsr()
+    neighbor_present.data = (neighbor_present.data > 0).astype(float)
+    neighbor_present.eliminate_zeros()
+
+    has_neighbor = np.asarray(adjacency.sum(axis=0)).ravel() > 0
+    scope = scipy.sparse.diags(has_neighbor.astype(float))
+    present_in_scope = present @ scope
+    prev = np.asarray(present_in_scope.sum(axis=1)).ravel()
+    next_to = np.asarray((neighbor_present @ scope).sum(axis=1)).ravel()
+    both = np.asarray(present_in_scope.multiply(neighbor_present)
+                      .sum(axis=1)).ravel()
+    n_scope = int(has_neighbor.sum())
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        lift = (both / next_to) / (prev / n_scope)
+        held = present.multiply(neighbor_abundance)
+        mean_neighbor = (np.asarray(held.sum(axis=1)).ravel()
+                         / np.asarray(present.sum(axis=1)).ravel())
+    p_leak = stats.hypergeom.sf(both - 1, n_scope, prev, next_to)
+    p_leak[(prev == 0) | (next_to == 0)] = np.nan
+    return np.column_stack([prev, next_to, both, lift, mean_neighbor,
+                            p_leak])
+
+
+_LEAKAGE_COLUMNS = ['prev', 'next_to_prev', 'co_occurrence', 'lift',
+                    'neighbor_abundance', 'p.leak']
+
+
+def decontam_well_leakage(asv_or_otu_table: pd.DataFrame,
+                          meta_data: qiime2.Metadata,
+                          plate_column: str,
+                          well_column: str,
+                          decon_identify_table: qiime2.Metadata = None,
+                          threshold: float = 0.1) -> pd.DataFrame:
+    """Score features for leakage between neighbouring wells.
+
+    With a score table only the contaminant candidates (p <= threshold) are
+    scored, and their decontam p is carried over next to p.leak.
+    """
+    with RunReport('decontam_well_leakage',
+                   matrix=_table_info(asv_or_otu_table)) as report:
+        table = asv_or_otu_table
+        # library sizes come from every feature, candidates or not
+        totals = table.sum(axis=0).to_numpy(dtype=float)
+        scores = None
+        if decon_identify_table is not None:
+            scores = decon_identify_table.to_dataframe()
+            candidates = scores.index[scores['p'].astype(float) <= threshold]
+            table = table.loc[table.index.intersection(candidates)]
+        metadata = meta_data.to_dataframe().reindex(table.columns)
+        with report.stage('well_adjacency'):
+            adjacency = _well_adjacency(
+                _metadata_column(metadata, plate_column),
+                _metadata_column(metadata, well_column))
+        if adjacency.nnz == 0:
+            raise ValueError('No two samples sit in neighbouring wells of '
+                             'the same plate; check the %r and %r columns.'
+                             % (plate_column, well_column))
+        with report.stage('leakage_scores'):
+            counts = _feature_matrix(table, block_rows=_BLOCK_ROWS)
+            df = pd.DataFrame(_leakage_scores(counts, adjacency, totals),
+                              index=pd.Index(table.index, name='#OTU ID'),
+                              columns=_LEAKAGE_COLUMNS)
+        for column in ['prev', 'next_to_prev', 'co_occurrence']:
+            df[column] = df[column].astype(int)
+        if scores is not None:
+            df['p'] = scores['p'].astype(float).reindex(df.index)
+        report.update(features=len(df), adjacency_edges=int(adjacency.nnz))
+        return df
@@ -0,0 +1,157 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2016-2022, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import itertools
+
+import qiime2
+import numpy as np
+import pandas as pd
+import scipy.sparse
+
+from ._scoring import _feature_matrix, _feature_rows
+from ._prefilter import _control_samples
+from ._report import RunReport, _table_info
+
+# Features converted to sparse at a time, so the table is never densified.
+_BLOCK_ROWS = 4096
+
+
+def _batched_nnls(gram, rhs):
+    """Non-negative least squares for many samples sharing few components.
+
+    Solves min ||x_s - C w_s|| subject to w_s >= 0 for every sample s at
+    once, from the components' Gram matrix C'C (k x k) and the products
+    C'x_s (samples x k). With a handful of components every active set can
+    be tried: each is one small solve broadcast over all samples, and the
+    feasible solution with the smallest residual wins.
+    """
+    n_samples, k = rhs.shape
+    best = np.zeros((n_samples, k))
+    best_loss = np.zeros(n_samples)  # the all-zero solution
+    for size in range(1, k + 1):
+        for active in itertools.combinations(range(k), size):
+            active = list(active)
+            sub_gram = gram[np.ix_(active, active)]
+            if np.linalg.matrix_rank(sub_gram) < size:
+                continue
+            weights = np.linalg.solve(sub_gram, rhs[:, active].T).T
+            # ||x - Cw||^2 minus the constant ||x||^2
+            loss = (np.einsum('si,ij,sj->s', weights, sub_gram, weights)
+                    - 2 * (weights * rhs[:, active]).sum(axis=1))
+            better = (weights >= 0).all(axis=1) & (loss < best_loss)
+            best[better] = 0
+            best[np.ix_(better, active)] = weights[better]
+            best_loss[better] = loss[better]
+    return best, best_loss
+
+
+def _pooled_profile(counts, samples):
+    """Relative abundance profile of the summed reads of `samples`."""
+    pooled = np.asarray(counts[:, samples].sum(axis=1)).ravel()
+    return pooled / pooled.sum() if pooled.sum() > 0 else pooled
+
+
+def _true_profile(counts, neg, control_profile):
+    """Profile of the true samples' reads of features the controls lack.
+
+    Pooling the true samples as they are would fold their contamination
+    into the true component, so a cohort where most samples are
+    contaminated would look clean. Dropping every feature seen in the
+    controls leaves a profile that contains none of it.
+    """
+    pooled = np.asarray(counts[:, ~neg].sum(axis=1)).ravel()
+    pooled[control_profile > 0] = 0
+    return pooled / pooled.sum() if pooled.sum() > 0 else pooled
+
+
+def _contaminant_fractions(counts, neg):
+    """Mixing weights of every sample over the pooled control profile and
+    the contamination-free true-sample profile.
+
+    `counts` is features x samples. Returns the control weight, the
+    true-sample weight and the residual sum of squares per sample, all on
+    relative abundances.
+    """
+    totals = np.asarray(counts.sum(axis=0)).ravel()
+    rel = (counts @ scipy.sparse.diags(
+        1 / np.where(totals > 0, totals, 1))).T.tocsr()
+    control_profile = _pooled_profile(counts, neg)
+    components = np.column_stack([
+        control_profile, _true_profile(counts, neg, control_profile)])
+    gram = components.T @ components
+    rhs = np.asarray(rel @ components)
+    weights, loss = _batched_nnls(gram, rhs)
+    norms = np.asarray(rel.multiply(rel).sum(axis=1)).ravel()
+    return weights, np.maximum(norms + loss, 0)
+
+
+def _subtract_contaminants(counts, candidates, neg):
+    """Remove each sample's expected control-derived reads of `candidates`.
+
+    `counts` is features x samples CSR and `candidates` a boolean vector
+    over the features. A sample's expected contaminant reads of a feature
+    are its control weight times the feature's share of the pooled control
+    profile times the sample's library size; that is subtracted from the
+    candidate entries only, rounded and floored at zero. Only stored
+    entries are touched, so the result stays as sparse as the input.
+    """
+    weights, _ = _contaminant_fractions(counts, neg)
+    control_profile = _pooled_profile(counts, neg)
+    totals = np.asarray(counts.sum(axis=0)).ravel()
+    rows, columns = _feature_rows(counts), counts.indices
+    selected = candidates[rows]
+    expected = (weights[columns[selected], 0]
+                * control_profile[rows[selected]]
+                * totals[columns[selected]])
+    out = counts.copy()
+    out.data[selected] = np.maximum(np.rint(out.data[selected] - expected), 0)
+    subtracted = counts.sum() - out.sum()
+    out.eliminate_zeros()
+    return out, subtracted
+
+
+def decontam_contaminant_fraction(asv_or_otu_table: pd.DataFrame,
+                                  meta_data: qiime2.Metadata,
+                                  prev_control_or_exp_sample_column: str,
+                                  prev_control_sample_indicator: str
+                                  ) -> pd.DataFrame:
+    """Estimate the fraction of each sample's reads that came from controls.
+
+    Every sample's relative abundance profile is fit, by non-negative least
+    squares, as a mix of the pooled negative-control profile and the pooled
+    profile of the true samples over the features no control holds; the
+    control share of the fitted weights is the contaminant fraction.
+    """
+    with RunReport('decontam_contaminant_fraction',
+                   matrix=_table_info(asv_or_otu_table)) as report:
+        neg = _control_samples(meta_data.to_dataframe(),
+                               asv_or_otu_table.columns,
+                               prev_control_or_exp_sample_column,
+                               prev_control_sample_indicator)
+        if not neg.any() or neg.all():
+            raise ValueError('Indicator %r must match some, but not all, of '
+                             'the samples in column %r.'
+                             % (prev_control_sample_indicator,
+                                prev_control_or_exp_sample_column))
+        with report.stage('mixing'):
+            counts = _feature_matrix(asv_or_otu_table,
+                                     block_rows=_BLOCK_ROWS)
+            weights, residual = _contaminant_fractions(counts, neg)
+        total = weights.sum(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            fraction = np.where(total > 0, weights[:, 0] / total, np.nan)
+        df = pd.DataFrame({'contaminant_fraction': fraction,
+                           'control_weight': weights[:, 0],
+                           'sample_weight': weights[:, 1],
+                           'residual': residual,
+                           'is_control': neg},
+                          index=pd.Index(asv_or_otu_table.columns,
+                                         name='sample-id'))
+        report.update(controls=int(neg.sum()),
+                      median_fraction=float(np.nanmedian(fraction[~neg])))
+        return df
@@ -0,0 +1,139 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2016-2022, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import multiprocessing
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import scipy.sparse
+
+from ._scoring import _score_counts, _SCORE_COLUMNS
+
+
+# Feature ranges handed out per worker; more than one each so that a slow
+# range does not leave the other workers idle.
+_TASKS_PER_WORKER = 4
+
+# Arrays a pool worker attached to in its initializer.
+_worker = {}
+
+
+class _SharedArrays:
+    """Copies NumPy arrays into shared memory blocks, once, in the parent.
+
+    `specs` is what a worker needs to map the same blocks back to arrays
+    without pickling their contents.
+    """
+
+    def __init__(self, arrays):
+        self._blocks = []
+        self.specs = {}
+        try:
+            for name, array in arrays.items():
+                block = shared_memory.SharedMemory(
+                    create=True, size=max(array.nbytes, 1))
+                self._blocks.append(block)
+                view = np.ndarray(array.shape, dtype=array.dtype,
+                                  buffer=block.buf)
+                view[...] = array
+                self.specs[name] = (block.name, array.shape, array.dtype.str)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        for block in self._blocks:
+            block.close()
+            block.unlink()
+        self._blocks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+
+def _attach(specs):
+    blocks, arrays = [], {}
+    for name, (block_name, shape, dtype) in specs.items():
+        block = shared_memory.SharedMemory(name=block_name)
+        blocks.append(block)
+        arrays[name] = np.ndarray(shape, dtype=np.dtype(dtype),
+                                  buffer=block.buf)
+    return blocks, arrays
+
+
+def _init_worker(specs, n_samples, decon_method):
+    blocks, arrays = _attach(specs)
+    _worker.update(blocks=blocks, arrays=arrays, n_samples=n_samples,
+                   decon_method=decon_method)
+
+
+def _score_range(start, stop):
+    arrays = _worker['arrays']
+    indptr = arrays['indptr']
+    lo, hi = indptr[start], indptr[stop]
+    counts = scipy.sparse.csr_matrix(
+        (arrays['data'][lo:hi], arrays['indices'][lo:hi],
+         indptr[start:stop + 1] - lo),
+        shape=(stop - start, _worker['n_samples']), copy=False)
+    scores = _score_counts(counts, arrays['totals'], arrays.get('conc'),
+                           arrays.get('neg'), _worker['decon_method'])
+    return start, stop, scores
+
+
+def _balanced_ranges(indptr, n_ranges):
+    """Split rows into contiguous ranges holding about equal nonzeros."""
+    n_rows = len(indptr) - 1
+    targets = np.linspace(0, indptr[-1], n_ranges + 1)[1:-1]
+    cuts = np.unique(np.concatenate(
+        [[0], np.searchsorted(indptr, targets), [n_rows]])).astype(int)
+    return list(zip(cuts[:-1], cuts[1:]))
+
+
+def _pool_context():
+    # forkserver avoids forking a parent that runs sampler/watcher threads
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('forkserver')
+    return multiprocessing.get_context('spawn')
+
+
+def _score_parallel(counts, totals, conc, neg, decon_method, n_jobs,
+                    progress=None):
+    """Score the rows of `counts` on a pool of `n_jobs` processes.
+
+    The CSR arrays and per-sample vectors are placed in shared memory once;
+    workers score disjoint feature ranges against them zero-copy and send
+    back only their (features x score columns) result block.
+    """
+    arrays = {'data': counts.data, 'indices': counts.indices,
+              'indptr': counts.indptr, 'totals': totals}
+    if conc is not None:
+        arrays['conc'] = conc
+    if neg is not None:
+        arrays['neg'] = neg
+
+    scores = np.empty((counts.shape[0], len(_SCORE_COLUMNS)))
+    ranges = _balanced_ranges(counts.indptr, n_jobs * _TASKS_PER_WORKER)
+    scored = 0
+    with _SharedArrays(arrays) as shared, ProcessPoolExecutor(
+            max_workers=n_jobs, mp_context=_pool_context(),
+            initializer=_init_worker,
+            initargs=(shared.specs, counts.shape[1], decon_method)) as pool:
+        futures = [pool.submit(_score_range, start, stop)
+                   for start, stop in ranges]
+        for future in as_completed(futures):
+            start, stop, block = future.result()
+            scores[start:stop] = block
+            scored += stop - start
+            if progress is not None:
+                progress(scored)
+    return scores
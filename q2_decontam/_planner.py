@@ -0,0 +1,216 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2016-2022, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import re
+import collections
+
+from ._report import _count_nonzero
+from ._progress import _progress_chunk_size
+from ._prefilter import _PREFILTER_BLOCK_ROWS
+
+_UNITS = {'': 1, 'B': 1, 'K': 2 ** 10, 'M': 2 ** 20, 'G': 2 ** 30,
+          'T': 2 ** 40}
+
+# Bytes held per stored nonzero / per feature while a chunk is scored: the
+# relative abundances, row ids, logs and residuals of _score_counts, and its
+# per-feature sums, p-values and the 4 x features prevalence stacks.
+_SCORE_BYTES_PER_NNZ = 12 * 8
+_SCORE_BYTES_PER_FEATURE = 24 * 8
+# CSR storage: float64 data and int32 column index per nonzero.
+_CSR_BYTES_PER_NNZ = 12
+# Dense float64 copy plus the boolean nonzero mask scipy builds from it.
+_DENSE_BYTES_PER_CELL = 9
+# run_decontam.R holds the table as a data.frame, a numeric matrix and a
+# normalized copy.
+_R_DENSE_COPIES = 3
+# Samples transposed at a time when writing the table for R; each block is
+# held as read and as the (subset) matrix written out.
+_R_WRITE_BLOCK_SAMPLES = 256
+_R_WRITE_COPIES = 2
+# Profile deduplication: the row hashes, np.unique's sorted copy, indices
+# and inverse, and the representative positions, as int64 per feature.
+_DEDUP_BYTES_PER_FEATURE = 8 * 8
+# Output frame plus the copies made by _finalize_scores and the transform.
+_OUTPUT_BYTES_PER_FEATURE = 3 * 5 * 8
+
+# Rough throughput of this code on a current core, for the runtime estimate.
+_NATIVE_SECONDS_PER_NNZ = 6e-8
+_NATIVE_SECONDS_PER_CELL = 2e-9
+_R_SECONDS_PER_CELL = 4e-8
+_R_SECONDS_PER_FEATURE = 2e-4
+
+# Smallest chunk the planner will go down to before giving up.
+_MIN_CHUNK_FEATURES = 64
+
+
+ExecutionPlan = collections.namedtuple(
+    'ExecutionPlan', ['backend', 'handling', 'chunk_size', 'n_chunks',
+                      'block_rows', 'estimated_peak_bytes', 'budget_bytes',
+                      'estimated_seconds'])
+ExecutionPlan.__doc__ = """How decontam_identify will score a table.
+
+`handling` is 'dense' when the count matrix is materialized in full at some
+point, 'sparse' when it is only ever built `block_rows` features at a time.
+"""
+
+
+def _parse_memory(value):
+    """Parse a size such as '8GB', '512M' or '1.5 GiB' into bytes."""
+    match = re.fullmatch(r'\s*([0-9]*\.?[0-9]+)\s*([KMGT]?)(?:i?B)?\s*',
+                         str(value), flags=re.IGNORECASE)
+    if match is None:
+        raise ValueError('Could not parse %r as a memory size, use e.g. '
+                         '"8GB" or "512MB".' % value)
+    number, unit = match.groups()
+    return int(float(number) * _UNITS[unit.upper()])
+
+
+def _format_bytes(n_bytes):
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if n_bytes < 1024:
+            return '%.1f %s' % (n_bytes, unit)
+        n_bytes /= 1024
+    return '%.1f TB' % n_bytes
+
+
+def _n_chunks(n_features, chunk_size):
+    if chunk_size <= 0:
+        return 1
+    return max(-(-n_features // chunk_size), 1)
+
+
+def _scoring_bytes(n_features, nnz, chunk_size):
+    rows = n_features if chunk_size <= 0 else min(chunk_size, n_features)
+    per_row_nnz = nnz / max(n_features, 1)
+    return int(rows * (per_row_nnz * _SCORE_BYTES_PER_NNZ
+                       + _SCORE_BYTES_PER_FEATURE))
+
+
+def _prefilter_bytes(n_features, n_samples, block_rows=None):
+    """Peak of the prefilter and deduplication before scoring starts.
+
+    Both read the table in blocks of rows; deduplication also compares a
+    block of duplicates against a block of their representatives.
+    """
+    block = min(block_rows or _PREFILTER_BLOCK_ROWS, n_features) * n_samples
+    return (n_features * _DEDUP_BYTES_PER_FEATURE
+            + 2 * block * _DENSE_BYTES_PER_CELL)
+
+
+def _estimate_native(n_features, n_samples, nnz, input_bytes, chunk_size,
+                     block_rows):
+    csr = nnz * _CSR_BYTES_PER_NNZ + (n_features + 1) * 4
+    if block_rows is None:
+        build = n_features * n_samples * _DENSE_BYTES_PER_CELL
+    else:
+        # the blocks are stacked into a second CSR at the end
+        build = block_rows * n_samples * _DENSE_BYTES_PER_CELL + csr
+    # after deduplication the unique profiles are sliced into a second CSR
+    scoring = max(build, csr, _scoring_bytes(n_features, nnz, chunk_size))
+    peak = (input_bytes + n_features * _OUTPUT_BYTES_PER_FEATURE
+            + max(_prefilter_bytes(n_features, n_samples, block_rows),
+                  csr + scoring))
+    seconds = (nnz * _NATIVE_SECONDS_PER_NNZ
+               + n_features * n_samples * _NATIVE_SECONDS_PER_CELL)
+    return peak, seconds
+
+
+def _estimate_r(n_features, n_samples, nnz, input_bytes, chunk_size):
+    dense = n_features * n_samples * 8
+    rows = n_features if chunk_size <= 0 else min(chunk_size, n_features)
+    # isContaminant works on a dense samples x chunk matrix
+    scoring = rows * n_samples * 8 * 2 + _scoring_bytes(n_features, nnz,
+                                                        chunk_size)
+    write = (min(_R_WRITE_BLOCK_SAMPLES, n_samples) * n_features * 8
+             * _R_WRITE_COPIES)
+    peak = (input_bytes + n_features * _OUTPUT_BYTES_PER_FEATURE
+            + max(_prefilter_bytes(n_features, n_samples), write,
+                  _R_DENSE_COPIES * dense + scoring))
+    seconds = (n_features * n_samples * _R_SECONDS_PER_CELL
+               + n_features * _R_SECONDS_PER_FEATURE)
+    return peak, seconds
+
+
+def _chunk_candidates(n_features, chunk_size):
+    if chunk_size is not None:
+        return [chunk_size]
+    # the default (single pass, or progress-sized chunks), then halving
+    default = _progress_chunk_size(n_features)
+    candidates = [default]
+    size = default if default > 0 else n_features
+    while size > _MIN_CHUNK_FEATURES:
+        size = max(size // 2, _MIN_CHUNK_FEATURES)
+        candidates.append(size)
+    return candidates
+
+
+def _plan(table, backend, budget_bytes=None, chunk_size=None):
+    """Pick the cheapest way of scoring `table` that fits `budget_bytes`.
+
+    `table` has features as rows. Dense handling and big chunks are preferred
+    while they fit, as they are the fastest; a fixed `chunk_size` (e.g. of a
+    checkpointed run) is kept as is. Raises ValueError when nothing fits.
+    """
+    n_features, n_samples = table.shape
+    nnz = _count_nonzero(table)
+    input_bytes = int(table.memory_usage(index=False).sum())
+
+    options = []
+    for size in _chunk_candidates(n_features, chunk_size):
+        if backend == 'r':
+            options.append(('dense', size, None)
+                           + _estimate_r(n_features, n_samples, nnz,
+                                         input_bytes, size))
+            continue
+        options.append(('dense', size, None)
+                       + _estimate_native(n_features, n_samples, nnz,
+                                          input_bytes, size, None))
+        block_rows = max(min(size if size > 0 else _MIN_CHUNK_FEATURES,
+                             n_features), 1)
+        options.append(('sparse', size, block_rows)
+                       + _estimate_native(n_features, n_samples, nnz,
+                                          input_bytes, size, block_rows))
+
+    def plan(handling, size, block_rows, peak, seconds):
+        return ExecutionPlan(backend, handling, size,
+                             _n_chunks(n_features, size), block_rows,
+                             int(peak), budget_bytes, seconds)
+
+    if budget_bytes is None:
+        return plan(*options[0])
+    for option in options:
+        if option[3] <= budget_bytes:
+            return plan(*option)
+    smallest = min(options, key=lambda option: option[3])
+    hint = (" Try scoring_backend='native', which can build its sparse "
+            "matrix in blocks." if backend == 'r' else '')
+    raise ValueError(
+        'Scoring this table (%d features x %d samples, %d nonzero) needs an '
+        'estimated %s even in the smallest chunks, more than the %s memory '
+        'budget.%s' % (n_features, n_samples, nnz,
+                       _format_bytes(smallest[3]),
+                       _format_bytes(budget_bytes), hint))
+
+
+def _describe_plan(plan):
+    budget = ('none' if plan.budget_bytes is None
+              else _format_bytes(plan.budget_bytes))
+    chunks = ('a single pass' if plan.n_chunks == 1
+              else '%d chunks of %d features' % (plan.n_chunks,
+                                                 plan.chunk_size))
+    lines = ['decontam identify execution plan',
+             '  backend:          %s' % plan.backend,
+             '  handling:         %s' % plan.handling,
+             '  scoring:          %s' % chunks,
+             '  estimated memory: %s (budget: %s)'
+             % (_format_bytes(plan.estimated_peak_bytes), budget),
+             '  expected runtime: ~%.0fs' % plan.estimated_seconds]
+    if plan.block_rows is not None:
+        lines.insert(3, '  matrix built in:  blocks of %d features'
+                     % plan.block_rows)
+    return '\n'.join(lines)
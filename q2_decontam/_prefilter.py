@@ -0,0 +1,159 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2016-2022, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import collections
+
+import numpy as np
+import pandas as pd
+
+from ._scoring import _metadata_column
+from ._progress import _feature_ranges
+
+# Status codes of the score table's `status` column, in the order they are
+# checked: a feature gets the first one that applies.
+SCORED = 'scored'
+ZERO_READS = 'zero_reads'
+CONTROL_ONLY = 'control_only'
+LOW_PREVALENCE = 'low_prevalence'
+LOW_READS = 'low_reads'
+
+# Synthetic feature holding the reads of every excluded feature, so that the
+# scored subset is normalized by the same per-sample totals as the full table.
+_REMAINDER = '__decontam_remainder__'
+
+# Features summarized or compared per block, bounding the dense copies.
+_PREFILTER_BLOCK_ROWS = 4096
+
+FeatureCounts = collections.namedtuple(
+    'FeatureCounts', ['reads', 'prevalence', 'control_prevalence', 'freq'])
+FeatureCounts.__doc__ = """Per-feature totals the prefilter works from.
+
+`control_prevalence` is None unless a control sample mask was given; `freq`
+is the mean relative abundance over the samples with reads, as
+isContaminant reports it.
+"""
+
+
+def _control_samples(metadata, sample_ids, prev_control_or_exp_sample_column,
+                     prev_control_sample_indicator):
+    if 'NULL' in (prev_control_or_exp_sample_column,
+                  prev_control_sample_indicator):
+        raise ValueError('exclude_control_only needs '
+                         'prev_control_or_exp_sample_column and '
+                         'prev_control_sample_indicator to tell control '
+                         'samples apart.')
+    control = _metadata_column(metadata.reindex(sample_ids),
+                               prev_control_or_exp_sample_column)
+    return control.astype(str).str.contains(
+        prev_control_sample_indicator).to_numpy(dtype=bool)
+
+
+def _feature_counts(table, neg=None, block_rows=None):
+    """FeatureCounts of a table with features as rows.
+
+    The table is read `block_rows` features at a time, so no dense copy of
+    the whole table is made.
+    """
+    totals = table.sum(axis=0).to_numpy(dtype=float)
+    with_reads = totals > 0
+    n_features = table.shape[0]
+    reads = np.empty(n_features)
+    prevalence = np.empty(n_features, dtype=np.int64)
+    freq = np.zeros(n_features)
+    control = None if neg is None else np.empty(n_features, dtype=np.int64)
+    for start, stop in _feature_ranges(n_features,
+                                       block_rows or _PREFILTER_BLOCK_ROWS):
+        block = table.iloc[start:stop].to_numpy(dtype=float)
+        present = block > 0
+        reads[start:stop] = block.sum(axis=1)
+        prevalence[start:stop] = present.sum(axis=1)
+        if neg is not None:
+            control[start:stop] = present[:, neg].sum(axis=1)
+        if with_reads.any():
+            freq[start:stop] = (block[:, with_reads]
+                                / totals[with_reads]).mean(axis=1)
+    return FeatureCounts(reads, prevalence, control, freq)
+
+
+def _prefilter_status(counts, min_prevalence=0, min_reads=0):
+    """Status code of every feature of a FeatureCounts.
+
+    Features without reads are always excluded; control-only features only
+    when the counts carry a control prevalence.
+    """
+    status = np.full(len(counts.reads), SCORED, dtype=object)
+    status[counts.reads < min_reads] = LOW_READS
+    status[counts.prevalence < min_prevalence] = LOW_PREVALENCE
+    if counts.control_prevalence is not None:
+        control_only = ((counts.prevalence > 0)
+                        & (counts.control_prevalence == counts.prevalence))
+        status[control_only] = CONTROL_ONLY
+    status[counts.reads == 0] = ZERO_READS
+    return status
+
+
+def _profile_representatives(table, block_rows=None):
+    """Position of the first feature with the same count profile as each.
+
+    Rows are bucketed by hash, and only the rows sharing a bucket with an
+    earlier one are compared with it, so a hash collision never merges two
+    different profiles.
+    """
+    hashes = pd.util.hash_pandas_object(table, index=False).to_numpy()
+    _, first, inverse = np.unique(hashes, return_index=True,
+                                  return_inverse=True)
+    representative = first[inverse.ravel()]
+    duplicates = np.flatnonzero(representative
+                                != np.arange(len(representative)))
+    for start, stop in _feature_ranges(len(duplicates),
+                                       block_rows or _PREFILTER_BLOCK_ROWS):
+        rows = duplicates[start:stop]
+        collided = (table.iloc[rows].to_numpy()
+                    != table.iloc[representative[rows]].to_numpy()).any(
+                        axis=1)
+        representative[rows[collided]] = rows[collided]
+    return representative
+
+
+def _excluded_scores(counts, status, feature_ids, columns):
+    """Score rows for the excluded features, in the scored table's columns.
+
+    freq and prev are filled in as isContaminant computes them; p-values
+    are missing, except that control-only features are called contaminants
+    outright (p = 0, and likewise every p-value that uses prevalence).
+    """
+    excluded = status != SCORED
+    df = pd.DataFrame(np.nan, index=feature_ids[excluded], columns=columns)
+    if 'freq' in columns:
+        df['freq'] = counts.freq[excluded]
+    if 'prev' in columns:
+        df['prev'] = counts.prevalence[excluded]
+    control_only = status[excluded] == CONTROL_ONLY
+    for column in columns:
+        if column in ('p.combined', 'p') or column.startswith('p.prev'):
+            df.loc[control_only, column] = 0.0
+    if 'p.not' in columns:
+        df.loc[control_only, 'p.not'] = 1.0
+    return df
+
+
+def _merge_prefiltered(scores, feature_ids, counts, status):
+    """Reinsert excluded features into `scores` and label every feature.
+
+    `scores` holds the scored features in the order of `feature_ids`.
+    """
+    if (status == SCORED).all():
+        return scores
+    excluded = _excluded_scores(counts, status, feature_ids, scores.columns)
+    scored = status == SCORED
+    positions = np.concatenate([np.flatnonzero(scored),
+                                np.flatnonzero(~scored)])
+    df = pd.concat([scores, excluded]).iloc[np.argsort(positions)]
+    df.index = pd.Index(feature_ids, name=scores.index.name)
+    df['status'] = status
+    return df
@@ -0,0 +1,243 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2016-2022, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import os
+import json
+import hashlib
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from ._scoring import (_metadata_column, _sample_vectors,
+                       _prevalence_pvalues, _combine_pvalues)
+from ._progress import _feature_ranges
+from ._report import _update_report
+
+# Directory where packed presence matrices are kept for reuse by later runs,
+# when set.
+PRESENCE_CACHE_ENV = 'Q2_DECONTAM_PRESENCE_CACHE'
+
+# Features packed per block, bounding the dense float copy of the table.
+_PACK_BLOCK_ROWS = 4096
+
+# Set bits of every byte value, for NumPy versions without bitwise_count.
+_POPCOUNT_TABLE = np.array([bin(value).count('1') for value in range(256)],
+                           dtype=np.uint8)
+
+
+def _popcount_rows(bits):
+    """Number of set bits in every row of a uint8 array."""
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(bits).sum(axis=1, dtype=np.int64)
+    return _POPCOUNT_TABLE[bits].sum(axis=1, dtype=np.int64)
+
+
+class PresenceMatrix:
+    """Features x samples presence/absence, 8 samples to a byte.
+
+    Prevalence scoring only needs to know which samples hold a feature, so
+    this is all it keeps of the table: 1 bit per cell instead of a 64-bit
+    count. Per-feature presence counts over any subset of samples are a
+    popcount of the rows ANDed with the subset's packed mask, so one matrix
+    serves any number of control definitions, and can be saved for reuse by
+    later runs. `fingerprint` identifies the table it was packed from.
+    """
+
+    def __init__(self, bits, feature_ids, sample_ids, fingerprint=None):
+        self.bits = bits
+        self.feature_ids = pd.Index(feature_ids)
+        self.sample_ids = pd.Index(sample_ids)
+        self.fingerprint = fingerprint
+
+    @classmethod
+    def from_table(cls, table, block_rows=None, rows=None):
+        """Pack a table with features as rows, `block_rows` at a time.
+
+        `rows` packs only those features.
+        """
+        block_rows = block_rows or _PACK_BLOCK_ROWS
+        rows = np.arange(table.shape[0]) if rows is None else rows
+        n_bytes = -(-table.shape[1] // 8)
+        bits = np.empty((len(rows), n_bytes), dtype=np.uint8)
+        for start, stop in _feature_ranges(len(rows), block_rows):
+            bits[start:stop] = np.packbits(
+                table.iloc[rows[start:stop]].to_numpy() > 0, axis=1)
+        return cls(bits, table.index[rows], table.columns)
+
+    @property
+    def shape(self):
+        return len(self.feature_ids), len(self.sample_ids)
+
+    @property
+    def nbytes(self):
+        return self.bits.nbytes
+
+    def mask(self, samples):
+        """Packed form of a boolean vector over the samples."""
+        return np.packbits(np.asarray(samples, dtype=bool))
+
+    def counts(self, samples=None, block_rows=None):
+        """Samples holding each feature, optionally among `samples` only."""
+        mask = None if samples is None else self.mask(samples)
+        out = np.empty(self.shape[0], dtype=np.int64)
+        for start, stop in _feature_ranges(self.shape[0],
+                                           block_rows or _PACK_BLOCK_ROWS):
+            block = self.bits[start:stop]
+            if mask is not None:
+                block = block & mask
+            out[start:stop] = _popcount_rows(block)
+        return out
+
+    def save(self, path):
+        with open(path, 'wb') as fh:
+            np.savez(fh, bits=self.bits,
+                     feature_ids=np.asarray(self.feature_ids, dtype=str),
+                     sample_ids=np.asarray(self.sample_ids, dtype=str),
+                     fingerprint=np.asarray(self.fingerprint or '', dtype=str))
+
+    @classmethod
+    def load(cls, path, fingerprint=None):
+        """Load a saved matrix, checking it was packed from `fingerprint`."""
+        with np.load(path) as data:
+            saved = str(data['fingerprint']) or None
+            if fingerprint is not None and saved != fingerprint:
+                raise ValueError('Presence matrix %r was packed from a '
+                                 'different table.' % str(path))
+            return cls(data['bits'], data['feature_ids'], data['sample_ids'],
+                       saved)
+
+
+def _table_fingerprint(table, rows=None):
+    """Digest of a table's ids and counts, and of the `rows` packed."""
+    digest = hashlib.sha256()
+    digest.update(json.dumps([str(c) for c in table.columns]).encode())
+    digest.update(pd.util.hash_pandas_object(table, index=True)
+                  .to_numpy().tobytes())
+    if rows is not None:
+        digest.update(np.asarray(rows, dtype=np.int64).tobytes())
+    return digest.hexdigest()
+
+
+def _cached_presence(table, block_rows=None, rows=None):
+    """PresenceMatrix.from_table, reusing a matrix saved by an earlier run.
+
+    Matrices are kept in `Q2_DECONTAM_PRESENCE_CACHE` under the table's
+    fingerprint; without it the table is simply packed.
+    """
+    cache_dir = os.environ.get(PRESENCE_CACHE_ENV)
+    if not cache_dir:
+        return PresenceMatrix.from_table(table, block_rows, rows)
+    fingerprint = _table_fingerprint(table, rows)
+    path = os.path.join(cache_dir, 'presence-%s.npz' % fingerprint)
+    if os.path.exists(path):
+        _update_report(presence_cache='hit')
+        return PresenceMatrix.load(path, fingerprint)
+    presence = PresenceMatrix.from_table(table, block_rows, rows)
+    presence.fingerprint = fingerprint
+    os.makedirs(cache_dir, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=cache_dir)
+    os.close(fd)
+    presence.save(tmp)
+    os.replace(tmp, path)
+    _update_report(presence_cache='miss')
+    return presence
+
+
+def _presence_inputs(table, metadata, decon_method,
+                     prev_control_or_exp_sample_column,
+                     prev_control_sample_indicator, block_rows=None,
+                     rows=None):
+    """The PresenceMatrix, freq column and control mask of a table.
+
+    `rows` limits both to those features, normalized by the whole table.
+    """
+    _, neg = _sample_vectors(metadata, table.columns, decon_method, 'NULL',
+                             prev_control_or_exp_sample_column,
+                             prev_control_sample_indicator)
+    totals = table.sum(axis=0).to_numpy(dtype=float)
+    # isContaminant drops samples without any reads before normalizing
+    keep = totals > 0
+    if not keep.all():
+        table, totals, neg = table.loc[:, keep], totals[keep], neg[keep]
+    presence = _cached_presence(table, block_rows, rows)
+    freq = _mean_relative_abundance(table, totals, block_rows, rows)
+    return presence, freq, neg
+
+
+def _mean_relative_abundance(table, totals, block_rows=None, rows=None):
+    """isContaminant's `freq` column, computed block by block."""
+    rows = np.arange(table.shape[0]) if rows is None else rows
+    freq = np.empty(len(rows))
+    for start, stop in _feature_ranges(len(rows),
+                                       block_rows or _PACK_BLOCK_ROWS):
+        block = table.iloc[rows[start:stop]].to_numpy(dtype=float)
+        freq[start:stop] = (block / totals).sum(axis=1) / len(totals)
+    return freq
+
+
+def _score_presence(presence, neg, freq, decon_method):
+    """Prevalence scores from a PresenceMatrix, in `_SCORE_COLUMNS` order.
+
+    `presence` must hold only samples with reads, as isContaminant drops the
+    others before scoring.
+    """
+    n_samples = presence.shape[1]
+    prev = presence.counts()
+    present_neg = presence.counts(neg)
+    alternative = 'less' if decon_method == 'not-contaminant' else 'greater'
+    p_prev = _prevalence_pvalues(present_neg, prev, int(neg.sum()),
+                                 n_samples, alternative)
+    p_freq = np.full(len(prev), np.nan)
+    p = _combine_pvalues(p_freq, p_prev, decon_method)
+    return np.column_stack([freq, prev, p_freq, p_prev, p])
+
+
+def _any_indicator(indicators):
+    """One pattern matching the samples of any of the control indicators.
+
+    Indicators are searched for as regular expressions, as grepl() does in
+    run_decontam.R.
+    """
+    return '|'.join('(?:%s)' % indicator for indicator in indicators)
+
+
+def _control_type_scores(presence, freq, metadata,
+                         prev_control_or_exp_sample_column, indicators):
+    """Prevalence scores of every feature against each control type.
+
+    Each type's controls are contrasted with the true samples (those of no
+    control type), reusing one count of true-sample presence for every
+    contrast. `p` is the smallest per-type p-value: a feature is called a
+    contaminant when any control type calls it one.
+    """
+    control = _metadata_column(metadata.reindex(presence.sample_ids),
+                               prev_control_or_exp_sample_column)
+    control = control.astype(str)
+    masks = [control.str.contains(indicator).to_numpy(dtype=bool)
+             for indicator in indicators]
+    true = ~np.logical_or.reduce(masks)
+    for indicator, neg in zip(indicators, masks):
+        if not neg.any():
+            raise ValueError('Indicator %r does not match any of the samples '
+                             'in column %r.'
+                             % (indicator, prev_control_or_exp_sample_column))
+
+    present_true = presence.counts(true)
+    df = pd.DataFrame({'freq': freq, 'prev': presence.counts()},
+                      index=pd.Index(presence.feature_ids, name='#OTU ID'))
+    pvalues = []
+    for indicator, neg in zip(indicators, masks):
+        present_neg = presence.counts(neg)
+        n_neg = int(neg.sum())
+        pvalues.append(_prevalence_pvalues(present_neg,
+                                           present_neg + present_true, n_neg,
+                                           n_neg + int(true.sum())))
+        df['p.prev.%s' % indicator] = pvalues[-1]
+    df['p'] = np.fmin.reduce(pvalues)
+    return df
@@ -0,0 +1,90 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2016-2022, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import os
+import re
+import sys
+import threading
+import collections
+
+
+# Any value other than '', '0', 'false' or 'no' turns profiling on.
+PROFILE_ENV = 'Q2_DECONTAM_PROFILE'
+
+
+def _profiling_enabled():
+    value = os.environ.get(PROFILE_ENV, '')
+    return value.strip().lower() not in {'', '0', 'false', 'no'}
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    label = '%s (%s:%d)' % (code.co_name, os.path.basename(code.co_filename),
+                            code.co_firstlineno)
+    return label.replace(';', ':')
+
+
+def _collapse_frame(frame):
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    return ';'.join(reversed(labels))
+
+
+def _write_collapsed(counts, path):
+    # Brendan Gregg's folded format: `outer;...;inner <samples>` per line
+    with open(path, 'w') as fh:
+        for stack, count in counts.most_common():
+            fh.write('%s %d\n' % (stack, count))
+
+
+class _SamplingProfiler(threading.Thread):
+    """Samples the Python stack of one thread at a fixed interval."""
+
+    def __init__(self, thread_id=None, interval=0.005):
+        super().__init__(name='q2-decontam-profiler', daemon=True)
+        self.thread_id = (threading.get_ident() if thread_id is None
+                          else thread_id)
+        self.interval = interval
+        self.counts = collections.Counter()
+        self._halt = threading.Event()
+
+    def run(self):
+        while not self._halt.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.counts[_collapse_frame(frame)] += 1
+            del frame
+
+    def stop(self):
+        self._halt.set()
+        self.join()
+
+    def write(self, path):
+        _write_collapsed(self.counts, path)
+
+
+def _collapse_rprof(rprof_fp, path):
+    """Convert an Rprof() sample file to folded stacks.
+
+    Each Rprof sample line lists the quoted call stack innermost first;
+    header and `#File` lines carry no samples.
+    """
+    counts = collections.Counter()
+    with open(rprof_fp) as fh:
+        for line in fh:
+            if line.startswith(('sample.interval', '#')):
+                continue
+            names = re.findall(r'"([^"]*)"', line)
+            if names:
+                stack = ';'.join(name.replace(';', ':')
+                                 for name in reversed(names))
+                counts[stack] += 1
+    _write_collapsed(counts, path)
+    return sum(counts.values())
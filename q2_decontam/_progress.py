@@ -0,0 +1,139 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2016-2022, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import os
+import time
+import logging
+import threading
+import collections
+
+
+logger = logging.getLogger('q2_decontam')
+
+# Seconds between progress log lines while features are being scored.
+PROGRESS_LOG_INTERVAL = 30.0
+
+ProgressEvent = collections.namedtuple(
+    'ProgressEvent', ['action', 'scored', 'total', 'elapsed', 'eta'])
+ProgressEvent.__doc__ = """Features scored so far by a running action.
+
+`elapsed` and `eta` are in seconds; `eta` is None until at least one
+feature has been scored.
+"""
+
+_listeners = []
+
+
+def add_progress_listener(callback):
+    """Call `callback(ProgressEvent)` whenever scoring makes progress."""
+    _listeners.append(callback)
+
+
+def remove_progress_listener(callback):
+    _listeners.remove(callback)
+
+
+class _ProgressTracker:
+    def __init__(self, action, total, log_interval=None):
+        self.action = action
+        self.total = total
+        self.scored = 0
+        self.log_interval = (PROGRESS_LOG_INTERVAL if log_interval is None
+                             else log_interval)
+        self._start = time.perf_counter()
+        self._last_log = self._start
+        self._last_progress = self._start
+        self._lock = threading.Lock()
+
+    def event(self):
+        elapsed = time.perf_counter() - self._start
+        eta = None
+        if self.scored > 0:
+            eta = elapsed * (self.total - self.scored) / self.scored
+        return ProgressEvent(self.action, self.scored, self.total, elapsed,
+                             eta)
+
+    def update(self, scored):
+        with self._lock:
+            if scored <= self.scored:
+                return
+            self.scored = scored
+            self._last_progress = time.perf_counter()
+            event = self.event()
+        for callback in list(_listeners):
+            callback(event)
+        self._maybe_log(event, force=scored >= self.total)
+
+    def tick(self):
+        """Log a heartbeat if the log interval passed without progress."""
+        self._maybe_log(self.event())
+
+    def _maybe_log(self, event, force=False):
+        now = time.perf_counter()
+        if not force and now - self._last_log < self.log_interval:
+            return
+        self._last_log = now
+        eta = 'unknown' if event.eta is None else '%.0fs' % event.eta
+        logger.info('%s: scored %d/%d features, %.0fs elapsed, ETA %s, '
+                    'last progress %.0fs ago', event.action, event.scored,
+                    event.total, event.elapsed, eta,
+                    now - self._last_progress)
+
+
+class _ProgressFileWatcher(threading.Thread):
+    """Relays `<scored>\\t<total>` lines appended by run_decontam.R."""
+
+    def __init__(self, path, tracker, interval=0.5):
+        super().__init__(name='q2-decontam-progress', daemon=True)
+        self.path = path
+        self.tracker = tracker
+        self.interval = interval
+        self._offset = 0
+        self._halt = threading.Event()
+
+    def run(self):
+        while not self._halt.wait(self.interval):
+            self.poll()
+            self.tracker.tick()
+
+    def poll(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path) as fh:
+            fh.seek(self._offset)
+            lines = fh.read().split('\n')
+            # keep a partially written last line for the next poll
+            self._offset = fh.tell() - len(lines[-1].encode())
+        for line in lines[:-1]:
+            fields = line.split('\t')
+            if len(fields) >= 2 and fields[0].isdigit():
+                self.tracker.update(int(fields[0]))
+
+    def stop(self):
+        self._halt.set()
+        self.join()
+        self.poll()
+
+
+# Tables with at least this many features are scored in chunks so that
+# progress can be reported; smaller ones are scored in a single pass.
+_PROGRESS_MIN_FEATURES = 5000
+_PROGRESS_CHUNKS = 100
+
+
+def _progress_chunk_size(n_features):
+    if n_features < _PROGRESS_MIN_FEATURES:
+        return 0
+    return -(-n_features // _PROGRESS_CHUNKS)
+
+
+def _feature_ranges(n_features, chunk_size):
+    if chunk_size <= 0:
+        chunk_size = max(n_features, 1)
+    return [(start, min(start + chunk_size, n_features))
+            for start in range(0, n_features, chunk_size)]
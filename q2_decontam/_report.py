@@ -0,0 +1,265 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2016-2022, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import os
+import sys
+import json
+import time
+import logging
+import inspect
+import itertools
+import resource
+import platform
+import threading
+import functools
+import contextlib
+import contextvars
+
+import numpy as np
+
+from ._profile import (_SamplingProfiler, _collapse_rprof,
+                       _profiling_enabled)
+
+
+logger = logging.getLogger('q2_decontam')
+
+# Directory that receives a JSON copy of every run report, when set.
+REPORT_DIR_ENV = 'Q2_DECONTAM_REPORT_DIR'
+
+_active_report = contextvars.ContextVar('_active_report', default=None)
+# Prepended to the names of stages recorded through _stage(), e.g. by the
+# threads of a batch that each score one table.
+_stage_prefix = contextvars.ContextVar('_stage_prefix', default='')
+# Numbers the reports of this process, so reports started in the same
+# second (e.g. by batch or service threads) get files of their own.
+_report_numbers = itertools.count(1)
+
+
+def _rusage_peak_bytes(who):
+    peak = resource.getrusage(who).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes everywhere else
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _current_rss_bytes():
+    try:
+        with open('/proc/self/statm') as fh:
+            resident_pages = int(fh.read().split()[1])
+        return resident_pages * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return _rusage_peak_bytes(resource.RUSAGE_SELF)
+
+
+class _MemorySampler(threading.Thread):
+    """Polls the resident set size and keeps the peak since `reset`.
+
+    `run_peak` is the peak since the sampler was created, `reset` leaves it.
+    """
+
+    def __init__(self, interval=0.01):
+        super().__init__(name='q2-decontam-memory-sampler', daemon=True)
+        self.interval = interval
+        self.peak = self.run_peak = _current_rss_bytes()
+        self._halt = threading.Event()
+
+    def run(self):
+        while not self._halt.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        rss = _current_rss_bytes()
+        self.peak = max(self.peak, rss)
+        self.run_peak = max(self.run_peak, rss)
+        return self.peak
+
+    def reset(self):
+        self.peak = _current_rss_bytes()
+        self.run_peak = max(self.run_peak, self.peak)
+
+    def stop(self):
+        self._halt.set()
+        self.join()
+
+
+# Rows read at a time when counting a table's nonzeros.
+_INFO_BLOCK_ROWS = 4096
+
+
+def _count_nonzero(table, block_rows=_INFO_BLOCK_ROWS):
+    """Nonzero cells of a table, read `block_rows` rows at a time."""
+    return sum(int(np.count_nonzero(
+        table.iloc[start:start + block_rows].to_numpy()))
+        for start in range(0, table.shape[0], block_rows))
+
+
+def _table_info(table):
+    return {'features': int(table.shape[0]),
+            'samples': int(table.shape[1]),
+            'nnz': _count_nonzero(table)}
+
+
+class RunReport:
+    """Stage timings and peak memory of a single action invocation.
+
+    Used as a context manager around an action body; stages are recorded
+    with `stage()` (or the module-level `_stage()` from helpers that do not
+    hold the report). On exit the report is logged as one JSON line on the
+    `q2_decontam` logger and, if `Q2_DECONTAM_REPORT_DIR` is set, written
+    there as ``<action>-<timestamp>-<pid>-<n>.json``, `n` numbering the
+    reports of the process.
+
+    `peak_rss_mb` is the peak sampled while the report was open;
+    `process_peak_rss_mb` is the peak over the whole process lifetime.
+
+    With `Q2_DECONTAM_PROFILE` set, the action's thread is also sampled and
+    written next to the report as ``<...>.python.collapsed``; the R backend
+    profiles run_decontam.R with Rprof into ``<...>.r.collapsed``. Without
+    a report directory, profiling writes to the working directory.
+    """
+
+    def __init__(self, action, **info):
+        self.action = action
+        self.number = next(_report_numbers)
+        self.info = dict(info)
+        self.stages = []
+        self.path = None
+        self.profiles = {}
+        self._sampler = None
+        self._profiler = None
+        self._token = None
+
+    def __enter__(self):
+        self._started = time.time()
+        self._start = time.perf_counter()
+        self._sampler = _MemorySampler()
+        self._sampler.start()
+        if _profiling_enabled():
+            self._profiler = _SamplingProfiler()
+            self._profiler.start()
+        self._token = _active_report.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _active_report.reset(self._token)
+        self.info['total_seconds'] = time.perf_counter() - self._start
+        self._sampler.stop()
+        self._sampler.sample()
+        self.info['peak_rss_mb'] = self._sampler.run_peak / 1e6
+        self.info['process_peak_rss_mb'] = _rusage_peak_bytes(
+            resource.RUSAGE_SELF) / 1e6
+        self.info['status'] = 'ok' if exc_type is None else exc_type.__name__
+        if self._profiler is not None:
+            self._profiler.stop()
+            self.profiles['python'] = self._output_base() + \
+                '.python.collapsed'
+            self._profiler.write(self.profiles['python'])
+        self.emit()
+        return False
+
+    def _output_dir(self):
+        report_dir = os.environ.get(REPORT_DIR_ENV)
+        if not report_dir and self.profiling:
+            report_dir = os.getcwd()
+        return report_dir
+
+    def _output_base(self):
+        report_dir = self._output_dir()
+        os.makedirs(report_dir, exist_ok=True)
+        return os.path.join(report_dir, '%s-%s-%d-%d' % (
+            self.action,
+            time.strftime('%Y%m%dT%H%M%S', time.localtime(self._started)),
+            os.getpid(), self.number))
+
+    @property
+    def profiling(self):
+        return self._profiler is not None
+
+    @property
+    def rprof_path(self):
+        """Where run_decontam.R should write Rprof samples, if profiling."""
+        if not self.profiling:
+            return None
+        return self._output_base() + '.Rprof.out'
+
+    def add_rprof(self, rprof_fp):
+        if os.path.exists(rprof_fp):
+            self.profiles['r'] = self._output_base() + '.r.collapsed'
+            _collapse_rprof(rprof_fp, self.profiles['r'])
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        self._sampler.reset()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_stage(name, time.perf_counter() - start,
+                           self._sampler.sample() / 1e6)
+
+    def add_stage(self, name, seconds, peak_mb=None):
+        self.stages.append({'stage': name, 'seconds': seconds,
+                            'peak_rss_mb': peak_mb})
+
+    def update(self, **info):
+        self.info.update(info)
+
+    def to_dict(self):
+        return {'action': self.action,
+                'started': time.strftime('%Y-%m-%dT%H:%M:%S',
+                                         time.localtime(self._started)),
+                'python_version': platform.python_version(),
+                **self.info,
+                'stages': self.stages,
+                **({'profiles': self.profiles} if self.profiles else {})}
+
+    def emit(self):
+        payload = self.to_dict()
+        logger.info('run report: %s', json.dumps(payload))
+        if self._output_dir():
+            self.path = self._output_base() + '.json'
+            with open(self.path, 'w') as fh:
+                json.dump(payload, fh, indent=2)
+
+
+def _current_report():
+    return _active_report.get()
+
+
+def _stage(name):
+    report = _active_report.get()
+    if report is None:
+        return contextlib.nullcontext()
+    return report.stage(_stage_prefix.get() + name)
+
+
+def _reported(action, info=None):
+    """Run the decorated action inside a RunReport.
+
+    `info` maps the call's arguments, by name and with defaults applied, to
+    the report's initial fields.
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            fields = {}
+            if info is not None:
+                bound = signature.bind(*args, **kwargs)
+                bound.apply_defaults()
+                fields = info(bound.arguments)
+            with RunReport(action, **fields):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _update_report(**info):
+    report = _active_report.get()
+    if report is not None:
+        report.update(**info)
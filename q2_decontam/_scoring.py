@@ -0,0 +1,309 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2016-2022, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import numpy as np
+import pandas as pd
+import scipy.sparse
+from scipy import stats
+
+from ._progress import _feature_ranges
+
+
+# Column order of decontam's detailed isContaminant output, minus the
+# trailing `contaminant` call that the plugin never keeps.
+_SCORE_COLUMNS = ['freq', 'prev', 'p.freq', 'p.prev', 'p']
+
+
+def _metadata_column(metadata, column):
+    # run_decontam.R matches metadata column names case-insensitively
+    for name in metadata.columns:
+        if name.lower() == column.lower():
+            return metadata[name]
+    raise ValueError('Column %r was not found in the metadata.' % column)
+
+
+def _sample_vectors(metadata, sample_ids, decon_method,
+                    freq_concentration_column,
+                    prev_control_or_exp_sample_column,
+                    prev_control_sample_indicator):
+    missing = pd.Index(sample_ids).difference(metadata.index)
+    if len(missing) > 0:
+        raise ValueError('The metadata is missing %d of the samples in the '
+                         'table, e.g. %r.' % (len(missing), missing[0]))
+    metadata = metadata.reindex(sample_ids)
+
+    conc = neg = None
+    if decon_method in {'frequency', 'combined', 'all'}:
+        conc = pd.to_numeric(
+            _metadata_column(metadata, freq_concentration_column),
+            errors='coerce').to_numpy(dtype=float)
+        if not (np.isfinite(conc) & (conc > 0)).all():
+            raise ValueError('Concentrations in column %r must all be '
+                             'positive numbers.' % freq_concentration_column)
+    if decon_method in {'prevalence', 'combined', 'all', 'not-contaminant'}:
+        # grepl() in run_decontam.R: a regex search, not an exact match
+        control = _metadata_column(metadata,
+                                   prev_control_or_exp_sample_column)
+        neg = control.astype(str).str.contains(
+            prev_control_sample_indicator).to_numpy(dtype=bool)
+        if not neg.any() or neg.all():
+            raise ValueError('Indicator %r must match some, but not all, of '
+                             'the samples in column %r.'
+                             % (prev_control_sample_indicator,
+                                prev_control_or_exp_sample_column))
+    return conc, neg
+
+
+def _feature_matrix(table, block_rows=None):
+    """Features x samples CSR matrix of a table with features as rows.
+
+    With `block_rows` the matrix is built that many features at a time, so
+    no dense copy of the whole table is ever made.
+    """
+    if block_rows is None:
+        counts = scipy.sparse.csr_matrix(table.to_numpy(dtype=float))
+    else:
+        counts = scipy.sparse.vstack(
+            [scipy.sparse.csr_matrix(
+                table.iloc[start:start + block_rows].to_numpy(dtype=float))
+             for start in range(0, table.shape[0], block_rows)],
+            format='csr')
+    counts.eliminate_zeros()
+    return counts
+
+
+class _TableRows:
+    """Features x samples counts of a table, as CSR row slices on demand.
+
+    Slicing a row range converts only those rows, so a consumer that walks
+    the table range by range (such as the shard writer) never holds the
+    whole matrix. `keep` selects the sample columns, `rows` the features.
+    """
+
+    def __init__(self, table, keep, rows=None):
+        self.table = table
+        self.keep = keep
+        self.rows = np.arange(table.shape[0]) if rows is None else rows
+        self.shape = (len(self.rows), int(keep.sum()))
+
+    def __getitem__(self, rows):
+        return _feature_matrix(
+            self.table.iloc[self.rows[rows]])[:, self.keep]
+
+
+def _scoring_inputs(table, metadata, decon_method, freq_concentration_column,
+                    prev_control_or_exp_sample_column,
+                    prev_control_sample_indicator, block_rows=None,
+                    stream=False, rows=None):
+    """Counts, sample totals, concentrations and control mask of a table.
+
+    With `stream` the counts are a _TableRows instead of a CSR matrix.
+    `rows` limits the counts to those features; the sample totals are
+    still those of the whole table.
+    """
+    conc, neg = _sample_vectors(metadata, table.columns, decon_method,
+                                freq_concentration_column,
+                                prev_control_or_exp_sample_column,
+                                prev_control_sample_indicator)
+    if stream:
+        totals = table.sum(axis=0).to_numpy(dtype=float)
+        keep = totals > 0
+        counts = _TableRows(table, keep, rows)
+        totals = totals[keep]
+        conc = None if conc is None else conc[keep]
+        neg = None if neg is None else neg[keep]
+        return counts, totals, conc, neg
+    counts = _feature_matrix(table, block_rows)
+    totals = np.asarray(counts.sum(axis=0)).ravel()
+    if rows is not None:
+        counts = counts[rows]
+
+    # isContaminant drops samples without any reads before normalizing
+    keep = totals > 0
+    if not keep.all():
+        counts = counts[:, keep]
+        totals = totals[keep]
+        conc = None if conc is None else conc[keep]
+        neg = None if neg is None else neg[keep]
+    return counts, totals, conc, neg
+
+
+def _feature_rows(counts):
+    return np.repeat(np.arange(counts.shape[0]), np.diff(counts.indptr))
+
+
+def _centered_sum_of_squares(values, rows, n):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        means = np.bincount(rows, weights=values, minlength=len(n)) / n
+    residuals = values - means[rows]
+    return np.bincount(rows, weights=residuals ** 2, minlength=len(n))
+
+
+def _frequency_pvalues(rel, log_conc, rows, n):
+    # isContaminantFrequency compares log(freq) ~ 1 against the contaminant
+    # model log(freq) ~ offset(-log(conc)) over the samples holding the
+    # feature; both fits only need per-feature centered sums of squares.
+    log_freq = np.log(rel)
+    ss0 = _centered_sum_of_squares(log_freq, rows, n)
+    ss1 = _centered_sum_of_squares(log_freq + log_conc, rows, n)
+    dof = n - 1
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pval = stats.f.cdf(ss1 / ss0, dof, dof)
+    pval[n <= 1] = np.nan
+    return pval
+
+
+def _fisher_midp(present_neg, present, n_neg, n_samples, alternative):
+    dist = stats.hypergeom(n_samples, present, n_neg)
+    if alternative == 'greater':
+        tail = dist.sf(present_neg - 1)
+    else:
+        tail = dist.cdf(present_neg)
+    return tail - dist.pmf(present_neg) / 2
+
+
+def _prevalence_pvalues(present_neg, present, n_neg, n_samples,
+                        alternative='greater'):
+    """One-sided test of presence in controls vs. true samples.
+
+    Mirrors isContaminantPrevalence: a continuity-corrected two-proportion
+    z-test, replaced by a mid-p Fisher test wherever prop.test would warn
+    about expected counts below 5. Features present in fewer than two
+    samples get NaN, as decontam returns NA for them.
+    """
+    present_neg = np.asarray(present_neg, dtype=np.int64)
+    present = np.asarray(present, dtype=np.int64)
+    n_pos = n_samples - n_neg
+    present_pos = present - present_neg
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pooled = present / n_samples
+        delta = present_neg / n_neg - present_pos / n_pos
+        yates = np.minimum(0.5, np.abs(delta) / (1 / n_neg + 1 / n_pos))
+        observed = np.stack([present_neg, n_neg - present_neg,
+                             present_pos, n_pos - present_pos])
+        expected = np.stack([n_neg * pooled, n_neg * (1 - pooled),
+                             n_pos * pooled, n_pos * (1 - pooled)])
+        statistic = ((np.abs(observed - expected) - yates) ** 2
+                     / expected).sum(axis=0)
+        z = np.sign(delta) * np.sqrt(statistic)
+    if alternative == 'greater':
+        pval = stats.norm.sf(z)
+    else:
+        pval = stats.norm.cdf(z)
+
+    small = (expected < 5).any(axis=0)
+    if small.any():
+        pval[small] = _fisher_midp(present_neg[small], present[small],
+                                   n_neg, n_samples, alternative)
+    pval[present == n_samples] = 0.5
+    # isContaminantPrevalence leaves features in at most one sample untested
+    pval[present <= 1] = np.nan
+    return pval
+
+
+# Ways of merging p.freq and p.prev into p, as offered by isContaminant.
+# 'either' calls a contaminant when either test does, i.e. when the smaller
+# p-value passes the threshold; 'both' when both do, i.e. the larger one.
+_COMBINATION_RULES = ('combined', 'minimum', 'either', 'both')
+
+
+def _combine_pvalues(p_freq, p_prev, decon_method):
+    if decon_method == 'frequency':
+        return p_freq
+    if decon_method == 'prevalence':
+        return p_prev
+    if decon_method in ('minimum', 'either'):
+        # a feature missing one test is judged on the other
+        return np.fmin(p_freq, p_prev)
+    if decon_method == 'both':
+        return np.maximum(p_freq, p_prev)
+    if decon_method == 'not-contaminant':
+        # p_prev tests for *lower* prevalence in controls; flip it so that,
+        # as everywhere else, a small p marks a contaminant
+        return 1 - p_prev
+    # combined, and 'all', which reports it next to p.freq and p.prev.
+    # Fisher's method over the two p-values, as isContaminant does it
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return stats.chi2.sf(-2 * np.log(p_freq * p_prev), 4)
+
+
+def _score_counts(counts, totals, conc=None, neg=None,
+                  decon_method='prevalence'):
+    """Score every row of a features x samples count matrix.
+
+    `totals` are the per-sample read totals of the whole table, so a row
+    slice is normalized exactly as it would be in the full table. Returns an
+    array with one column per entry of `_SCORE_COLUMNS`.
+    """
+    n_features, n_samples = counts.shape
+    rows = _feature_rows(counts)
+    rel = counts.data / totals[counts.indices]
+    prev = np.diff(counts.indptr)
+
+    freq = np.bincount(rows, weights=rel, minlength=n_features) / n_samples
+    p_freq = np.full(n_features, np.nan)
+    p_prev = np.full(n_features, np.nan)
+    if conc is not None:
+        # isContaminant leaves the negative controls out of the frequency
+        # fit whenever they are given
+        fit = (slice(None) if neg is None
+               else ~np.asarray(neg, dtype=bool)[counts.indices])
+        p_freq = _frequency_pvalues(
+            rel[fit], np.log(conc)[counts.indices][fit], rows[fit],
+            np.bincount(rows[fit], minlength=n_features))
+    if neg is not None:
+        present_neg = np.bincount(rows, weights=neg[counts.indices],
+                                  minlength=n_features)
+        # isNotContaminant asks the opposite question of isContaminant:
+        # is the feature rarer in the controls than in the true samples?
+        alternative = ('less' if decon_method == 'not-contaminant'
+                       else 'greater')
+        p_prev = _prevalence_pvalues(present_neg, prev, int(neg.sum()),
+                                     n_samples, alternative)
+    p = _combine_pvalues(p_freq, p_prev, decon_method)
+    return np.column_stack([freq, prev, p_freq, p_prev, p])
+
+
+def _score_chunks(counts, totals, conc, neg, decon_method, chunk_size=0,
+                  progress=None):
+    scores = []
+    for start, stop in _feature_ranges(counts.shape[0], chunk_size):
+        scores.append(_score_counts(counts[start:stop], totals, conc, neg,
+                                    decon_method))
+        if progress is not None:
+            progress(stop)
+    return np.concatenate(scores)
+
+
+def _scores_frame(scores, feature_ids):
+    df = pd.DataFrame(scores, index=pd.Index(feature_ids, name='#OTU ID'),
+                      columns=_SCORE_COLUMNS)
+    df['prev'] = df['prev'].astype(int)
+    return df
+
+
+def _score_native(table, metadata, decon_method,
+                  freq_concentration_column='NULL',
+                  prev_control_or_exp_sample_column='NULL',
+                  prev_control_sample_indicator='NULL',
+                  chunk_size=0, progress=None):
+    """Vectorized port of decontam's isContaminant (normalize=TRUE).
+
+    `table` has features as rows and samples as columns; `metadata` is a
+    DataFrame indexed by sample id. The result matches the track table that
+    run_decontam.R writes, without the `contaminant` column. With a positive
+    `chunk_size` features are scored in row chunks and `progress` is called
+    with the number of features scored after each one.
+    """
+    counts, totals, conc, neg = _scoring_inputs(
+        table, metadata, decon_method, freq_concentration_column,
+        prev_control_or_exp_sample_column, prev_control_sample_indicator)
+    scores = _score_chunks(counts, totals, conc, neg, decon_method,
+                           chunk_size, progress)
+    return _scores_frame(scores, table.index)
@@ -0,0 +1,380 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2016-2022, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+"""Long-running localhost job service for identify, remove and score-viz.
+
+Start it with::
+
+    python -m q2_decontam._service --port 8765 --work-dir /data/decontam
+
+and talk JSON over HTTP:
+
+``POST /jobs``
+    ``{"action": "identify", "project": "lims-42",
+    "inputs": {"table": "t.qza", "metadata": "m.tsv"},
+    "params": {"decon_method": "prevalence", ...}}`` queues a job and
+    answers with its status. A request identical to one still queued or
+    running (same action, parameters and input file contents) is attached
+    to that job instead of queuing another one.
+``GET /jobs/<job_id>``
+    The job's status; `output` is the path of its result once `done`.
+``GET /health``
+    Queue and worker counts.
+
+Jobs run on a fixed set of worker threads that stay up for the lifetime of
+the service, next to caches of parsed metadata and loaded artifacts. Queued
+jobs are handed out round-robin across projects, so one project submitting
+hundreds of tables does not starve the others.
+"""
+
+import os
+import json
+import time
+import uuid
+import hashlib
+import logging
+import argparse
+import threading
+import collections
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import qiime2
+import pandas as pd
+
+from ._decontamination import decontam_identify, decontam_remove
+from ._threshold_graph import decontam_score_viz
+
+logger = logging.getLogger('q2_decontam')
+
+# Loaded inputs kept warm, least recently used evicted first.
+_CACHE_SIZE = 32
+
+_VIZ_LOCK = threading.Lock()
+
+
+class _Job:
+    def __init__(self, action, project, inputs, params, key):
+        self.job_id = uuid.uuid4().hex
+        self.action = action
+        self.project = project
+        self.inputs = inputs
+        self.params = params
+        self.key = key
+        self.state = 'queued'
+        self.submissions = 1
+        self.output = None
+        self.error = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.done = threading.Event()
+
+    def to_dict(self):
+        return {'job_id': self.job_id, 'action': self.action,
+                'project': self.project, 'state': self.state,
+                'submissions': self.submissions, 'output': self.output,
+                'error': self.error, 'submitted': self.submitted,
+                'started': self.started, 'finished': self.finished}
+
+
+class _FairQueue:
+    """Per-project FIFO queues served round-robin."""
+
+    def __init__(self):
+        self._queues = collections.OrderedDict()
+        self._cond = threading.Condition()
+        self._closed = False
+
+    def __len__(self):
+        with self._cond:
+            return sum(len(queue) for queue in self._queues.values())
+
+    def put(self, job):
+        with self._cond:
+            self._queues.setdefault(job.project, collections.deque()) \
+                .append(job)
+            self._cond.notify()
+
+    def get(self):
+        """Next job, or None once the queue is closed."""
+        with self._cond:
+            while not self._queues and not self._closed:
+                self._cond.wait()
+            if not self._queues:
+                return None
+            project, queue = next(iter(self._queues.items()))
+            job = queue.popleft()
+            # the project goes to the back of the rotation
+            del self._queues[project]
+            if queue:
+                self._queues[project] = queue
+            return job
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
+class _Cache:
+    """LRU cache of loaded files, invalidated when a file changes."""
+
+    def __init__(self, size=_CACHE_SIZE):
+        self.size = size
+        self.hits = 0
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path, loader):
+        stat = os.stat(path)
+        key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size,
+               loader.__name__)
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return self._items[key]
+        value = loader(path)
+        with self._lock:
+            self._items[key] = value
+            while len(self._items) > self.size:
+                self._items.popitem(last=False)
+        return value
+
+
+def _load_metadata(path):
+    if path.endswith('.qza'):
+        return qiime2.Artifact.load(path).view(qiime2.Metadata)
+    return qiime2.Metadata.load(path)
+
+
+def _load_table(path):
+    return qiime2.Artifact.load(path).view(pd.DataFrame)
+
+
+def _file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fh:
+        for block in iter(lambda: fh.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _run_identify(service, job, out_dir):
+    ff = decontam_identify(service.table(job.inputs['table']),
+                           service.metadata(job.inputs['metadata']),
+                           **job.params)
+    artifact = qiime2.Artifact.import_data('FeatureData[DecontamScore]', ff)
+    return artifact.save(os.path.join(out_dir, 'score_table.qza'))
+
+
+def _run_remove(service, job, out_dir):
+    table = decontam_remove(service.metadata(job.inputs['score_table']),
+                            service.table(job.inputs['table']),
+                            **job.params)
+    artifact = qiime2.Artifact.import_data('FeatureTable[Frequency]', table)
+    return artifact.save(os.path.join(out_dir,
+                                      'no_contaminant_asv_table.qza'))
+
+
+def _run_viz(service, job, out_dir):
+    viz_dir = os.path.join(out_dir, 'visualization')
+    os.makedirs(viz_dir)
+    # the histogram is drawn on pyplot's global figure
+    with _VIZ_LOCK:
+        decontam_score_viz(viz_dir,
+                           service.metadata(job.inputs['score_table']),
+                           service.table(job.inputs['table']), **job.params)
+    return viz_dir
+
+
+_ACTIONS = {
+    'identify': (_run_identify, ('table', 'metadata')),
+    'remove': (_run_remove, ('score_table', 'table')),
+    'viz': (_run_viz, ('score_table', 'table')),
+}
+
+
+class DecontamService:
+    def __init__(self, work_dir, host='127.0.0.1', port=0, workers=2):
+        self.work_dir = work_dir
+        self.host = host
+        self.port = port
+        self.n_workers = workers
+        self.jobs = {}
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._queue = _FairQueue()
+        self._cache = _Cache()
+        self._workers = []
+        self._server = None
+        self._server_thread = None
+        os.makedirs(work_dir, exist_ok=True)
+
+    def metadata(self, path):
+        return self._cache.get(path, _load_metadata)
+
+    def table(self, path):
+        return self._cache.get(path, _load_table)
+
+    def _request_key(self, action, inputs, params):
+        contents = {name: _file_digest(path) for name, path in inputs.items()}
+        payload = json.dumps([action, contents, params], sort_keys=True)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def submit(self, request):
+        """Queue a job, or join an identical one. Returns (job, joined)."""
+        action = request.get('action')
+        if action not in _ACTIONS:
+            raise ValueError('Unknown action %r, expected one of %s.'
+                             % (action, ', '.join(sorted(_ACTIONS))))
+        inputs = dict(request.get('inputs') or {})
+        missing = set(_ACTIONS[action][1]) - set(inputs)
+        if missing:
+            raise ValueError('A %s job needs the inputs %s.'
+                             % (action, ', '.join(sorted(missing))))
+        for path in inputs.values():
+            if not os.path.exists(path):
+                raise ValueError('Input %r does not exist.' % path)
+        params = dict(request.get('params') or {})
+        project = str(request.get('project', 'default'))
+        key = self._request_key(action, inputs, params)
+
+        with self._lock:
+            job = self._in_flight.get(key)
+            if job is not None:
+                job.submissions += 1
+                return job, True
+            job = _Job(action, project, inputs, params, key)
+            self.jobs[job.job_id] = job
+            self._in_flight[key] = job
+        self._queue.put(job)
+        return job, False
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            job.state = 'running'
+            job.started = time.time()
+            out_dir = os.path.join(self.work_dir, job.job_id)
+            try:
+                os.makedirs(out_dir)
+                run, _ = _ACTIONS[job.action]
+                job.output = run(self, job, out_dir)
+                job.state = 'done'
+            except Exception as e:
+                logger.exception('Job %s (%s) failed', job.job_id,
+                                 job.action)
+                job.error = '%s: %s' % (type(e).__name__, e)
+                job.state = 'failed'
+            finally:
+                job.finished = time.time()
+                with self._lock:
+                    self._in_flight.pop(job.key, None)
+                job.done.set()
+
+    def health(self):
+        states = collections.Counter(job.state for job in self.jobs.values())
+        return {'workers': self.n_workers, 'queued': len(self._queue),
+                'running': states['running'], 'done': states['done'],
+                'failed': states['failed'], 'cache_hits': self._cache.hits}
+
+    def start(self):
+        for index in range(self.n_workers):
+            worker = threading.Thread(target=self._work, daemon=True,
+                                      name='q2-decontam-job-%d' % index)
+            worker.start()
+            self._workers.append(worker)
+        self._server = ThreadingHTTPServer((self.host, self.port),
+                                           _RequestHandler)
+        self._server.service = self
+        self.port = self._server.server_address[1]
+        self._server_thread = threading.Thread(
+            target=self._server.serve_forever, daemon=True,
+            name='q2-decontam-http')
+        self._server_thread.start()
+        logger.info('decontam service listening on http://%s:%d',
+                    self.host, self.port)
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server_thread.join()
+        self._queue.close()
+        for worker in self._workers:
+            worker.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+        return False
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    def _send(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        service = self.server.service
+        if self.path == '/health':
+            return self._send(200, service.health())
+        if self.path.startswith('/jobs/'):
+            job = service.jobs.get(self.path[len('/jobs/'):])
+            if job is not None:
+                return self._send(200, job.to_dict())
+        self._send(404, {'error': 'Not found: %s' % self.path})
+
+    def do_POST(self):
+        if self.path != '/jobs':
+            return self._send(404, {'error': 'Not found: %s' % self.path})
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length) or b'{}')
+            job, joined = self.server.service.submit(request)
+        except ValueError as e:
+            return self._send(400, {'error': str(e)})
+        self._send(200 if joined else 202, dict(job.to_dict(),
+                                                deduplicated=joined))
+
+    def log_message(self, format, *args):
+        logger.debug('%s - %s', self.address_string(), format % args)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m q2_decontam._service',
+        description='Serve decontam identify/remove/viz jobs over HTTP.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--work-dir', required=True,
+                        help='directory job outputs are written to')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    service = DecontamService(args.work_dir, args.host, args.port,
+                              args.workers).start()
+    try:
+        service._server_thread.join()
+    except KeyboardInterrupt:
+        service.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,343 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2016-2022, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+"""File-based work queue for scoring a table as feature-range shards.
+
+A coordinator writes the shards and a manifest to a directory on shared
+storage. Workers on any host that can see the directory run::
+
+    python -m q2_decontam._sharding worker <shard_dir>
+
+and claim shards by atomically creating `<shard>.lock`. A worker touches its
+lock while scoring; a lock that has not been touched for `lock_timeout`
+seconds belongs to a dead worker and is reclaimed by the next worker to see
+it. Failed attempts are appended to `<shard>.errors` and a shard is given up
+on after `max_attempts` of them. The coordinator merges the `<shard>.npy`
+results once every shard has one.
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import logging
+import argparse
+import threading
+import subprocess
+
+import numpy as np
+import scipy.sparse
+
+from ._scoring import _score_counts
+
+logger = logging.getLogger('q2_decontam')
+
+MANIFEST = 'manifest.json'
+_INPUTS = 'inputs.npz'
+
+# Features per shard unless the caller asks for something else.
+_SHARD_FEATURES = 10000
+_LOCK_TIMEOUT = 60.0
+_MAX_ATTEMPTS = 3
+_POLL_INTERVAL = 1.0
+
+
+def _shard_name(index):
+    return 'shard-%05d' % index
+
+
+def _shard_path(shard_dir, index, suffix):
+    return os.path.join(shard_dir, _shard_name(index) + suffix)
+
+
+def _atomic_save(path, save, *args, **kwargs):
+    tmp = '%s.tmp.%d' % (path, os.getpid())
+    with open(tmp, 'wb') as fh:
+        save(fh, *args, **kwargs)
+    os.replace(tmp, path)
+
+
+def _write_shards(shard_dir, counts, totals, conc, neg, decon_method,
+                  shard_size=_SHARD_FEATURES, lock_timeout=_LOCK_TIMEOUT,
+                  max_attempts=_MAX_ATTEMPTS):
+    """Split features x samples counts into shards under `shard_dir`.
+
+    `counts` is a CSR matrix or a _TableRows; with the latter each shard is
+    converted from the table as it is written, so the coordinator never
+    holds the whole matrix.
+    """
+    if os.path.exists(os.path.join(shard_dir, MANIFEST)):
+        raise ValueError('%r already holds a shard manifest; use an empty '
+                         'directory for every sharded run.' % shard_dir)
+    os.makedirs(shard_dir, exist_ok=True)
+
+    inputs = {'totals': totals}
+    if conc is not None:
+        inputs['conc'] = conc
+    if neg is not None:
+        inputs['neg'] = neg
+    _atomic_save(os.path.join(shard_dir, _INPUTS), np.savez, **inputs)
+
+    n_features = counts.shape[0]
+    shard_size = max(int(shard_size), 1)
+    ranges = [(start, min(start + shard_size, n_features))
+              for start in range(0, n_features, shard_size)]
+    for index, (start, stop) in enumerate(ranges):
+        shard = counts[start:stop]
+        _atomic_save(_shard_path(shard_dir, index, '.npz'), np.savez,
+                     data=shard.data, indices=shard.indices,
+                     indptr=shard.indptr, shape=np.array(shard.shape))
+
+    manifest = {'decon_method': decon_method,
+                'n_features': n_features,
+                'n_samples': counts.shape[1],
+                'shards': ranges,
+                'lock_timeout': lock_timeout,
+                'max_attempts': max_attempts}
+    # written last: workers treat a directory without one as not ready
+    _atomic_save(os.path.join(shard_dir, MANIFEST),
+                 lambda fh: fh.write(json.dumps(manifest).encode()))
+    return manifest
+
+
+def _read_manifest(shard_dir):
+    with open(os.path.join(shard_dir, MANIFEST)) as fh:
+        return json.load(fh)
+
+
+def _attempts(shard_dir, index):
+    try:
+        with open(_shard_path(shard_dir, index, '.errors')) as fh:
+            return fh.read().splitlines()
+    except FileNotFoundError:
+        return []
+
+
+def _shard_state(shard_dir, index, max_attempts):
+    if os.path.exists(_shard_path(shard_dir, index, '.npy')):
+        return 'done'
+    if len(_attempts(shard_dir, index)) >= max_attempts:
+        return 'failed'
+    return 'pending'
+
+
+def _lock_age(path):
+    return time.time() - os.stat(path).st_mtime
+
+
+def _claim(shard_dir, index, worker_id, lock_timeout, max_attempts):
+    """Take the lock on a shard, reclaiming it if its holder went silent."""
+    lock = _shard_path(shard_dir, index, '.lock')
+    try:
+        age = _lock_age(lock)
+    except FileNotFoundError:
+        pass
+    else:
+        if age < lock_timeout:
+            return False
+        stale = '%s.stale.%s' % (lock, worker_id)
+        try:
+            # only one of the workers racing for a stale lock wins the rename
+            os.rename(lock, stale)
+        except FileNotFoundError:
+            return False
+        if _lock_age(stale) < lock_timeout:
+            # another worker reclaimed it between our stat and rename
+            os.rename(stale, lock)
+            return False
+        with open(stale) as fh:
+            holder = fh.read().strip()
+        os.remove(stale)
+        _record_failure(shard_dir, index, 'lock held by %s went stale'
+                        % (holder or 'an unknown worker'))
+    if _shard_state(shard_dir, index, max_attempts) != 'pending':
+        return False
+    try:
+        fd = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        return False
+    with os.fdopen(fd, 'w') as fh:
+        fh.write(worker_id)
+    if _shard_state(shard_dir, index, max_attempts) != 'pending':
+        # finished by another worker while we were claiming it
+        os.remove(lock)
+        return False
+    return True
+
+
+def _record_failure(shard_dir, index, message):
+    with open(_shard_path(shard_dir, index, '.errors'), 'a') as fh:
+        fh.write(message.replace('\n', ' ') + '\n')
+
+
+class _Heartbeat(threading.Thread):
+    def __init__(self, path, interval):
+        super().__init__(name='q2-decontam-heartbeat', daemon=True)
+        self.path = path
+        self.interval = interval
+        self._halt = threading.Event()
+
+    def run(self):
+        while not self._halt.wait(self.interval):
+            try:
+                os.utime(self.path)
+            except FileNotFoundError:
+                return
+
+    def stop(self):
+        self._halt.set()
+        self.join()
+
+
+def _score_shard(shard_dir, index, manifest, inputs):
+    with np.load(_shard_path(shard_dir, index, '.npz')) as shard:
+        counts = scipy.sparse.csr_matrix(
+            (shard['data'], shard['indices'], shard['indptr']),
+            shape=tuple(shard['shape']))
+    scores = _score_counts(counts, inputs['totals'], inputs.get('conc'),
+                           inputs.get('neg'), manifest['decon_method'])
+    _atomic_save(_shard_path(shard_dir, index, '.npy'), np.save, scores)
+
+
+def _run_worker(shard_dir, worker_id=None, poll_interval=_POLL_INTERVAL,
+                max_shards=None):
+    """Claim and score shards until every shard is done or given up on.
+
+    Returns the number of shards this worker scored.
+    """
+    if worker_id is None:
+        worker_id = '%s:%d' % (socket.gethostname(), os.getpid())
+    while not os.path.exists(os.path.join(shard_dir, MANIFEST)):
+        time.sleep(poll_interval)
+    manifest = _read_manifest(shard_dir)
+    with np.load(os.path.join(shard_dir, _INPUTS)) as npz:
+        inputs = {name: npz[name] for name in npz.files}
+    lock_timeout = manifest['lock_timeout']
+    max_attempts = manifest['max_attempts']
+
+    scored = 0
+    while max_shards is None or scored < max_shards:
+        pending = [index for index in range(len(manifest['shards']))
+                   if _shard_state(shard_dir, index, max_attempts)
+                   == 'pending']
+        if not pending:
+            break
+        claimed = next((index for index in pending
+                        if _claim(shard_dir, index, worker_id,
+                                  lock_timeout, max_attempts)), None)
+        if claimed is None:
+            # everything left is locked by live workers; wait them out
+            time.sleep(poll_interval)
+            continue
+        lock = _shard_path(shard_dir, claimed, '.lock')
+        heartbeat = _Heartbeat(lock, lock_timeout / 4)
+        heartbeat.start()
+        try:
+            _score_shard(shard_dir, claimed, manifest, inputs)
+            scored += 1
+        except Exception as e:
+            logger.warning('Worker %s failed on %s: %r', worker_id,
+                           _shard_name(claimed), e)
+            _record_failure(shard_dir, claimed, '%s: %r' % (worker_id, e))
+        finally:
+            heartbeat.stop()
+            try:
+                os.remove(lock)
+            except FileNotFoundError:
+                pass  # reclaimed as stale while we were still scoring
+    return scored
+
+
+def _worker_command(shard_dir):
+    return [sys.executable, '-m', 'q2_decontam._sharding', 'worker',
+            shard_dir]
+
+
+def _wait_for_shards(shard_dir, manifest, workers=(), progress=None,
+                     poll_interval=_POLL_INTERVAL):
+    """Block until every shard is done, scoring shards in-process whenever
+    no launched worker is left alive to do it."""
+    shards = manifest['shards']
+    while True:
+        states = [_shard_state(shard_dir, index, manifest['max_attempts'])
+                  for index in range(len(shards))]
+        if progress is not None:
+            progress(sum(stop - start for (start, stop), state
+                         in zip(shards, states) if state == 'done'))
+        failed = [index for index, state in enumerate(states)
+                  if state == 'failed']
+        if failed:
+            raise RuntimeError(
+                '%d shard(s) failed %d times and were given up on, e.g. %s: '
+                '%s' % (len(failed), manifest['max_attempts'],
+                        _shard_name(failed[0]),
+                        _attempts(shard_dir, failed[0])[-1]))
+        if all(state == 'done' for state in states):
+            return
+        if workers and all(worker.poll() is not None for worker in workers):
+            # launched workers exit only once nothing is pending, or crash
+            workers = ()
+        if not workers:
+            _run_worker(shard_dir, poll_interval=poll_interval, max_shards=1)
+        else:
+            time.sleep(poll_interval)
+
+
+def _merge_shards(shard_dir, manifest):
+    return np.concatenate(
+        [np.load(_shard_path(shard_dir, index, '.npy'))
+         for index in range(len(manifest['shards']))])
+
+
+def _score_sharded(counts, totals, conc, neg, decon_method, shard_dir,
+                   local_workers=0, shard_size=_SHARD_FEATURES,
+                   lock_timeout=_LOCK_TIMEOUT, max_attempts=_MAX_ATTEMPTS,
+                   progress=None, poll_interval=_POLL_INTERVAL):
+    """Coordinate a sharded scoring run and return the merged scores.
+
+    `local_workers` worker processes are launched on this host; any number
+    of remote workers may join through the same `shard_dir`. With no
+    workers at all the coordinator scores the shards itself.
+    """
+    manifest = _write_shards(shard_dir, counts, totals, conc, neg,
+                             decon_method, shard_size, lock_timeout,
+                             max_attempts)
+    workers = [subprocess.Popen(_worker_command(shard_dir))
+               for _ in range(local_workers)]
+    try:
+        _wait_for_shards(shard_dir, manifest, workers, progress,
+                         poll_interval)
+    finally:
+        for worker in workers:
+            if worker.poll() is None:
+                worker.terminate()
+            worker.wait()
+    return _merge_shards(shard_dir, manifest)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m q2_decontam._sharding',
+        description='Score shards of a sharded decontam identify run.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    worker = subparsers.add_parser('worker', help='claim and score shards '
+                                   'until none are left')
+    worker.add_argument('shard_dir')
+    worker.add_argument('--worker-id', default=None)
+    worker.add_argument('--poll-interval', type=float,
+                        default=_POLL_INTERVAL)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    scored = _run_worker(args.shard_dir, args.worker_id, args.poll_interval)
+    logger.info('Scored %d shard(s) in %s', scored, args.shard_dir)
+
+
+if __name__ == '__main__':
+    main()
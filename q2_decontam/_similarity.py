@@ -0,0 +1,128 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2016-2022, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import qiime2
+import numpy as np
+import pandas as pd
+
+from ._scoring import _feature_matrix
+from ._prefilter import _control_samples
+from ._report import RunReport, _table_info
+from ._stats import _CONTROL_SIMILARITY_COLUMNS
+
+# Features converted to sparse at a time, so the table is never densified.
+_BLOCK_ROWS = 4096
+# Controls whose similarity rows are held at once, as dense
+# controls x samples blocks.
+_CONTROL_BLOCK = 256
+
+
+def _sample_matrix(table):
+    """Samples x features CSR matrix of relative abundances."""
+    counts = _feature_matrix(table, block_rows=_BLOCK_ROWS).T.tocsr()
+    totals = np.asarray(counts.sum(axis=1)).ravel()
+    # samples without reads have no stored entries to divide
+    counts.data /= np.repeat(totals, np.diff(counts.indptr))
+    return counts
+
+
+def _jaccard_rows(matrix, controls):
+    """Jaccard similarity of presence between `controls` and all samples."""
+    present = matrix.copy()
+    present.data = np.ones_like(present.data)
+    sizes = np.diff(present.indptr)
+    for start in range(0, len(controls), _CONTROL_BLOCK):
+        block = controls[start:start + _CONTROL_BLOCK]
+        shared = (present[block] @ present.T).toarray()
+        union = sizes[block][:, None] + sizes[None, :] - shared
+        with np.errstate(divide='ignore', invalid='ignore'):
+            yield block, np.where(union > 0, shared / union, 0.0)
+
+
+def _braycurtis_rows(matrix, controls):
+    """1 - Bray-Curtis dissimilarity of relative abundances.
+
+    With profiles summing to 1 this is the summed elementwise minimum, which
+    only involves the features present in the control: for each control the
+    matching columns are sliced out of a CSC copy and reduced per sample.
+    """
+    by_feature = matrix.tocsc()
+    n_samples = matrix.shape[0]
+    for start in range(0, len(controls), _CONTROL_BLOCK):
+        block = controls[start:start + _CONTROL_BLOCK]
+        similarity = np.zeros((len(block), n_samples))
+        for row, control in enumerate(block):
+            lo, hi = matrix.indptr[control], matrix.indptr[control + 1]
+            features, values = matrix.indices[lo:hi], matrix.data[lo:hi]
+            columns = by_feature[:, features]
+            control_values = np.repeat(values, np.diff(columns.indptr))
+            similarity[row] = np.bincount(
+                columns.indices,
+                weights=np.minimum(columns.data, control_values),
+                minlength=n_samples)
+        yield block, similarity
+
+
+_METRICS = {'braycurtis': _braycurtis_rows, 'jaccard': _jaccard_rows}
+
+
+def _top_similar(similarity_rows, sample_ids, neg, top_k):
+    records = []
+    for block, similarity in similarity_rows:
+        # a control is trivially most similar to itself
+        similarity[np.arange(len(block)), block] = -np.inf
+        k = min(top_k, similarity.shape[1] - 1)
+        if k <= 0:
+            continue
+        top = np.argpartition(-similarity, k - 1, axis=1)[:, :k]
+        for row, control in enumerate(block):
+            order = top[row][np.argsort(-similarity[row, top[row]],
+                                        kind='stable')]
+            for rank, sample in enumerate(order, start=1):
+                records.append((sample_ids[control], rank,
+                                sample_ids[sample],
+                                similarity[row, sample], bool(neg[sample])))
+    return pd.DataFrame.from_records(records,
+                                     columns=_CONTROL_SIMILARITY_COLUMNS)
+
+
+def decontam_control_similarity(asv_or_otu_table: pd.DataFrame,
+                                meta_data: qiime2.Metadata,
+                                prev_control_or_exp_sample_column: str,
+                                prev_control_sample_indicator: str,
+                                metric: str = 'braycurtis',
+                                top_k: int = 10) -> pd.DataFrame:
+    """The `top_k` samples most similar to each negative control.
+
+    High similarity between a control and a biological sample, especially a
+    neighbouring one, points at cross-contamination (well-to-well leakage).
+    Similarities are computed from a sparse samples x features matrix, so
+    the cost follows the nonzero counts and the number of controls; no
+    samples x samples matrix is ever built.
+    """
+    if metric not in _METRICS:
+        raise ValueError('Unknown metric %r, expected one of %s.'
+                         % (metric, ', '.join(sorted(_METRICS))))
+    with RunReport('decontam_control_similarity', metric=metric, top_k=top_k,
+                   matrix=_table_info(asv_or_otu_table)) as report:
+        neg = _control_samples(meta_data.to_dataframe(),
+                               asv_or_otu_table.columns,
+                               prev_control_or_exp_sample_column,
+                               prev_control_sample_indicator)
+        if not neg.any():
+            raise ValueError('Indicator %r does not match any of the samples '
+                             'in column %r.'
+                             % (prev_control_sample_indicator,
+                                prev_control_or_exp_sample_column))
+        with report.stage('sample_matrix'):
+            matrix = _sample_matrix(asv_or_otu_table)
+        with report.stage('similarity'):
+            df = _top_similar(_METRICS[metric](matrix, np.flatnonzero(neg)),
+                              asv_or_otu_table.columns, neg, top_k)
+        report.update(controls=int(neg.sum()))
+        return df
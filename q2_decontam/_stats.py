@@ -6,8 +6,9 @@
 # The full license is in the file LICENSE, distributed with this software.
 # ----------------------------------------------------------------------------
 
-from qiime2.plugin import SemanticType, model
+from qiime2.plugin import SemanticType, ValidationError, model
 from q2_types.feature_data import FeatureData
+from q2_types.sample_data import SampleData
 
 #defines types for scoretable
 DecontamScore = SemanticType('DecontamScore', variant_of=FeatureData.field['type'])
@@ -16,4 +17,64 @@ class DecontamScoreFormat(model.TextFileFormat):
         pass
 
 DecontamScoreDirFmt = model.SingleFileDirectoryFormat(
-    'DecontamScoreDirFmt', 'stats.tsv', DecontamScoreFormat)
\ No newline at end of file
+    'DecontamScoreDirFmt', 'stats.tsv', DecontamScoreFormat)
+
+#defines types for the control similarity table
+ControlSimilarity = SemanticType('ControlSimilarity',
+                                 variant_of=SampleData.field['type'])
+
+_CONTROL_SIMILARITY_COLUMNS = ['control', 'rank', 'sample', 'similarity',
+                               'sample_is_control']
+
+
+class ControlSimilarityFormat(model.TextFileFormat):
+    def validate(self, *args):
+        with self.open() as fh:
+            header = fh.readline().rstrip('\n').split('\t')
+        if header != _CONTROL_SIMILARITY_COLUMNS:
+            raise ValidationError('Expected the columns %s, found %s.'
+                                  % (_CONTROL_SIMILARITY_COLUMNS, header))
+
+ControlSimilarityDirFmt = model.SingleFileDirectoryFormat(
+    'ControlSimilarityDirFmt', 'similarity.tsv', ControlSimilarityFormat)
+
+
+#defines types for the well leakage table
+WellLeakage = SemanticType('WellLeakage',
+                           variant_of=FeatureData.field['type'])
+
+
+class WellLeakageFormat(model.TextFileFormat):
+    def validate(*args):
+        pass
+
+WellLeakageDirFmt = model.SingleFileDirectoryFormat(
+    'WellLeakageDirFmt', 'leakage.tsv', WellLeakageFormat)
+
+
+#defines types for the per-sample contaminant fraction table
+ContaminantFraction = SemanticType('ContaminantFraction',
+                                   variant_of=SampleData.field['type'])
+
+
+class ContaminantFractionFormat(model.TextFileFormat):
+    def validate(*args):
+        pass
+
+ContaminantFractionDirFmt = model.SingleFileDirectoryFormat(
+    'ContaminantFractionDirFmt', 'fractions.tsv', ContaminantFractionFormat)
+
+
+#defines types for the contaminant reference k-mer index
+ContaminantKmerIndex = SemanticType('ContaminantKmerIndex')
+
+
+class ContaminantKmerIndexFormat(model.BinaryFileFormat):
+    def validate(self, *args):
+        # the index is a NumPy .npz archive, i.e. a zip file
+        with self.open() as fh:
+            if fh.read(4) != b'PK\x03\x04':
+                raise ValidationError('Not a k-mer index (.npz) file.')
+
+ContaminantKmerIndexDirFmt = model.SingleFileDirectoryFormat(
+    'ContaminantKmerIndexDirFmt', 'index.npz', ContaminantKmerIndexFormat)
@@ -17,11 +17,16 @@ import seaborn as sns
 import qiime2
 import q2_decontam
 from itertools import repeat
+from .._report import _reported, _table_info
 
 _BOOLEAN = (lambda x: type(x) is bool, 'True or False')
 
 TEMPLATES = pkg_resources.resource_filename('q2_decontam._threshold_graph',
                                             'assets')
+@_reported('decontam_score_viz', lambda args: {
+    'threshold': args['threshold'], 'weighted': args['weighted'],
+    'bin_size': args['bin_size'],
+    'matrix': _table_info(args['asv_or_otu_table'])})
 def decontam_score_viz(output_dir, decon_identify_table: qiime2.Metadata, asv_or_otu_table: pd.DataFrame, threshold: float=0.1, weighted: bool=True, bin_size: float=0.02):
 
 
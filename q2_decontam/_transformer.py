@@ -1,6 +1,9 @@
 import qiime2
 import pandas as pd
-from q2_decontam import DecontamScoreFormat
+from q2_decontam import (DecontamScoreFormat, ControlSimilarityFormat,
+                         WellLeakageFormat, ContaminantFractionFormat,
+                         ContaminantKmerIndexFormat)
+from q2_decontam._kmers import KmerIndex
 from q2_decontam.plugin_setup import plugin
 import collections
 
@@ -45,3 +48,54 @@ def _3(df: pd.DataFrame) -> DecontamScoreFormat:
 def _4(ff: DecontamScoreFormat) -> pd.DataFrame:
     return _DecontamScore_to_df(ff)
 
+
+@plugin.register_transformer
+def _5(df: pd.DataFrame) -> ControlSimilarityFormat:
+    ff = ControlSimilarityFormat()
+    df.to_csv(str(ff), sep='\t', header=True, index=False)
+    return ff
+
+@plugin.register_transformer
+def _6(ff: ControlSimilarityFormat) -> pd.DataFrame:
+    return pd.read_csv(str(ff), sep='\t', dtype={'control': str,
+                                                  'sample': str})
+
+@plugin.register_transformer
+def _7(df: pd.DataFrame) -> WellLeakageFormat:
+    ff = WellLeakageFormat()
+    df.to_csv(str(ff), sep='\t', header=True, index=True)
+    return ff
+
+@plugin.register_transformer
+def _8(ff: WellLeakageFormat) -> pd.DataFrame:
+    return qiime2.Metadata.load(str(ff)).to_dataframe()
+
+@plugin.register_transformer
+def _9(ff: WellLeakageFormat) -> qiime2.Metadata:
+    return qiime2.Metadata.load(str(ff))
+
+@plugin.register_transformer
+def _10(df: pd.DataFrame) -> ContaminantFractionFormat:
+    ff = ContaminantFractionFormat()
+    df.to_csv(str(ff), sep='\t', header=True, index=True)
+    return ff
+
+@plugin.register_transformer
+def _11(ff: ContaminantFractionFormat) -> pd.DataFrame:
+    return qiime2.Metadata.load(str(ff)).to_dataframe()
+
+@plugin.register_transformer
+def _12(ff: ContaminantFractionFormat) -> qiime2.Metadata:
+    return qiime2.Metadata.load(str(ff))
+
+@plugin.register_transformer
+def _13(index: KmerIndex) -> ContaminantKmerIndexFormat:
+    ff = ContaminantKmerIndexFormat()
+    with ff.open() as fh:
+        index.save(fh)
+    return ff
+
+@plugin.register_transformer
+def _14(ff: ContaminantKmerIndexFormat) -> KmerIndex:
+    with ff.open() as fh:
+        return KmerIndex.load(fh)
@@ -17,8 +17,18 @@ from q2_types.feature_table import FeatureTable, Frequency
 
 import q2_decontam
 from q2_decontam import DecontamScore, DecontamScoreFormat, DecontamScoreDirFmt
+from q2_decontam import (ControlSimilarity, ControlSimilarityFormat,
+                         ControlSimilarityDirFmt, WellLeakage,
+                         WellLeakageFormat, WellLeakageDirFmt,
+                         ContaminantFraction, ContaminantFractionFormat,
+                         ContaminantFractionDirFmt, ContaminantKmerIndex,
+                         ContaminantKmerIndexFormat,
+                         ContaminantKmerIndexDirFmt)
+from q2_decontam._scoring import _COMBINATION_RULES
 
-_DECON_METHOD_OPT = {'frequency', 'prevalence', 'combined'}
+_DECON_METHOD_OPT = {'frequency', 'prevalence', 'combined', 'all',
+                     'not-contaminant'}
+_SCORING_BACKEND_OPT = {'r', 'native'}
 
 plugin = qiime2.plugin.Plugin(
     name='decontam',
@@ -33,28 +43,117 @@ plugin = qiime2.plugin.Plugin(
 
 plugin.methods.register_function(
     function=q2_decontam.decontam_identify,
-    inputs={'asv_or_otu_table': FeatureTable[Frequency]},
+    inputs={'asv_or_otu_table': FeatureTable[Frequency],
+            'representative_sequences': FeatureData[Sequence],
+            'contaminant_index': ContaminantKmerIndex},
     parameters={ 'meta_data': Metadata,
                 'decon_method': qiime2.plugin.Str %
                 qiime2.plugin.Choices(_DECON_METHOD_OPT),
                 'freq_concentration_column': qiime2.plugin.Str,
                 'prev_control_or_exp_sample_column': qiime2.plugin.Str,
-                'prev_control_sample_indicator': qiime2.plugin.Str,},
+                'prev_control_sample_indicator': qiime2.plugin.Str,
+                'scoring_backend': qiime2.plugin.Str %
+                qiime2.plugin.Choices(_SCORING_BACKEND_OPT),
+                'n_jobs': qiime2.plugin.Int % qiime2.plugin.Range(1, None),
+                'shard_dir': qiime2.plugin.Str,
+                'shard_workers': qiime2.plugin.Int %
+                qiime2.plugin.Range(0, None),
+                'checkpoint_dir': qiime2.plugin.Str,
+                'max_memory': qiime2.plugin.Str,
+                'dry_run': qiime2.plugin.Bool,
+                'min_prevalence': qiime2.plugin.Int %
+                qiime2.plugin.Range(0, None),
+                'min_reads': qiime2.plugin.Int % qiime2.plugin.Range(0, None),
+                'exclude_control_only': qiime2.plugin.Bool,
+                'feature_groups': MetadataColumn[Categorical],
+                'prev_control_sample_indicators': List[Str],
+                'kmer_min_fraction': qiime2.plugin.Float %
+                qiime2.plugin.Range(0, 1, inclusive_end=True)},
     outputs=[('score_table', FeatureData[DecontamScore])],
     input_descriptions={
         'asv_or_otu_table': ('Table with presence counts in the matrix '
                              'rownames are sample id and column names are'
-                             'seqeunce id')
+                             'seqeunce id'),
+        'representative_sequences': ('Sequences of the features, matched '
+                                     'against contaminant_index'),
+        'contaminant_index': ('K-mer index of known kit and reagent '
+                              'contaminant sequences, from '
+                              'build-kmer-index. Adds kmer_fraction, '
+                              'kmer_reference and prior_contaminant '
+                              'columns to the score table')
     },
     parameter_descriptions={
         'meta_data': ('metadata file indicating which samples in the '
                            'experiment are control samples, '
                            'assumes sample names in file correspond '
                            'to ASV_or_OTU_table'),
-        'decon_method': ('Select how to which method to id contaminants with'),
+        'decon_method': ('Select how to which method to id contaminants with. '
+                         'all scores frequency, prevalence and combined in '
+                         'one pass and keeps p.freq, p.prev and p.combined, '
+                         'with p set to p.combined. not-contaminant runs '
+                         "isNotContaminant's prevalence test for low-biomass "
+                         'samples (native backend only): p.not is small for '
+                         'features confidently not contaminants, and p is '
+                         '1 - p.not, so remove at threshold 0.5 matches its '
+                         'default call'),
         'freq_concentration_column': ('Input column name that has concentration information for the samples'),
         'prev_control_or_exp_sample_column': ('Input column name containing experimental or control sample metadata'),
-        'prev_control_sample_indicator': ('indicate the control sample identifier')
+        'prev_control_sample_indicator': ('indicate the control sample identifier'),
+        'scoring_backend': ('Score with the decontam R package (r) or with the '
+                            'vectorized Python port of isContaminant (native)'),
+        'n_jobs': ('Number of worker processes to score features with, '
+                   'sharing the table through shared memory (native backend '
+                   'only)'),
+        'shard_dir': ('Empty directory on shared storage to split the table '
+                      'into feature-range shards in. Shards are scored by '
+                      'workers started with `python -m q2_decontam._sharding '
+                      'worker <shard_dir>` on any host that can see it, and '
+                      'merged once all are done (native backend only)'),
+        'shard_workers': ('Number of shard workers to start on this host; '
+                          'with none, and no remote workers, shards are '
+                          'scored by this process'),
+        'checkpoint_dir': ('Directory to persist scored feature chunks in. '
+                           'Rerunning with the same inputs and parameters '
+                           'resumes from the chunks already completed; a '
+                           'directory from a different run is rejected'),
+        'max_memory': ('Memory budget for the run, e.g. 8GB. Peak usage is '
+                       'estimated from the table shape and nonzero count, '
+                       'and dense or blockwise sparse handling and a chunk '
+                       'size are chosen to fit it; the run fails up front if '
+                       'nothing fits'),
+        'dry_run': ('Print the execution plan (estimated memory, chunks and '
+                    'runtime) and return an empty score table instead of '
+                    'scoring'),
+        'min_prevalence': ('Features present in fewer samples are not scored; '
+                           'they are kept in the score table with status '
+                           'low_prevalence and no p-values. With any of '
+                           'min_prevalence, min_reads or exclude_control_only '
+                           'set, features without reads are not scored either '
+                           '(status zero_reads)'),
+        'min_reads': ('Features with fewer reads in total are not scored; '
+                      'they are kept with status low_reads and no p-values'),
+        'exclude_control_only': ('Do not score features found only in control '
+                                 'samples; they are kept with status '
+                                 'control_only and a score of 0, i.e. called '
+                                 'contaminants'),
+        'feature_groups': ('Feature metadata column assigning every feature '
+                           'to a group (e.g. a taxon or cluster). Counts are '
+                           'summed per group, groups are scored, and every '
+                           'feature gets the scores of its group, named in a '
+                           'group column'),
+        'prev_control_sample_indicators': ('Identifiers of several control '
+                                           'types (e.g. extraction, PCR and '
+                                           'sequencing blanks), instead of '
+                                           'prev_control_sample_indicator. '
+                                           'Each type is contrasted with the '
+                                           'true samples in one pass, giving '
+                                           'a p.prev.<indicator> column per '
+                                           'type; p is the smallest of them '
+                                           '(prevalence, native backend '
+                                           'only)'),
+        'kmer_min_fraction': ('Share of a feature\'s distinct k-mers that '
+                              'must be in contaminant_index for it to be '
+                              'flagged prior_contaminant')
     },
     output_descriptions={
         'score_table': ('The resulting table of scores from the input ASV table')
@@ -65,11 +164,67 @@ plugin.methods.register_function(
                  'OTU or ASV table and reports them to the user')
 )
 
+plugin.methods.register_function(
+    function=q2_decontam.decontam_identify_approximate,
+    inputs={'asv_or_otu_table': FeatureTable[Frequency]},
+    parameters={'meta_data': Metadata,
+                'decon_method': qiime2.plugin.Str %
+                qiime2.plugin.Choices(_DECON_METHOD_OPT),
+                'freq_concentration_column': qiime2.plugin.Str,
+                'prev_control_or_exp_sample_column': qiime2.plugin.Str,
+                'prev_control_sample_indicator': qiime2.plugin.Str,
+                'sample_fraction': qiime2.plugin.Float %
+                qiime2.plugin.Range(0, 1, inclusive_start=False,
+                                    inclusive_end=True),
+                'n_bootstraps': qiime2.plugin.Int %
+                qiime2.plugin.Range(1, None),
+                'threshold': qiime2.plugin.Float %
+                qiime2.plugin.Range(0, 1, inclusive_end=True),
+                'random_seed': qiime2.plugin.Int},
+    outputs=[('score_table', FeatureData[DecontamScore])],
+    input_descriptions={
+        'asv_or_otu_table': ('Table with presence counts in the matrix '
+                             'rownames are sample id and column names are'
+                             'seqeunce id')
+    },
+    parameter_descriptions={
+        'meta_data': ('metadata file indicating which samples in the '
+                           'experiment are control samples, '
+                           'assumes sample names in file correspond '
+                           'to ASV_or_OTU_table'),
+        'decon_method': ('Select how to which method to id contaminants with'),
+        'freq_concentration_column': ('Input column name that has concentration information for the samples'),
+        'prev_control_or_exp_sample_column': ('Input column name containing experimental or control sample metadata'),
+        'prev_control_sample_indicator': ('indicate the control sample identifier'),
+        'sample_fraction': ('Fraction of the non-control samples to score, '
+                            'drawn evenly across library-size strata. All '
+                            'control samples are always kept'),
+        'n_bootstraps': ('Number of bootstrap resamples of the scored '
+                         'samples used for the p.lower/p.upper interval'),
+        'threshold': ('Score threshold you intend to use; features whose '
+                      'interval straddles it are flagged as unstable'),
+        'random_seed': ('Seed for the subsample and the bootstrap')
+    },
+    output_descriptions={
+        'score_table': ('Approximate scores, with a 90% bootstrap interval '
+                        'around p and an unstable flag')
+    },
+    name='Identify contaminants approximately',
+    description=('Quick triage version of identify: scores a stratified '
+                 'subsample of the samples (keeping every control) with the '
+                 'native backend and flags features whose call is unstable '
+                 'across bootstrap resamples')
+)
+
 plugin.methods.register_function(
     function=q2_decontam.decontam_remove,
     inputs={'decon_identify_table': FeatureData[DecontamScore],
             'asv_or_otu_table': FeatureTable[Frequency]},
-    parameters={'threshold': qiime2.plugin.Float},
+    parameters={'threshold': qiime2.plugin.Float,
+                'removal_mode': Str % Choices({'remove', 'subtract'}),
+                'meta_data': Metadata,
+                'prev_control_or_exp_sample_column': Str,
+                'prev_control_sample_indicator': Str},
     outputs=[('no_contaminant_asv_table', FeatureTable[Frequency])],
     input_descriptions={
         'decon_identify_table': ('Output table from decontam identify'),
@@ -78,7 +233,18 @@ plugin.methods.register_function(
                              'seqeunce id')
     },
     parameter_descriptions={
-        'threshold': ('Select threshold cutoff for decontam algorithm scores')
+        'threshold': ('Select threshold cutoff for decontam algorithm scores'),
+        'removal_mode': ('remove drops contaminant features entirely; '
+                         'subtract keeps them, but takes from each sample '
+                         'the reads its estimated control fraction accounts '
+                         'for (needs meta_data and the control columns)'),
+        'meta_data': ('metadata file locating the negative controls, '
+                      'used by removal_mode subtract'),
+        'prev_control_or_exp_sample_column': ('Metadata column identifying '
+                                              'controls, used by '
+                                              'removal_mode subtract'),
+        'prev_control_sample_indicator': ('Value of the control column '
+                                          'marking negative controls')
     },
     output_descriptions={
         'no_contaminant_asv_table': ('The resulting table of scores once contaminants are removed')
@@ -90,6 +256,165 @@ plugin.methods.register_function(
 )
 
 
+plugin.methods.register_function(
+    function=q2_decontam.decontam_recombine,
+    inputs={'decon_identify_table': FeatureData[DecontamScore]},
+    parameters={'combination': qiime2.plugin.Str %
+                qiime2.plugin.Choices(set(_COMBINATION_RULES))},
+    outputs=[('score_table', FeatureData[DecontamScore])],
+    input_descriptions={
+        'decon_identify_table': ('Output table from decontam identify, '
+                                 'holding both p.freq and p.prev')
+    },
+    parameter_descriptions={
+        'combination': ('How p.freq and p.prev are merged into p: combined '
+                        "(Fisher's method), minimum or either (the smaller "
+                        'p-value) or both (the larger p-value)')
+    },
+    output_descriptions={
+        'score_table': ('The score table with p recomputed')
+    },
+    name='Recombine contaminant scores',
+    description=('Recomputes the p column of a score table from its '
+                 'p.freq and p.prev columns under another combination rule, '
+                 'without scoring the table again')
+)
+
+
+plugin.methods.register_function(
+    function=q2_decontam.decontam_control_similarity,
+    inputs={'asv_or_otu_table': FeatureTable[Frequency]},
+    parameters={'meta_data': Metadata,
+                'prev_control_or_exp_sample_column': qiime2.plugin.Str,
+                'prev_control_sample_indicator': qiime2.plugin.Str,
+                'metric': qiime2.plugin.Str %
+                qiime2.plugin.Choices({'braycurtis', 'jaccard'}),
+                'top_k': qiime2.plugin.Int % qiime2.plugin.Range(1, None)},
+    outputs=[('control_similarity', SampleData[ControlSimilarity])],
+    input_descriptions={
+        'asv_or_otu_table': ('Table with presence counts in the matrix '
+                             'rownames are sample id and column names are'
+                             'seqeunce id')
+    },
+    parameter_descriptions={
+        'meta_data': ('metadata file indicating which samples in the '
+                      'experiment are control samples'),
+        'prev_control_or_exp_sample_column': ('Input column name containing experimental or control sample metadata'),
+        'prev_control_sample_indicator': ('indicate the control sample identifier'),
+        'metric': ('Similarity between relative abundance profiles: 1 - '
+                   'Bray-Curtis dissimilarity (braycurtis) or Jaccard '
+                   'similarity of the features present (jaccard)'),
+        'top_k': ('Number of most similar samples reported per control')
+    },
+    output_descriptions={
+        'control_similarity': ('One row per control and similar sample: '
+                               'its rank, the similarity and whether that '
+                               'sample is a control itself')
+    },
+    name='Find samples similar to the negative controls',
+    description=('Compares every negative control with all samples using '
+                 'sparse matrix products, to screen for cross-contamination '
+                 'such as well-to-well leakage')
+)
+
+
+plugin.methods.register_function(
+    function=q2_decontam.decontam_well_leakage,
+    inputs={'asv_or_otu_table': FeatureTable[Frequency],
+            'decon_identify_table': FeatureData[DecontamScore]},
+    parameters={'meta_data': Metadata,
+                'plate_column': qiime2.plugin.Str,
+                'well_column': qiime2.plugin.Str,
+                'threshold': qiime2.plugin.Float},
+    outputs=[('leakage_table', FeatureData[WellLeakage])],
+    input_descriptions={
+        'asv_or_otu_table': ('Table with presence counts in the matrix '
+                             'rownames are sample id and column names are'
+                             'seqeunce id'),
+        'decon_identify_table': ('Optional output of decontam identify; when '
+                                 'given only the contaminant candidates are '
+                                 'scored and their p is kept next to p.leak')
+    },
+    parameter_descriptions={
+        'meta_data': ('metadata file with the plate and well of every sample'),
+        'plate_column': ('Metadata column naming the plate of each sample'),
+        'well_column': ('Metadata column with the well of each sample, e.g. '
+                        'A1 or H09'),
+        'threshold': ('Score threshold selecting the contaminant candidates '
+                      'of decon_identify_table')
+    },
+    output_descriptions={
+        'leakage_table': ('Per feature: prevalence among samples with plate '
+                          'neighbours (prev), samples next to a well holding '
+                          'it (next_to_prev), samples where both hold '
+                          '(co_occurrence), their lift over chance, the mean '
+                          'neighbour abundance and the one-sided '
+                          'hypergeometric p.leak')
+    },
+    name='Score features for well-to-well leakage',
+    description=('Multiplies a sparse well-adjacency matrix (the 8 '
+                 'surrounding wells on the same plate) against the feature '
+                 'table and tests whether features turn up next to wells '
+                 'holding them more often than their prevalence explains')
+)
+
+
+plugin.methods.register_function(
+    function=q2_decontam.decontam_contaminant_fraction,
+    inputs={'asv_or_otu_table': FeatureTable[Frequency]},
+    parameters={'meta_data': Metadata,
+                'prev_control_or_exp_sample_column': qiime2.plugin.Str,
+                'prev_control_sample_indicator': qiime2.plugin.Str},
+    outputs=[('fractions', SampleData[ContaminantFraction])],
+    input_descriptions={
+        'asv_or_otu_table': ('Table with presence counts in the matrix '
+                             'rownames are sample id and column names are'
+                             'seqeunce id')
+    },
+    parameter_descriptions={
+        'meta_data': ('metadata file indicating which samples in the '
+                      'experiment are control samples'),
+        'prev_control_or_exp_sample_column': ('Input column name containing experimental or control sample metadata'),
+        'prev_control_sample_indicator': ('indicate the control sample identifier')
+    },
+    output_descriptions={
+        'fractions': ('Per sample: the estimated contaminant fraction, the '
+                      'non-negative mixing weights of the control and '
+                      'true-sample profiles, and the residual of the fit')
+    },
+    name='Estimate per-sample contaminant fractions',
+    description=('Fits every sample as a non-negative mix of the pooled '
+                 'negative-control profile and the pooled true-sample '
+                 'profile of features absent from the controls, solving all the least squares problems at once, '
+                 'and reports the share of the control profile')
+)
+
+
+plugin.methods.register_function(
+    function=q2_decontam.decontam_build_kmer_index,
+    inputs={'reference_sequences': FeatureData[Sequence]},
+    parameters={'kmer_size': qiime2.plugin.Int %
+                qiime2.plugin.Range(1, 32, inclusive_end=True)},
+    outputs=[('kmer_index', ContaminantKmerIndex)],
+    input_descriptions={
+        'reference_sequences': ('Known kit and reagent contaminant '
+                                'sequences')
+    },
+    parameter_descriptions={
+        'kmer_size': ('Length of the indexed k-mers')
+    },
+    output_descriptions={
+        'kmer_index': ('Sorted canonical k-mers of the references, each '
+                       'with the first reference it occurs in, for '
+                       'identify\'s contaminant_index')
+    },
+    name='Build a contaminant reference k-mer index',
+    description=('Builds a reusable index of the k-mers of known '
+                 'contaminant sequences, so that identify can flag prior '
+                 'contaminants by k-mer lookup instead of alignment')
+)
+
+
 plugin.visualizers.register_function(
     function=q2_decontam.decontam_score_viz,
     inputs={
@@ -115,9 +440,69 @@ plugin.visualizers.register_function(
 )
 
 
+# Collections of artifacts arrived in QIIME 2 2023.5; older frameworks still
+# get the Python API, just not the action.
+try:
+    from qiime2.plugin import Collection
+except ImportError:
+    Collection = None
 
-plugin.register_formats(DecontamScoreFormat, DecontamScoreDirFmt)
-plugin.register_semantic_types(DecontamScore)
+if Collection is not None:
+    plugin.methods.register_function(
+        function=q2_decontam.decontam_identify_batch,
+        inputs={'asv_or_otu_tables': Collection[FeatureTable[Frequency]]},
+        parameters={'meta_data': Metadata,
+                    'decon_method': qiime2.plugin.Str %
+                    qiime2.plugin.Choices(_DECON_METHOD_OPT),
+                    'freq_concentration_column': qiime2.plugin.Str,
+                    'prev_control_or_exp_sample_column': qiime2.plugin.Str,
+                    'prev_control_sample_indicator': qiime2.plugin.Str,
+                    'scoring_backend': qiime2.plugin.Str %
+                    qiime2.plugin.Choices(_SCORING_BACKEND_OPT),
+                    'n_workers': qiime2.plugin.Int %
+                    qiime2.plugin.Range(1, None)},
+        outputs=[('score_tables', Collection[FeatureData[DecontamScore]])],
+        input_descriptions={
+            'asv_or_otu_tables': ('Tables to identify contaminants in, all '
+                                  'described by the same metadata')
+        },
+        parameter_descriptions={
+            'meta_data': ('metadata file covering the samples of every '
+                          'table in the batch'),
+            'decon_method': ('Select how to which method to id contaminants with'),
+            'freq_concentration_column': ('Input column name that has concentration information for the samples'),
+            'prev_control_or_exp_sample_column': ('Input column name containing experimental or control sample metadata'),
+            'prev_control_sample_indicator': ('indicate the control sample identifier'),
+            'scoring_backend': ('Score with the decontam R package (r) or with the '
+                                'vectorized Python port of isContaminant (native)'),
+            'n_workers': ('Number of tables to score at the same time')
+        },
+        output_descriptions={
+            'score_tables': ('One score table per input table')
+        },
+        name='Identify contaminants in a batch of tables',
+        description=('Runs identify on many tables that share metadata and '
+                     'parameters in one invocation, preparing the metadata '
+                     'once and scoring the tables on a bounded pool')
+    )
+
+
+plugin.register_formats(DecontamScoreFormat, DecontamScoreDirFmt,
+                        ControlSimilarityFormat, ControlSimilarityDirFmt,
+                        WellLeakageFormat, WellLeakageDirFmt,
+                        ContaminantFractionFormat, ContaminantFractionDirFmt,
+                        ContaminantKmerIndexFormat,
+                        ContaminantKmerIndexDirFmt)
+plugin.register_semantic_types(DecontamScore, ControlSimilarity, WellLeakage,
+                               ContaminantFraction, ContaminantKmerIndex)
 plugin.register_semantic_type_to_format(
     FeatureData[DecontamScore], DecontamScoreDirFmt)
+plugin.register_semantic_type_to_format(
+    SampleData[ControlSimilarity], ControlSimilarityDirFmt)
+plugin.register_semantic_type_to_format(
+    FeatureData[WellLeakage], WellLeakageDirFmt)
+plugin.register_semantic_type_to_format(
+    SampleData[ContaminantFraction], ContaminantFractionDirFmt)
+plugin.register_semantic_type_to_format(
+    ContaminantKmerIndex, ContaminantKmerIndexDirFmt)
 importlib.import_module('q2_decontam._transformer')
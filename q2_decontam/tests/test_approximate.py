@@ -0,0 +1,99 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2016-2022, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import unittest
+
+import numpy as np
+import pandas as pd
+import qiime2
+from qiime2.plugin.testing import TestPluginBase
+
+from q2_decontam import decontam_identify, decontam_identify_approximate
+from q2_decontam._approximate import (_library_size_strata,
+                                      _stratified_subsample)
+
+
+class TestApproximate(TestPluginBase):
+    package = 'q2_decontam.tests'
+
+    def setUp(self):
+        super().setUp()
+        table = qiime2.Artifact.load(
+            self.get_data_path('expected/decon_default_ASV_table.qza'))
+        self.asv_table = table.view(qiime2.Metadata).to_dataframe()
+        self.metadata_input = qiime2.Metadata.load(
+            self.get_data_path('expected/test_metadata.tsv'))
+        self.params = {'decon_method': 'prevalence',
+                       'prev_control_or_exp_sample_column': 'Sample_or_ConTrol',
+                       'prev_control_sample_indicator': 'Control'}
+
+    def _read(self, ff):
+        return pd.read_csv(str(ff), sep='\t', index_col=0)
+
+    def test_strata(self):
+        sizes = np.array([50, 10, 40, 20, 30])
+        self.assertEqual(_library_size_strata(sizes, 5).tolist(),
+                         [4, 0, 3, 1, 2])
+        self.assertEqual(_library_size_strata(sizes, 2).tolist(),
+                         [1, 0, 1, 0, 0])
+
+    def test_subsample_keeps_controls_and_covers_strata(self):
+        sizes = np.arange(1, 101, dtype=float)
+        neg = np.zeros(100, dtype=bool)
+        neg[[3, 50, 97]] = True
+        idx = _stratified_subsample(sizes, neg, 0.1,
+                                    np.random.default_rng(0))
+
+        self.assertTrue(set([3, 50, 97]) <= set(idx))
+        others = np.setdiff1d(idx, [3, 50, 97])
+        self.assertEqual(len(others), 10)
+        # one sample from every library-size stratum
+        samples = np.flatnonzero(~neg)
+        strata = _library_size_strata(sizes[samples])
+        drawn = strata[np.searchsorted(samples, others)]
+        self.assertEqual(sorted(drawn), list(range(10)))
+
+    def test_full_fraction_matches_identify(self):
+        obs = self._read(decontam_identify_approximate(
+            self.asv_table, self.metadata_input, sample_fraction=1.0,
+            n_bootstraps=5, **self.params))
+        exp = self._read(decontam_identify(
+            self.asv_table, self.metadata_input, scoring_backend='native',
+            **self.params))
+
+        pd.testing.assert_frame_equal(obs[exp.columns], exp,
+                                      check_dtype=False)
+
+    def test_intervals_and_flags(self):
+        obs = self._read(decontam_identify_approximate(
+            self.asv_table, self.metadata_input, sample_fraction=0.5,
+            n_bootstraps=10, threshold=0.1, **self.params))
+
+        self.assertEqual(len(obs), len(self.asv_table))
+        for column in ['p', 'p.lower', 'p.upper', 'unstable']:
+            self.assertIn(column, obs.columns)
+        scored = obs.dropna(subset=['p.lower'])
+        self.assertTrue((scored['p.lower'] <= scored['p.upper']).all())
+        straddles = (scored['p.lower'] <= 0.1) & (scored['p.upper'] > 0.1)
+        self.assertTrue((scored['unstable'] == straddles).all())
+        self.assertTrue(obs.loc[obs['p.lower'].isna(), 'unstable'].all())
+
+    def test_seed_is_reproducible(self):
+        first, second = (self._read(decontam_identify_approximate(
+            self.asv_table, self.metadata_input, sample_fraction=0.3,
+            n_bootstraps=5, random_seed=7, **self.params)) for _ in range(2))
+        pd.testing.assert_frame_equal(first, second)
+
+    def test_bad_fraction(self):
+        with self.assertRaisesRegex(ValueError, 'sample_fraction'):
+            decontam_identify_approximate(self.asv_table, self.metadata_input,
+                                          sample_fraction=0, **self.params)
+
+
+if __name__ == '__main__':
+    unittest.main()
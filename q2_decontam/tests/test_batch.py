@@ -0,0 +1,89 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2016-2022, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import json
+import unittest
+
+import pandas as pd
+import qiime2
+from qiime2.plugin.testing import TestPluginBase
+
+from q2_decontam import decontam_identify, decontam_identify_batch
+
+
+class TestIdentifyBatch(TestPluginBase):
+    package = 'q2_decontam.tests'
+
+    def setUp(self):
+        super().setUp()
+        table = qiime2.Artifact.load(
+            self.get_data_path('expected/decon_default_ASV_table.qza'))
+        self.asv_table = table.view(qiime2.Metadata).to_dataframe()
+        self.metadata_input = qiime2.Metadata.load(
+            self.get_data_path('expected/test_metadata.tsv'))
+        self.params = {'decon_method': 'combined',
+                       'freq_concentration_column': 'quant_reading',
+                       'prev_control_or_exp_sample_column': 'Sample_or_ConTrol',
+                       'prev_control_sample_indicator': 'Control'}
+        # two "runs": the first and second half of the features
+        half = self.asv_table.shape[0] // 2
+        self.tables = {'run1': self.asv_table.iloc[:half],
+                       'run2': self.asv_table.iloc[half:]}
+
+    def _read(self, ff):
+        return pd.read_csv(str(ff), sep='\t', index_col=0)
+
+    def _check_batch(self, scoring_backend):
+        obs = decontam_identify_batch(self.tables, self.metadata_input,
+                                      scoring_backend=scoring_backend,
+                                      n_workers=2, **self.params)
+
+        self.assertEqual(list(obs), ['run1', 'run2'])
+        for name, table in self.tables.items():
+            exp = decontam_identify(table, self.metadata_input,
+                                    scoring_backend=scoring_backend,
+                                    **self.params)
+            pd.testing.assert_frame_equal(self._read(obs[name]),
+                                          self._read(exp))
+
+    def test_native_batch(self):
+        self._check_batch('native')
+
+    def test_r_batch(self):
+        self._check_batch('r')
+
+    def test_worker_stages_reach_the_report(self):
+        with self.assertLogs('q2_decontam', level='INFO') as logs:
+            decontam_identify_batch(self.tables, self.metadata_input,
+                                    scoring_backend='native', n_workers=2,
+                                    **self.params)
+        payload = json.loads(logs.output[-1].split('run report: ', 1)[1])
+        stages = [stage['stage'] for stage in payload['stages']]
+        for name in self.tables:
+            self.assertIn('%s:score_native' % name, stages)
+
+    def test_list_input_is_keyed_by_position(self):
+        obs = decontam_identify_batch(list(self.tables.values()),
+                                      self.metadata_input,
+                                      scoring_backend='native', **self.params)
+        self.assertEqual(list(obs), ['0', '1'])
+
+    def test_failing_table_is_named(self):
+        tables = dict(self.tables)
+        tables['bad'] = self.asv_table.rename(columns=lambda c: c + '-x')
+        with self.assertRaisesRegex(ValueError, "table 'bad'.*missing"):
+            decontam_identify_batch(tables, self.metadata_input,
+                                    scoring_backend='native', **self.params)
+
+    def test_empty_batch(self):
+        with self.assertRaisesRegex(ValueError, 'any tables'):
+            decontam_identify_batch({}, self.metadata_input)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2016-2022, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import os
+import glob
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+import qiime2
+from qiime2.plugin.testing import TestPluginBase
+
+from q2_decontam._decontamination import _score_with_native, _score_with_r
+from q2_decontam._checkpoint import _checkpoint_chunk_size, _input_hash
+from q2_decontam._report import RunReport
+
+
+class TestCheckpoint(TestPluginBase):
+    package = 'q2_decontam.tests'
+
+    def setUp(self):
+        super().setUp()
+        table = qiime2.Artifact.load(
+            self.get_data_path('expected/decon_default_ASV_table.qza'))
+        self.asv_table = table.view(qiime2.Metadata).to_dataframe()
+        self.metadata_input = qiime2.Metadata.load(
+            self.get_data_path('expected/test_metadata.tsv'))
+        self.args = (self.asv_table, self.metadata_input, 'combined',
+                     'quant_reading', 'Sample_or_ConTrol', 'Control')
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.checkpoint_dir = os.path.join(self.temp_dir.name, 'ckpt')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+        super().tearDown()
+
+    def _run(self, backend, table=None):
+        args = self.args if table is None else (table,) + self.args[1:]
+        with RunReport('test') as report:
+            df = backend(*args, checkpoint_dir=self.checkpoint_dir)
+        return df, report.info['checkpoint_chunks_resumed']
+
+    def test_chunk_size(self):
+        self.assertEqual(_checkpoint_chunk_size(1), 1)
+        self.assertEqual(_checkpoint_chunk_size(847), 9)
+
+    def test_input_hash(self):
+        metadata = self.metadata_input.to_dataframe()
+        exp = _input_hash(self.asv_table, metadata, decon_method='combined')
+        self.assertEqual(
+            _input_hash(self.asv_table.copy(), metadata.copy(),
+                        decon_method='combined'), exp)
+        changed = self.asv_table.copy()
+        changed.iloc[0, 0] += 1
+        self.assertNotEqual(_input_hash(changed, metadata,
+                                        decon_method='combined'), exp)
+        self.assertNotEqual(_input_hash(self.asv_table, metadata,
+                                        decon_method='frequency'), exp)
+
+    def test_native_resume(self):
+        exp = _score_with_native(*self.args)
+        obs, resumed = self._run(_score_with_native)
+        pd.testing.assert_frame_equal(obs, exp)
+        self.assertEqual(resumed, 0)
+
+        # a run killed part way through leaves only some chunks behind
+        chunks = sorted(glob.glob(os.path.join(self.checkpoint_dir,
+                                               'chunk-*.npy')))
+        self.assertEqual(len(chunks), 95)
+        for chunk_fp in chunks[40:]:
+            os.remove(chunk_fp)
+        # resumed chunks are read back, not rescored
+        marked = np.load(chunks[0])
+        marked[:, 0] = 0.5
+        np.save(chunks[0], marked)
+
+        obs, resumed = self._run(_score_with_native)
+        self.assertEqual(resumed, 40)
+        self.assertTrue((obs['freq'].iloc[:9] == 0.5).all())
+        pd.testing.assert_frame_equal(obs.iloc[9:], exp.iloc[9:])
+
+    def test_different_inputs_are_rejected(self):
+        self._run(_score_with_native)
+        changed = self.asv_table.copy()
+        changed.iloc[0, 0] += 1
+        with self.assertRaisesRegex(ValueError, 'different inputs'):
+            self._run(_score_with_native, changed)
+
+    def test_backends_do_not_share_checkpoints(self):
+        self._run(_score_with_native)
+        with self.assertRaisesRegex(ValueError, 'different inputs'):
+            self._run(_score_with_r)
+
+    def test_r_resume(self):
+        exp = _score_with_r(*self.args, chunk_size=0)
+        obs, resumed = self._run(_score_with_r)
+        pd.testing.assert_frame_equal(obs, exp, check_exact=False,
+                                      rtol=1e-10)
+        self.assertEqual(resumed, 0)
+
+        chunks = sorted(glob.glob(os.path.join(self.checkpoint_dir,
+                                               'chunk-*.tsv')))
+        for chunk_fp in chunks[40:]:
+            os.remove(chunk_fp)
+        obs, resumed = self._run(_score_with_r)
+        self.assertEqual(resumed, 40)
+        pd.testing.assert_frame_equal(obs, exp, check_exact=False,
+                                      rtol=1e-10)
+
+
+if __name__ == '__main__':
+    unittest.main()
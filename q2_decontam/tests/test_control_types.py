@@ -0,0 +1,85 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2016-2022, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import unittest
+
+import numpy as np
+import pandas as pd
+import qiime2
+from qiime2.plugin.testing import TestPluginBase
+
+from q2_decontam import decontam_identify
+
+
+class TestControlTypes(TestPluginBase):
+    package = 'q2_decontam.tests'
+
+    def setUp(self):
+        super().setUp()
+        table = qiime2.Artifact.load(
+            self.get_data_path('expected/decon_default_ASV_table.qza'))
+        self.asv_table = table.view(qiime2.Metadata).to_dataframe()
+        metadata = qiime2.Metadata.load(
+            self.get_data_path('expected/test_metadata.tsv')).to_dataframe()
+        metadata = metadata.reindex(self.asv_table.columns)
+        # split the controls into two kinds of blank
+        column = metadata['Sample_or_Control'].copy()
+        controls = column.index[column.str.contains('Control')]
+        column[controls[::2]] = 'Extraction blank'
+        column[controls[1::2]] = 'PCR blank'
+        self.column = column
+        self.metadata = qiime2.Metadata(
+            column.to_frame().rename_axis('sampleid'))
+
+    def _identify(self, table, metadata, **kwargs):
+        ff = decontam_identify(
+            asv_or_otu_table=table, meta_data=metadata,
+            prev_control_or_exp_sample_column='Sample_or_Control',
+            scoring_backend='native', **kwargs)
+        return pd.read_csv(str(ff), sep='\t', index_col=0)
+
+    def test_one_column_per_type(self):
+        obs = self._identify(
+            self.asv_table, self.metadata,
+            prev_control_sample_indicators=['Extraction', 'PCR'])
+
+        self.assertEqual(list(obs.columns)[:2], ['freq', 'prev'])
+        self.assertIn('p.prev.Extraction', obs.columns)
+        self.assertIn('p.prev.PCR', obs.columns)
+        np.testing.assert_allclose(
+            obs['p'], np.fmin(obs['p.prev.Extraction'], obs['p.prev.PCR']))
+
+        for indicator in ['Extraction', 'PCR']:
+            # the same contrast as a run on just that type and true samples
+            keep = ~self.column.str.contains(
+                'PCR' if indicator == 'Extraction' else 'Extraction')
+            # the subset leaves some features without reads
+            exp = self._identify(self.asv_table.loc[:, keep.to_numpy()],
+                                 self.metadata,
+                                 prev_control_sample_indicator=indicator,
+                                 min_reads=1)
+            if 'status' in exp.columns:
+                exp = exp[exp['status'] == 'scored']
+            np.testing.assert_allclose(
+                obs.loc[exp.index, 'p.prev.%s' % indicator], exp['p'])
+
+    def test_both_indicator_parameters(self):
+        with self.assertRaisesRegex(ValueError, 'not both'):
+            self._identify(self.asv_table, self.metadata,
+                           prev_control_sample_indicator='blank',
+                           prev_control_sample_indicators=['PCR'])
+
+    def test_unmatched_indicator(self):
+        with self.assertRaisesRegex(ValueError, 'Sequencing'):
+            self._identify(self.asv_table, self.metadata,
+                           prev_control_sample_indicators=['PCR',
+                                                           'Sequencing'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -118,6 +118,66 @@ class TestIdentify(TestPluginBase):
 
             self.assertEqual(test_table,expecter_table)
 
+    def test_all(self):
+        exp_table = pd.read_csv(self.get_data_path('expected/combined-score-table.tsv'), sep='\t', index_col=0)
+        exp_table = exp_table.transpose().dropna().transpose()
+        for scoring_backend in ['r', 'native']:
+            output_feature_table = decontam_identify(asv_or_otu_table=self.asv_table, meta_data=self.metadata_input,
+                                            decon_method='all',
+                                            prev_control_or_exp_sample_column='Sample_or_ConTrol',
+                                            prev_control_sample_indicator='Control',
+                                            freq_concentration_column='quant_reading',
+                                            scoring_backend=scoring_backend)
+            obs = pd.read_csv(str(output_feature_table), sep='\t', index_col=0)
+
+            self.assertEqual(list(obs.columns),
+                             ['freq', 'prev', 'p.freq', 'p.prev', 'p.combined', 'p'])
+            pd.testing.assert_series_equal(obs['p.combined'], obs['p'],
+                                           check_names=False)
+            pd.testing.assert_frame_equal(
+                obs.drop(columns='p.combined').round(decimals=6),
+                exp_table[obs.columns.drop('p.combined')].round(decimals=6),
+                check_dtype=False, check_names=False)
+
+
+    def test_not_contaminant(self):
+        output_feature_table = decontam_identify(asv_or_otu_table=self.asv_table, meta_data=self.metadata_input,
+                                        decon_method='not-contaminant',
+                                        prev_control_or_exp_sample_column='Sample_or_ConTrol',
+                                        prev_control_sample_indicator='Control',
+                                        scoring_backend='native')
+        obs = pd.read_csv(str(output_feature_table), sep='\t', index_col=0)
+
+        self.assertEqual(list(obs.columns), ['freq', 'prev', 'p.not', 'p'])
+        pd.testing.assert_series_equal(obs['p'], 1 - obs['p.not'],
+                                       check_names=False)
+
+        # present in every true sample and no control: clearly not a
+        # contaminant; present only in controls: clearly not a true taxon
+        samples = self.metadata_input.to_dataframe()['Sample_or_Control']
+        samples = samples.reindex(self.asv_table.columns)
+        control = samples.str.contains('Control').to_numpy()
+        toy = pd.DataFrame([~control * 10, control * 10],
+                           index=pd.Index(['true', 'control'], name='id'),
+                           columns=self.asv_table.columns)
+        toy = pd.concat([toy, self.asv_table])
+        obs = pd.read_csv(str(decontam_identify(
+            asv_or_otu_table=toy, meta_data=self.metadata_input,
+            decon_method='not-contaminant',
+            prev_control_or_exp_sample_column='Sample_or_ConTrol',
+            prev_control_sample_indicator='Control',
+            scoring_backend='native')), sep='\t', index_col=0)
+        self.assertLess(obs.loc['true', 'p.not'], 0.05)
+        self.assertGreater(obs.loc['control', 'p.not'], 0.95)
+
+    def test_not_contaminant_needs_native(self):
+        with self.assertRaisesRegex(ValueError, 'native'):
+            decontam_identify(asv_or_otu_table=self.asv_table, meta_data=self.metadata_input,
+                              decon_method='not-contaminant',
+                              prev_control_or_exp_sample_column='Sample_or_ConTrol',
+                              prev_control_sample_indicator='Control')
+
+
 class TestRemove(TestPluginBase):
     package = 'q2_decontam.tests'
 
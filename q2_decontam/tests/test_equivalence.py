@@ -0,0 +1,125 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2016-2022, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import unittest
+
+import numpy as np
+import pandas as pd
+import qiime2
+from qiime2.plugin.testing import TestPluginBase
+
+from q2_decontam._decontamination import _score_with_native
+from q2_decontam._equivalence import (run_harness, summarize,
+                                      _random_inputs, _TOLERANCES)
+from q2_decontam._scoring import _prevalence_pvalues
+
+
+class TestNativeBackend(TestPluginBase):
+    package = 'q2_decontam.tests'
+
+    def setUp(self):
+        super().setUp()
+        table = qiime2.Artifact.load(
+            self.get_data_path('expected/decon_default_ASV_table.qza'))
+        self.asv_table = table.view(qiime2.Metadata).to_dataframe()
+        self.metadata_input = qiime2.Metadata.load(
+            self.get_data_path('expected/test_metadata.tsv'))
+
+    def assertMatchesExpected(self, obs, exp_fp):
+        exp = pd.read_csv(self.get_data_path(exp_fp), sep='\t', index_col=0)
+        exp = exp.dropna(axis='columns')
+        self.assertEqual(list(obs.columns), list(exp.columns))
+        obs = obs.reindex(exp.index)
+        for column in exp.columns:
+            np.testing.assert_allclose(obs[column].astype(float),
+                                       exp[column].astype(float),
+                                       rtol=1e-7, atol=_TOLERANCES[column],
+                                       err_msg=column)
+
+    def test_prevalence(self):
+        obs = _score_with_native(self.asv_table, self.metadata_input,
+                                 'prevalence', 'NULL', 'Sample_or_ConTrol',
+                                 'Control')
+        self.assertMatchesExpected(obs, 'expected/prevalence-score-table.tsv')
+
+    def test_frequency(self):
+        obs = _score_with_native(self.asv_table, self.metadata_input,
+                                 'frequency', 'quant_reading', 'NULL', 'NULL')
+        self.assertMatchesExpected(obs, 'expected/frequency-score-table.tsv')
+
+    def test_combined(self):
+        obs = _score_with_native(self.asv_table, self.metadata_input,
+                                 'combined', 'quant_reading',
+                                 'Sample_or_ConTrol', 'Control')
+        self.assertMatchesExpected(obs, 'expected/combined-score-table.tsv')
+
+    def test_combined_fits_frequency_without_controls(self):
+        # fixed data, so this holds whether or not R is installed
+        rng = np.random.default_rng(0)
+        table = pd.DataFrame(rng.integers(1, 200, size=(5, 10)),
+                             index=pd.Index(['f%d' % i for i in range(5)],
+                                            name='id'),
+                             columns=['s%d' % i for i in range(10)])
+        metadata = pd.DataFrame(
+            {'conc': rng.uniform(1, 10, 10),
+             'kind': ['Control'] * 3 + ['True'] * 7},
+            index=pd.Index(table.columns, name='sampleid'))
+        combined = _score_with_native(table, qiime2.Metadata(metadata),
+                                      'combined', 'conc', 'kind', 'Control')
+        true = metadata.index[3:]
+        frequency = _score_with_native(
+            table[true], qiime2.Metadata(metadata.loc[true]), 'frequency',
+            'conc', 'NULL', 'NULL')
+        np.testing.assert_allclose(combined['p.freq'], frequency['p.freq'],
+                                   rtol=1e-12)
+
+        # the controls' reads do not move p.freq
+        table.iloc[:, :3] = rng.integers(1, 200, size=(5, 3))
+        moved = _score_with_native(table, qiime2.Metadata(metadata),
+                                   'combined', 'conc', 'kind', 'Control')
+        np.testing.assert_allclose(moved['p.freq'], combined['p.freq'],
+                                   rtol=1e-12)
+
+    def test_rare_features_untested(self):
+        # decontam returns NA for features in fewer than two samples
+        for alternative in ('greater', 'less'):
+            obs = _prevalence_pvalues([0, 1, 0, 1], [0, 1, 1, 2], 3, 10,
+                                      alternative)
+            self.assertTrue(np.isnan(obs[:3]).all())
+            self.assertFalse(np.isnan(obs[3]))
+
+    def test_missing_samples_in_metadata(self):
+        metadata = self.metadata_input.to_dataframe().iloc[1:]
+        with self.assertRaisesRegex(ValueError, 'missing 1 of the samples'):
+            _score_with_native(self.asv_table, qiime2.Metadata(metadata),
+                               'prevalence', 'NULL', 'Sample_or_ConTrol',
+                               'Control')
+
+
+class TestEquivalenceHarness(TestPluginBase):
+    package = 'q2_decontam.tests'
+
+    def test_random_inputs(self):
+        table, metadata = _random_inputs(50, 20, 4, seed=1)
+        self.assertEqual(table.shape, (50, 20))
+        # some features are too rare for decontam to test
+        self.assertTrue(((table > 0).sum(axis=1) <= 1).any())
+        self.assertEqual(list(metadata.ids), list(table.columns))
+
+    def test_backends_agree(self):
+        report = run_harness(n_trials=2, n_features=120, n_samples=40,
+                             n_controls=6, seed=3)
+        summary = summarize(report)
+        self.assertTrue(summary['within_tolerance'].all(),
+                        summary.to_string())
+        self.assertEqual(set(report['decon_method']),
+                         {'frequency', 'prevalence', 'combined', 'all'})
+
+
+if __name__ == '__main__':
+    unittest.main()
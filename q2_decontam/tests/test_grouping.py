@@ -0,0 +1,84 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2016-2022, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import unittest
+
+import pandas as pd
+import qiime2
+from qiime2.plugin.testing import TestPluginBase
+
+from q2_decontam import decontam_identify
+from q2_decontam._decontamination import _score_with_native
+from q2_decontam._grouping import (_group_labels, _collapse_features,
+                                   _expand_groups)
+
+
+class TestGrouping(TestPluginBase):
+    package = 'q2_decontam.tests'
+
+    def setUp(self):
+        super().setUp()
+        table = qiime2.Artifact.load(
+            self.get_data_path('expected/decon_default_ASV_table.qza'))
+        self.asv_table = table.view(qiime2.Metadata).to_dataframe()
+        self.metadata_input = qiime2.Metadata.load(
+            self.get_data_path('expected/test_metadata.tsv'))
+        groups = pd.Series(['g%d' % (i % 40) for i in
+                            range(len(self.asv_table))],
+                           index=pd.Index(self.asv_table.index,
+                                          name='feature-id'),
+                           name='cluster')
+        self.feature_groups = qiime2.CategoricalMetadataColumn(groups)
+
+    def test_collapse_and_expand(self):
+        table = pd.DataFrame([[1, 0], [2, 3], [0, 4]],
+                             index=pd.Index(['a', 'b', 'c'], name='id'),
+                             columns=['s1', 's2'])
+        labels = pd.Series(['x', 'y', 'x'], index=table.index)
+
+        collapsed = _collapse_features(table, labels)
+        self.assertEqual(list(collapsed.index), ['x', 'y'])
+        self.assertEqual(collapsed.loc['x'].tolist(), [1, 4])
+        self.assertEqual(collapsed.loc['y'].tolist(), [2, 3])
+
+        scores = pd.DataFrame({'p': [0.1, 0.9]},
+                              index=pd.Index(['x', 'y'], name='#OTU ID'))
+        expanded = _expand_groups(scores, labels)
+        self.assertEqual(expanded['p'].tolist(), [0.1, 0.9, 0.1])
+        self.assertEqual(expanded['group'].tolist(), ['x', 'y', 'x'])
+        self.assertEqual(list(expanded.index), ['a', 'b', 'c'])
+
+    def test_missing_group(self):
+        groups = pd.Series(['x'], index=['a'])
+        with self.assertRaisesRegex(ValueError, '1 of the features.*b'):
+            _group_labels(pd.Index(['a', 'b']), groups)
+
+    def test_identify_scores_groups(self):
+        ff = decontam_identify(asv_or_otu_table=self.asv_table,
+                               meta_data=self.metadata_input,
+                               prev_control_or_exp_sample_column='Sample_or_ConTrol',
+                               prev_control_sample_indicator='Control',
+                               scoring_backend='native',
+                               feature_groups=self.feature_groups)
+        obs = pd.read_csv(str(ff), sep='\t', index_col=0)
+
+        labels = _group_labels(self.asv_table.index,
+                               self.feature_groups.to_series())
+        exp = _score_with_native(
+            _collapse_features(self.asv_table, labels), self.metadata_input,
+            'prevalence', 'NULL', 'Sample_or_ConTrol', 'Control')
+        self.assertEqual(len(obs), 847)
+        self.assertEqual(obs['group'].nunique(), 40)
+        for feature_id in ['Seq1', 'Seq41', 'Seq500']:
+            group = obs.loc[feature_id, 'group']
+            self.assertAlmostEqual(obs.loc[feature_id, 'p'],
+                                   exp.loc[group, 'p'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2016-2022, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import unittest
+
+import numpy as np
+import pandas as pd
+import qiime2
+import skbio
+from qiime2.plugin.testing import TestPluginBase
+from qiime2.plugin.util import transform
+
+from q2_decontam import (decontam_build_kmer_index, decontam_identify,
+                         ContaminantKmerIndexFormat)
+from q2_decontam._kmers import KmerIndex, _attach_kmer_flags
+
+
+def _dna(sequences):
+    return [skbio.DNA(sequence, metadata={'id': sequence_id})
+            for sequence_id, sequence in sequences.items()]
+
+
+class TestKmerIndex(TestPluginBase):
+    package = 'q2_decontam.tests'
+
+    def setUp(self):
+        super().setUp()
+        rng = np.random.default_rng(0)
+        self.random = {name: ''.join(rng.choice(list('ACGT'), 120))
+                       for name in ['ralstonia', 'bradyrhizobium', 'gut']}
+        self.index = decontam_build_kmer_index(
+            _dna({'ralstonia': self.random['ralstonia'],
+                  'bradyrhizobium': self.random['bradyrhizobium']}),
+            kmer_size=15)
+
+    def test_lookup(self):
+        ralstonia = self.random['ralstonia']
+        reverse = str(skbio.DNA(ralstonia).reverse_complement())
+        queries = {'exact': ralstonia, 'reverse': reverse,
+                   'half': ralstonia[:60] + self.random['gut'][60:],
+                   'clean': self.random['gut'],
+                   'short': ralstonia[:10],
+                   'ambiguous': ralstonia[:50] + 'N' + ralstonia[51:]}
+        obs = self.index.lookup(list(queries), list(queries.values()))
+
+        self.assertEqual(obs.loc['exact', 'kmer_fraction'], 1)
+        self.assertEqual(obs.loc['reverse', 'kmer_fraction'], 1)
+        self.assertEqual(obs.loc['ambiguous', 'kmer_fraction'], 1)
+        self.assertEqual(obs.loc['exact', 'kmer_reference'], 'ralstonia')
+        self.assertEqual(obs.loc['reverse', 'kmer_reference'], 'ralstonia')
+        self.assertTrue(0.3 < obs.loc['half', 'kmer_fraction'] < 0.7)
+        self.assertEqual(obs.loc['clean', 'kmer_fraction'], 0)
+        self.assertEqual(obs.loc['clean', 'kmer_reference'], '')
+        self.assertEqual(obs.loc['short', 'kmer_fraction'], 0)
+
+    def test_blocks_match_single_pass(self):
+        names = list(self.random)
+        sequences = list(self.random.values())
+        exp = self.index.lookup(names, sequences)
+        obs = self.index.lookup(names, sequences, block_size=1)
+        pd.testing.assert_frame_equal(obs, exp)
+
+    def test_round_trip(self):
+        ff = transform(self.index, from_type=KmerIndex,
+                       to_type=ContaminantKmerIndexFormat)
+        obs = transform(ff, from_type=ContaminantKmerIndexFormat,
+                        to_type=KmerIndex)
+        np.testing.assert_array_equal(obs.kmers, self.index.kmers)
+        np.testing.assert_array_equal(obs.references, self.index.references)
+        self.assertEqual(list(obs.reference_ids),
+                         ['ralstonia', 'bradyrhizobium'])
+        self.assertEqual(obs.k, 15)
+
+    def test_attach_kmer_flags(self):
+        df = pd.DataFrame({'p': [0.01, 0.5, 0.9]},
+                          index=pd.Index(['contam', 'clean', 'no_sequence'],
+                                         name='#OTU ID'))
+        sequences = _dna({'contam': self.random['bradyrhizobium'],
+                          'clean': self.random['gut']})
+        obs = _attach_kmer_flags(df, self.index, sequences, 0.5)
+        self.assertEqual(list(obs['prior_contaminant']),
+                         [True, False, False])
+        self.assertEqual(list(obs['kmer_reference']),
+                         ['bradyrhizobium', '', ''])
+        self.assertEqual(obs.loc['no_sequence', 'kmer_fraction'], 0)
+
+    def test_identify_needs_both_inputs(self):
+        table = pd.DataFrame({'s1': [1]}, index=['f1'])
+        metadata = qiime2.Metadata(pd.DataFrame(
+            {'kind': ['Control']}, index=pd.Index(['s1'], name='sampleid')))
+        with self.assertRaisesRegex(ValueError, 'contaminant_index'):
+            decontam_identify(table, metadata,
+                              contaminant_index=self.index)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2016-2022, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import unittest
+
+import numpy as np
+import pandas as pd
+import qiime2
+from qiime2.plugin.testing import TestPluginBase
+
+from q2_decontam import decontam_well_leakage
+from q2_decontam._leakage import _parse_wells, _well_adjacency
+
+
+class TestWellLeakage(TestPluginBase):
+    package = 'q2_decontam.tests'
+
+    def setUp(self):
+        super().setUp()
+        # one 96-well plate; 'leaky' fills rows A and B, 'scattered' sits in
+        # random wells, 'everywhere' is in every sample
+        wells = ['%s%d' % (row, column) for row in 'ABCDEFGH'
+                 for column in range(1, 13)]
+        samples = ['s%02d' % i for i in range(96)]
+        rng = np.random.default_rng(0)
+        leaky = np.zeros(96, dtype=int)
+        leaky[:24] = 5
+        scattered = np.zeros(96, dtype=int)
+        scattered[rng.choice(96, 24, replace=False)] = 5
+        self.table = pd.DataFrame(
+            [leaky, scattered, np.full(96, 100)],
+            index=pd.Index(['leaky', 'scattered', 'everywhere'], name='id'),
+            columns=samples)
+        self.metadata = qiime2.Metadata(pd.DataFrame(
+            {'plate': ['P1'] * 96, 'well': wells},
+            index=pd.Index(samples, name='sampleid')))
+
+    def test_parse_wells(self):
+        rows, columns = _parse_wells(['A1', 'h09', 'AA12', 'x', None])
+        self.assertEqual(rows.tolist(), [0, 7, 26, -1, -1])
+        self.assertEqual(columns.tolist(), [0, 8, 11, -1, -1])
+
+    def test_adjacency(self):
+        adjacency = _well_adjacency(pd.Series(['1', '1', '1', '2', None]),
+                                    pd.Series(['A1', 'A2', 'B2', 'A1',
+                                               'A3']))
+        dense = adjacency.toarray()
+        np.testing.assert_array_equal(dense, dense.T)
+        self.assertEqual(dense[0].tolist(), [0, 1, 1, 0, 0])
+        self.assertEqual(dense[1].tolist(), [1, 0, 1, 0, 0])
+        # other plate, and no plate at all
+        self.assertEqual(dense[3].sum(), 0)
+        self.assertEqual(dense[4].sum(), 0)
+
+    def test_leaky_feature_scores_low(self):
+        obs = decontam_well_leakage(self.table, self.metadata, 'plate',
+                                    'well')
+
+        self.assertEqual(obs.loc['leaky', 'prev'], 24)
+        self.assertLess(obs.loc['leaky', 'p.leak'], 1e-6)
+        self.assertGreater(obs.loc['leaky', 'lift'], 2)
+        self.assertLess(obs.loc['leaky', 'p.leak'],
+                        obs.loc['scattered', 'p.leak'])
+        self.assertAlmostEqual(obs.loc['everywhere', 'lift'], 1)
+
+    def test_candidates_only(self):
+        scores = qiime2.Metadata(pd.DataFrame(
+            {'p': [0.01, 0.5, 0.05]},
+            index=pd.Index(['leaky', 'scattered', 'everywhere'],
+                           name='#OTU ID')))
+        obs = decontam_well_leakage(self.table, self.metadata, 'plate',
+                                    'well', decon_identify_table=scores)
+
+        self.assertEqual(sorted(obs.index), ['everywhere', 'leaky'])
+        self.assertEqual(obs.loc['leaky', 'p'], 0.01)
+
+    def test_candidates_scored_as_in_full_table(self):
+        # 'everywhere' holds most reads; leaving it out must not change the
+        # library sizes the other features are scored against
+        scores = qiime2.Metadata(pd.DataFrame(
+            {'p': [0.01, 0.05, 0.5]},
+            index=pd.Index(['leaky', 'scattered', 'everywhere'],
+                           name='#OTU ID')))
+        full = decontam_well_leakage(self.table, self.metadata, 'plate',
+                                     'well')
+        obs = decontam_well_leakage(self.table, self.metadata, 'plate',
+                                    'well', decon_identify_table=scores)
+
+        pd.testing.assert_frame_equal(obs.drop(columns='p'),
+                                      full.loc[['leaky', 'scattered']])
+
+    def test_no_layout(self):
+        metadata = qiime2.Metadata(pd.DataFrame(
+            {'plate': ['P1'] * 96, 'well': ['?'] * 96},
+            index=pd.Index(self.table.columns, name='sampleid')))
+        with self.assertRaisesRegex(ValueError, 'neighbouring wells'):
+            decontam_well_leakage(self.table, metadata, 'plate', 'well')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2016-2022, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import unittest
+import tracemalloc
+
+import numpy as np
+import qiime2
+from qiime2.plugin.testing import TestPluginBase
+
+from q2_decontam import decontam_identify, decontam_remove
+
+
+# Peak Python-heap allocation an action may make, expressed as a multiple of
+# the CSR footprint (float64 data, int32 indices and indptr) of its input
+# table. The R subprocess is not traced; only the pandas/biom glue is.
+# Measured on the 847 x 569 test table: identify peaks at 42x, remove at
+# 49x. One more dense copy of that table is about 8.5x, so the ~15% of
+# headroom fails on any extra densification.
+PEAK_MEMORY_MULTIPLES = {'identify': 48, 'remove': 56}
+
+
+def _sparse_nbytes(df):
+    nnz = int(np.count_nonzero(df.values))
+    return nnz * (8 + 4) + (df.shape[0] + 1) * 4
+
+
+def _traced_peak(func, **kwargs):
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        func(**kwargs)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak
+
+
+class TestPeakMemory(TestPluginBase):
+    package = 'q2_decontam.tests'
+
+    def setUp(self):
+        super().setUp()
+        table = qiime2.Artifact.load(
+            self.get_data_path('expected/decon_default_ASV_table.qza'))
+        self.asv_table = table.view(qiime2.Metadata).to_dataframe()
+        self.metadata_input = qiime2.Metadata.load(
+            self.get_data_path('expected/test_metadata.tsv'))
+        id_table = qiime2.Artifact.load(
+            self.get_data_path('expected/decon_default_score_table.qza'))
+        self.identify_table = id_table.view(qiime2.Metadata)
+        self.sparse_nbytes = _sparse_nbytes(self.asv_table)
+
+    def assertWithinBudget(self, peak, action):
+        multiple = PEAK_MEMORY_MULTIPLES[action]
+        budget = multiple * self.sparse_nbytes
+        self.assertLessEqual(
+            peak, budget,
+            'peak of %.1f MB exceeds %dx the sparse input size (%.1f MB)'
+            % (peak / 1e6, multiple, budget / 1e6))
+
+    def test_identify_peak_memory(self):
+        for method, kwargs in [
+                ('prevalence',
+                 {'prev_control_or_exp_sample_column': 'Sample_or_ConTrol',
+                  'prev_control_sample_indicator': 'Control'}),
+                ('frequency',
+                 {'freq_concentration_column': 'quant_reading'})]:
+            with self.subTest(decon_method=method):
+                peak = _traced_peak(decontam_identify,
+                                    asv_or_otu_table=self.asv_table,
+                                    meta_data=self.metadata_input,
+                                    decon_method=method, **kwargs)
+                self.assertWithinBudget(peak, 'identify')
+
+    def test_remove_peak_memory(self):
+        peak = _traced_peak(decontam_remove,
+                            decon_identify_table=self.identify_table,
+                            asv_or_otu_table=self.asv_table,
+                            threshold=0.1)
+        self.assertWithinBudget(peak, 'remove')
+
+
+if __name__ == '__main__':
+    unittest.main()
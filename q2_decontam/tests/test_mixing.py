@@ -0,0 +1,85 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2016-2022, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import unittest
+
+import numpy as np
+import pandas as pd
+import qiime2
+from scipy.optimize import nnls
+from qiime2.plugin.testing import TestPluginBase
+
+from q2_decontam import decontam_contaminant_fraction
+from q2_decontam._mixing import _batched_nnls
+
+
+class TestContaminantFraction(TestPluginBase):
+    package = 'q2_decontam.tests'
+
+    def test_batched_nnls_matches_scipy(self):
+        rng = np.random.default_rng(0)
+        components = rng.random((30, 3))
+        samples = rng.normal(size=(50, 30))
+        weights, _ = _batched_nnls(components.T @ components,
+                                   samples @ components)
+        for sample, obs in zip(samples, weights):
+            exp, _ = nnls(components, sample)
+            np.testing.assert_allclose(obs, exp, atol=1e-10)
+
+    def test_known_mixtures(self):
+        control = np.array([50, 50, 0, 0, 0])
+        true = np.array([0, 0, 40, 30, 30])
+        mixes = {'c1': control, 'c2': control * 2,
+                 'clean': true, 'quarter': 0.25 * control + 0.75 * true,
+                 'half': 0.5 * control * 3 + 0.5 * true * 3}
+        table = pd.DataFrame(mixes, index=pd.Index(
+            ['f%d' % i for i in range(5)], name='id'))
+        metadata = qiime2.Metadata(pd.DataFrame(
+            {'kind': ['Control', 'Control', 'True', 'True', 'True']},
+            index=pd.Index(table.columns, name='sampleid')))
+
+        obs = decontam_contaminant_fraction(table, metadata, 'kind',
+                                            'Control')
+
+        self.assertEqual(list(obs.index), list(table.columns))
+        self.assertAlmostEqual(obs.loc['clean', 'contaminant_fraction'], 0,
+                               places=6)
+        self.assertAlmostEqual(obs.loc['c1', 'contaminant_fraction'], 1,
+                               places=6)
+        self.assertTrue(obs.loc['c1', 'is_control'])
+        self.assertFalse(obs.loc['clean', 'is_control'])
+        self.assertGreater(obs.loc['half', 'contaminant_fraction'],
+                           obs.loc['quarter', 'contaminant_fraction'])
+        self.assertTrue((obs[['control_weight', 'sample_weight']] >= 0)
+                        .all().all())
+
+    def test_contaminated_majority(self):
+        control = np.array([50, 50, 0, 0, 0])
+        true = np.array([0, 0, 40, 30, 30])
+        mixes = {'c1': control, 'c2': control * 2, 'clean': true,
+                 'third': control + 2 * true,
+                 'half': control * 2 + true * 2,
+                 'most': 0.9 * control * 4 + 0.1 * true * 4}
+        table = pd.DataFrame(mixes, index=pd.Index(
+            ['f%d' % i for i in range(5)], name='id'))
+        metadata = qiime2.Metadata(pd.DataFrame(
+            {'kind': ['Control'] * 2 + ['True'] * 4},
+            index=pd.Index(table.columns, name='sampleid')))
+
+        obs = decontam_contaminant_fraction(table, metadata, 'kind',
+                                            'Control')
+
+        fraction = obs['contaminant_fraction']
+        self.assertAlmostEqual(fraction['clean'], 0, places=6)
+        self.assertAlmostEqual(fraction['third'], 1 / 3, places=6)
+        self.assertAlmostEqual(fraction['half'], 0.5, places=6)
+        self.assertAlmostEqual(fraction['most'], 0.9, places=6)
+
+
+if __name__ == '__main__':
+    unittest.main()
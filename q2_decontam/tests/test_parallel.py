@@ -0,0 +1,93 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2016-2022, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import unittest
+
+import numpy as np
+import pandas as pd
+import qiime2
+from qiime2.plugin.testing import TestPluginBase
+
+from q2_decontam import (decontam_identify, add_progress_listener,
+                         remove_progress_listener)
+from q2_decontam._decontamination import _score_with_native
+from q2_decontam._parallel import _SharedArrays, _attach, _balanced_ranges
+
+
+class TestParallelHelpers(TestPluginBase):
+    package = 'q2_decontam.tests'
+
+    def test_balanced_ranges(self):
+        # one heavy row followed by many light ones
+        indptr = np.cumsum([0, 90] + [1] * 10)
+        ranges = _balanced_ranges(indptr, 4)
+
+        self.assertEqual(ranges[0][0], 0)
+        self.assertEqual(ranges[-1][1], 11)
+        for (_, stop), (start, _) in zip(ranges, ranges[1:]):
+            self.assertEqual(stop, start)
+        self.assertTrue(all(start < stop for start, stop in ranges))
+
+    def test_balanced_ranges_more_ranges_than_rows(self):
+        self.assertEqual(_balanced_ranges(np.array([0, 2, 4]), 8),
+                         [(0, 1), (1, 2)])
+
+    def test_shared_arrays_round_trip(self):
+        arrays = {'data': np.arange(5, dtype=float),
+                  'neg': np.array([True, False, True]),
+                  'empty': np.array([], dtype=np.int32)}
+        with _SharedArrays(arrays) as shared:
+            blocks, attached = _attach(shared.specs)
+            for name, array in arrays.items():
+                np.testing.assert_array_equal(attached[name], array)
+                self.assertEqual(attached[name].dtype, array.dtype)
+            del attached
+            for block in blocks:
+                block.close()
+
+
+class TestParallelScoring(TestPluginBase):
+    package = 'q2_decontam.tests'
+
+    def setUp(self):
+        super().setUp()
+        table = qiime2.Artifact.load(
+            self.get_data_path('expected/decon_default_ASV_table.qza'))
+        self.asv_table = table.view(qiime2.Metadata).to_dataframe()
+        self.metadata_input = qiime2.Metadata.load(
+            self.get_data_path('expected/test_metadata.tsv'))
+        self.events = []
+        add_progress_listener(self.events.append)
+
+    def tearDown(self):
+        remove_progress_listener(self.events.append)
+        super().tearDown()
+
+    def test_parallel_matches_single_process(self):
+        for decon_method in ['prevalence', 'frequency', 'combined']:
+            args = (self.asv_table, self.metadata_input, decon_method,
+                    'quant_reading', 'Sample_or_ConTrol', 'Control')
+            with self.subTest(decon_method=decon_method):
+                exp = _score_with_native(*args)
+                self.events.clear()
+                obs = _score_with_native(*args, n_jobs=2)
+
+                pd.testing.assert_frame_equal(obs, exp)
+                self.assertEqual(self.events[-1].scored, 847)
+
+    def test_n_jobs_requires_native_backend(self):
+        with self.assertRaisesRegex(ValueError, 'native'):
+            decontam_identify(asv_or_otu_table=self.asv_table,
+                              meta_data=self.metadata_input,
+                              prev_control_or_exp_sample_column='Sample_or_ConTrol',
+                              prev_control_sample_indicator='Control',
+                              n_jobs=2)
+
+
+if __name__ == '__main__':
+    unittest.main()
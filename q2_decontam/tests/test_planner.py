@@ -0,0 +1,114 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2016-2022, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import unittest
+
+import numpy as np
+import pandas as pd
+import qiime2
+from qiime2.plugin.testing import TestPluginBase
+
+from q2_decontam import decontam_identify
+from q2_decontam._decontamination import _score_with_native
+from q2_decontam._planner import _parse_memory, _plan, _describe_plan
+from q2_decontam._report import _count_nonzero
+
+
+class TestPlanner(TestPluginBase):
+    package = 'q2_decontam.tests'
+
+    def setUp(self):
+        super().setUp()
+        table = qiime2.Artifact.load(
+            self.get_data_path('expected/decon_default_ASV_table.qza'))
+        self.asv_table = table.view(qiime2.Metadata).to_dataframe()
+        self.metadata_input = qiime2.Metadata.load(
+            self.get_data_path('expected/test_metadata.tsv'))
+
+    def test_parse_memory(self):
+        self.assertEqual(_parse_memory('8GB'), 8 * 2 ** 30)
+        self.assertEqual(_parse_memory('512m'), 512 * 2 ** 20)
+        self.assertEqual(_parse_memory('1.5 GiB'), int(1.5 * 2 ** 30))
+        self.assertEqual(_parse_memory('100'), 100)
+        with self.assertRaisesRegex(ValueError, 'memory size'):
+            _parse_memory('lots')
+
+    def test_unbudgeted_plan_is_dense_single_pass(self):
+        plan = _plan(self.asv_table, 'native')
+        self.assertEqual(plan.handling, 'dense')
+        self.assertEqual(plan.chunk_size, 0)
+        self.assertEqual(plan.n_chunks, 1)
+        self.assertIsNone(plan.budget_bytes)
+        self.assertIn('a single pass', _describe_plan(plan))
+
+    def test_tight_budget_shrinks_plan(self):
+        unbudgeted = _plan(self.asv_table, 'native')
+        budget = unbudgeted.estimated_peak_bytes - 1
+        plan = _plan(self.asv_table, 'native', budget)
+
+        self.assertNotEqual((plan.handling, plan.chunk_size), ('dense', 0))
+        self.assertLessEqual(plan.estimated_peak_bytes, budget)
+
+    def test_sparse_handling_for_very_sparse_tables(self):
+        # one read per feature: the dense copy dwarfs everything else
+        table = pd.DataFrame(np.eye(2000, 500, dtype=float))
+        unbudgeted = _plan(table, 'native')
+        plan = _plan(table, 'native', unbudgeted.estimated_peak_bytes - 1)
+
+        self.assertEqual(plan.handling, 'sparse')
+        self.assertEqual(plan.chunk_size, 0)
+        self.assertIn('blocks of %d features' % plan.block_rows,
+                      _describe_plan(plan))
+
+    def test_nonzero_counted_in_blocks(self):
+        self.assertEqual(_count_nonzero(self.asv_table, block_rows=100),
+                         np.count_nonzero(self.asv_table.to_numpy()))
+
+    def test_fixed_chunk_size_is_kept(self):
+        plan = _plan(self.asv_table, 'r', chunk_size=9)
+        self.assertEqual((plan.chunk_size, plan.n_chunks), (9, 95))
+
+    def test_budget_too_small(self):
+        with self.assertRaisesRegex(ValueError, "scoring_backend='native'"):
+            _plan(self.asv_table, 'r', 1024)
+        with self.assertRaisesRegex(ValueError, 'memory budget'):
+            _plan(self.asv_table, 'native', 1024)
+
+    def test_sparse_handling_matches_dense(self):
+        args = (self.asv_table, self.metadata_input, 'combined',
+                'quant_reading', 'Sample_or_ConTrol', 'Control')
+        exp = _score_with_native(*args)
+        obs = _score_with_native(*args, chunk_size=100, block_rows=64)
+        pd.testing.assert_frame_equal(obs, exp)
+
+    def test_dry_run(self):
+        with self.assertLogs('q2_decontam', level='INFO') as logs:
+            ff = decontam_identify(asv_or_otu_table=self.asv_table,
+                                   meta_data=self.metadata_input,
+                                   prev_control_or_exp_sample_column='Sample_or_ConTrol',
+                                   prev_control_sample_indicator='Control',
+                                   max_memory='8GB', dry_run=True)
+
+        output = '\n'.join(logs.output)
+        self.assertIn('execution plan', output)
+        self.assertIn('budget: 8.0 GB', output)
+        with open(str(ff)) as fh:
+            self.assertEqual(fh.read().splitlines(),
+                             ['#OTU ID\tfreq\tprev\tp.prev\tp'])
+
+    def test_identify_rejects_unfittable_budget(self):
+        with self.assertRaisesRegex(ValueError, 'memory budget'):
+            decontam_identify(asv_or_otu_table=self.asv_table,
+                              meta_data=self.metadata_input,
+                              prev_control_or_exp_sample_column='Sample_or_ConTrol',
+                              prev_control_sample_indicator='Control',
+                              scoring_backend='native', max_memory='1KB')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,193 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2016-2022, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import unittest
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+import qiime2
+from qiime2.plugin.testing import TestPluginBase
+
+from q2_decontam import decontam_identify
+from q2_decontam._decontamination import (_score_with_native, _score_with_r,
+                                          _score_prefiltered)
+from q2_decontam._prefilter import (_feature_counts, _prefilter_status,
+                                    _profile_representatives)
+from q2_decontam._report import RunReport
+
+
+class TestPrefilter(TestPluginBase):
+    package = 'q2_decontam.tests'
+
+    def setUp(self):
+        super().setUp()
+        table = qiime2.Artifact.load(
+            self.get_data_path('expected/decon_default_ASV_table.qza'))
+        self.asv_table = table.view(qiime2.Metadata).to_dataframe()
+        self.metadata_input = qiime2.Metadata.load(
+            self.get_data_path('expected/test_metadata.tsv'))
+        self.args = (self.metadata_input, 'combined', 'quant_reading',
+                     'Sample_or_ConTrol', 'Control')
+
+    def test_status(self):
+        values = np.array([[0, 0, 0, 0],
+                           [5, 0, 0, 0],
+                           [1, 1, 0, 0],
+                           [0, 0, 3, 4],
+                           [9, 9, 9, 9]])
+        table = pd.DataFrame(values)
+        neg = np.array([False, False, True, True])
+
+        self.assertEqual(
+            list(_prefilter_status(_feature_counts(table))),
+            ['zero_reads', 'scored', 'scored', 'scored', 'scored'])
+        self.assertEqual(
+            list(_prefilter_status(_feature_counts(table, neg, block_rows=2),
+                                   min_prevalence=2, min_reads=3)),
+            ['zero_reads', 'low_prevalence', 'low_reads', 'control_only',
+             'scored'])
+
+    def test_defaults_skip_the_prefilter(self):
+        table = pd.concat([self.asv_table, pd.DataFrame(
+            0.0, index=['empty'], columns=self.asv_table.columns)])
+
+        with RunReport('test') as report:
+            obs = _score_prefiltered(_score_with_native, table, *self.args)
+
+        self.assertNotIn('prefilter', report.info)
+        self.assertNotIn('status', obs.columns)
+        self.assertEqual(list(obs.index), list(table.index))
+
+    def _check_scored_rows_unchanged(self, backend, **kwargs):
+        exp = backend(self.asv_table, *self.args)
+        obs = _score_prefiltered(backend, self.asv_table, *self.args,
+                                 min_prevalence=100, **kwargs)
+
+        self.assertEqual(list(obs.index), list(self.asv_table.index))
+        scored = obs['status'] == 'scored'
+        self.assertTrue(0 < scored.sum() < len(obs))
+        # the scored subset is normalized by the full table's sample totals
+        pd.testing.assert_frame_equal(
+            obs.loc[scored, exp.columns], exp.loc[scored], check_exact=False,
+            rtol=1e-10)
+        excluded = obs[~scored]
+        self.assertTrue((excluded['status'] == 'low_prevalence').all())
+        self.assertTrue(excluded['p'].isna().all())
+        pd.testing.assert_series_equal(excluded['prev'],
+                                       exp.loc[~scored, 'prev'])
+        np.testing.assert_allclose(excluded['freq'],
+                                   exp.loc[~scored, 'freq'])
+
+    def test_native_scored_rows_unchanged(self):
+        self._check_scored_rows_unchanged(_score_with_native)
+
+    def test_r_scored_rows_unchanged(self):
+        self._check_scored_rows_unchanged(_score_with_r)
+
+    def test_nothing_excluded_adds_no_status(self):
+        exp = _score_with_native(self.asv_table, *self.args)
+        obs = _score_prefiltered(_score_with_native, self.asv_table,
+                                 *self.args)
+        pd.testing.assert_frame_equal(obs, exp)
+
+    def test_zero_read_and_control_only_features(self):
+        metadata = self.metadata_input.to_dataframe()
+        controls = metadata.index[
+            metadata['Sample_or_Control'].str.contains('Control')].intersection(
+                self.asv_table.columns)
+        extra = pd.DataFrame(0.0, index=['empty', 'kitome'],
+                             columns=self.asv_table.columns)
+        extra.loc['kitome', controls[:2]] = 10.0
+        table = pd.concat([self.asv_table, extra])
+
+        obs = _score_prefiltered(_score_with_native, table, *self.args,
+                                 exclude_control_only=True)
+
+        self.assertEqual(obs.loc['empty', 'status'], 'zero_reads')
+        self.assertTrue(np.isnan(obs.loc['empty', 'p']))
+        self.assertEqual(obs.loc['kitome', 'status'], 'control_only')
+        self.assertEqual(obs.loc['kitome', 'p'], 0)
+        self.assertEqual(obs.loc['kitome', 'prev'], 2)
+
+    def test_profile_representatives(self):
+        table = pd.DataFrame([[0, 1, 2], [3, 0, 0], [0, 1, 2], [3, 0, 0],
+                              [1, 1, 1]])
+        np.testing.assert_array_equal(_profile_representatives(table),
+                                      [0, 1, 0, 1, 4])
+        np.testing.assert_array_equal(
+            _profile_representatives(table, block_rows=1), [0, 1, 0, 1, 4])
+
+    def test_rows_score_as_in_full_table(self):
+        rows = np.arange(0, 847, 3)
+        exp = _score_with_native(self.asv_table, *self.args)
+
+        obs = _score_with_native(self.asv_table, *self.args, rows=rows)
+        pd.testing.assert_frame_equal(obs, exp.iloc[rows])
+        obs = _score_with_r(self.asv_table, *self.args, rows=rows)
+        self.assertEqual(list(obs.index), list(self.asv_table.index[rows]))
+
+    def test_hash_collisions_are_not_merged(self):
+        table = pd.DataFrame([[0, 1], [1, 0], [0, 1]])
+        colliding = pd.Series(np.zeros(3, dtype=np.uint64))
+        with mock.patch('pandas.util.hash_pandas_object',
+                        return_value=colliding):
+            representative = _profile_representatives(table)
+        np.testing.assert_array_equal(representative, [0, 1, 0])
+
+    def test_duplicate_profiles_share_scores(self):
+        copies = self.asv_table.iloc[:5].copy()
+        copies.index = ['copy-%s' % i for i in copies.index]
+        table = pd.concat([self.asv_table, copies])
+        exp = _score_with_native(table, *self.args)
+
+        with RunReport('test') as report:
+            obs = _score_prefiltered(_score_with_native, table, *self.args)
+
+        pd.testing.assert_frame_equal(obs, exp)
+        dedup = report.info['dedup']
+        self.assertEqual(dedup['features'], 852)
+        self.assertLessEqual(dedup['profiles'], 847)
+        self.assertGreater(dedup['ratio'], 1)
+
+    def test_r_duplicate_profiles_keep_their_ids(self):
+        # ids R's read.csv would rewrite by default, duplicating the first
+        # profiles so a remainder feature is written too
+        copies = self.asv_table.iloc[:5].copy()
+        copies.index = ['%d-copy' % i for i in range(5)]
+        table = pd.concat([self.asv_table, copies])
+
+        obs = _score_prefiltered(_score_with_r, table, *self.args)
+
+        self.assertEqual(list(obs.index), list(table.index))
+        self.assertFalse(obs[['freq', 'prev', 'p']].isna().any().any())
+        np.testing.assert_array_equal(obs.loc[copies.index].to_numpy(),
+                                      obs.iloc[:5].to_numpy())
+
+    def test_control_only_needs_control_column(self):
+        with self.assertRaisesRegex(ValueError, 'exclude_control_only'):
+            decontam_identify(asv_or_otu_table=self.asv_table,
+                              meta_data=self.metadata_input,
+                              decon_method='frequency',
+                              freq_concentration_column='quant_reading',
+                              scoring_backend='native',
+                              exclude_control_only=True)
+
+    def test_identify_writes_status(self):
+        ff = decontam_identify(asv_or_otu_table=self.asv_table,
+                               meta_data=self.metadata_input,
+                               prev_control_or_exp_sample_column='Sample_or_ConTrol',
+                               prev_control_sample_indicator='Control',
+                               scoring_backend='native', min_reads=1000)
+        obs = pd.read_csv(str(ff), sep='\t', index_col=0)
+        self.assertIn('low_reads', set(obs['status']))
+        self.assertEqual(len(obs), 847)
+
+
+if __name__ == '__main__':
+    unittest.main()
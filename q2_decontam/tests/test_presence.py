@@ -0,0 +1,106 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2016-2022, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+import qiime2
+from qiime2.plugin.testing import TestPluginBase
+
+from q2_decontam._scoring import _score_native
+from q2_decontam._presence import (PresenceMatrix, PRESENCE_CACHE_ENV,
+                                   _POPCOUNT_TABLE, _presence_inputs,
+                                   _score_presence, _table_fingerprint)
+
+
+class TestPresenceMatrix(TestPluginBase):
+    package = 'q2_decontam.tests'
+
+    def setUp(self):
+        super().setUp()
+        table = qiime2.Artifact.load(
+            self.get_data_path('expected/decon_default_ASV_table.qza'))
+        self.asv_table = table.view(qiime2.Metadata).to_dataframe()
+        self.metadata = qiime2.Metadata.load(
+            self.get_data_path('expected/test_metadata.tsv')).to_dataframe()
+
+    def test_popcount_table(self):
+        self.assertEqual(_POPCOUNT_TABLE[0b10110001], 4)
+        self.assertEqual(_POPCOUNT_TABLE[255], 8)
+
+    def test_counts(self):
+        rng = np.random.default_rng(0)
+        values = rng.poisson(0.3, size=(50, 21))
+        table = pd.DataFrame(values, index=['f%d' % i for i in range(50)],
+                             columns=['s%d' % i for i in range(21)])
+        samples = rng.random(21) < 0.4
+        presence = PresenceMatrix.from_table(table, block_rows=7)
+
+        self.assertEqual(presence.bits.shape, (50, 3))
+        np.testing.assert_array_equal(presence.counts(),
+                                      (values > 0).sum(axis=1))
+        np.testing.assert_array_equal(presence.counts(samples),
+                                      (values[:, samples] > 0).sum(axis=1))
+
+    def test_save_load(self):
+        fingerprint = _table_fingerprint(self.asv_table)
+        presence = PresenceMatrix.from_table(self.asv_table)
+        presence.fingerprint = fingerprint
+        with tempfile.TemporaryDirectory() as temp_dir_name:
+            path = os.path.join(temp_dir_name, 'presence.npz')
+            presence.save(path)
+            loaded = PresenceMatrix.load(path, fingerprint)
+            with self.assertRaisesRegex(ValueError, 'different table'):
+                PresenceMatrix.load(path, _table_fingerprint(
+                    self.asv_table.iloc[1:]))
+        np.testing.assert_array_equal(loaded.bits, presence.bits)
+        self.assertEqual(list(loaded.feature_ids), list(self.asv_table.index))
+        self.assertEqual(list(loaded.sample_ids),
+                         list(self.asv_table.columns))
+
+    def test_reused_across_runs(self):
+        params = ('prevalence', 'Sample_or_ConTrol', 'Control')
+        changed = self.asv_table.copy()
+        changed.iloc[0, :] = 0
+        with tempfile.TemporaryDirectory() as cache_dir, \
+                mock.patch.dict(os.environ, {PRESENCE_CACHE_ENV: cache_dir}):
+            first, _, _ = _presence_inputs(self.asv_table, self.metadata,
+                                           *params)
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+            with mock.patch.object(PresenceMatrix, 'from_table') as packed:
+                second, _, _ = _presence_inputs(self.asv_table,
+                                                self.metadata, *params)
+            packed.assert_not_called()
+            _presence_inputs(changed, self.metadata, *params)
+            self.assertEqual(len(os.listdir(cache_dir)), 2)
+        np.testing.assert_array_equal(second.bits, first.bits)
+        self.assertEqual(second.fingerprint, first.fingerprint)
+
+    def test_footprint(self):
+        presence = PresenceMatrix.from_table(self.asv_table)
+        # 1 bit per cell, against 8 bytes per count
+        self.assertLess(presence.nbytes,
+                        self.asv_table.to_numpy().nbytes / 32)
+
+    def test_matches_sparse_scoring(self):
+        params = ('Sample_or_ConTrol', 'Control')
+        presence, freq, neg = _presence_inputs(self.asv_table, self.metadata,
+                                               'prevalence', *params)
+        obs = _score_presence(presence, neg, freq, 'prevalence')
+        exp = _score_native(self.asv_table, self.metadata, 'prevalence',
+                            prev_control_or_exp_sample_column=params[0],
+                            prev_control_sample_indicator=params[1])
+        np.testing.assert_allclose(obs, exp.to_numpy(), rtol=1e-12)
+
+
+if __name__ == '__main__':
+    unittest.main()
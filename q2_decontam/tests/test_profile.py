@@ -0,0 +1,113 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2016-2022, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import os
+import json
+import time
+import tempfile
+import unittest
+from unittest import mock
+
+import qiime2
+from qiime2.plugin.testing import TestPluginBase
+
+from q2_decontam import decontam_identify
+from q2_decontam._profile import (_SamplingProfiler, _collapse_rprof,
+                                  _profiling_enabled, PROFILE_ENV)
+from q2_decontam._report import REPORT_DIR_ENV
+
+
+def _busy_wait(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+class TestProfiling(TestPluginBase):
+    package = 'q2_decontam.tests'
+
+    def setUp(self):
+        super().setUp()
+        table = qiime2.Artifact.load(
+            self.get_data_path('expected/decon_default_ASV_table.qza'))
+        self.asv_table = table.view(qiime2.Metadata).to_dataframe()
+        self.metadata_input = qiime2.Metadata.load(
+            self.get_data_path('expected/test_metadata.tsv'))
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+        super().tearDown()
+
+    def test_profiling_enabled(self):
+        for value, exp in [('', False), ('0', False), ('no', False),
+                           ('1', True), ('yes', True)]:
+            with mock.patch.dict(os.environ, {PROFILE_ENV: value}):
+                self.assertEqual(_profiling_enabled(), exp)
+
+    def test_sampling_profiler(self):
+        profiler = _SamplingProfiler(interval=0.001)
+        profiler.start()
+        _busy_wait(0.1)
+        profiler.stop()
+
+        self.assertGreater(sum(profiler.counts.values()), 0)
+        self.assertTrue(any('_busy_wait' in stack
+                            for stack in profiler.counts))
+
+        out_fp = os.path.join(self.temp_dir.name, 'out.collapsed')
+        profiler.write(out_fp)
+        with open(out_fp) as fh:
+            stack, count = fh.readline().rsplit(' ', 1)
+        self.assertGreater(int(count), 0)
+
+    def test_collapse_rprof(self):
+        rprof_fp = os.path.join(self.temp_dir.name, 'Rprof.out')
+        with open(rprof_fp, 'w') as fh:
+            fh.write('sample.interval=10000\n'
+                     '"pf" "isContaminantFrequency" "apply" "isContaminant" \n'
+                     '"pf" "isContaminantFrequency" "apply" "isContaminant" \n'
+                     '"read.csv" \n')
+        out_fp = os.path.join(self.temp_dir.name, 'r.collapsed')
+
+        self.assertEqual(_collapse_rprof(rprof_fp, out_fp), 3)
+        with open(out_fp) as fh:
+            lines = fh.read().splitlines()
+        self.assertEqual(lines, [
+            'isContaminant;apply;isContaminantFrequency;pf 2',
+            'read.csv 1'])
+
+    def _identify_with_profiling(self, **kwargs):
+        env = {PROFILE_ENV: '1', REPORT_DIR_ENV: self.temp_dir.name}
+        with mock.patch.dict(os.environ, env):
+            decontam_identify(asv_or_otu_table=self.asv_table,
+                              meta_data=self.metadata_input,
+                              decon_method='prevalence',
+                              prev_control_or_exp_sample_column='Sample_or_ConTrol',
+                              prev_control_sample_indicator='Control',
+                              **kwargs)
+        report_fp, = [os.path.join(self.temp_dir.name, fp)
+                      for fp in os.listdir(self.temp_dir.name)
+                      if fp.endswith('.json')]
+        with open(report_fp) as fh:
+            return json.load(fh)
+
+    def test_identify_native_profile(self):
+        report = self._identify_with_profiling(scoring_backend='native')
+        self.assertEqual(set(report['profiles']), {'python'})
+        self.assertTrue(os.path.exists(report['profiles']['python']))
+
+    def test_identify_r_profile(self):
+        report = self._identify_with_profiling()
+        self.assertEqual(set(report['profiles']), {'python', 'r'})
+        with open(report['profiles']['r']) as fh:
+            self.assertIn('isContaminant', fh.read())
+
+
+if __name__ == '__main__':
+    unittest.main()
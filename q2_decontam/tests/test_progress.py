@@ -0,0 +1,114 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2016-2022, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import os
+import tempfile
+import unittest
+
+import pandas as pd
+import qiime2
+from qiime2.plugin.testing import TestPluginBase
+
+from q2_decontam import (add_progress_listener, remove_progress_listener,
+                         ProgressEvent)
+from q2_decontam._decontamination import _score_with_native, _score_with_r
+from q2_decontam._progress import (_ProgressTracker, _ProgressFileWatcher,
+                                   _progress_chunk_size, _feature_ranges)
+
+
+class TestProgress(TestPluginBase):
+    package = 'q2_decontam.tests'
+
+    def setUp(self):
+        super().setUp()
+        self.events = []
+        add_progress_listener(self.events.append)
+
+    def tearDown(self):
+        remove_progress_listener(self.events.append)
+        super().tearDown()
+
+    def test_tracker(self):
+        tracker = _ProgressTracker('example', 10, log_interval=0)
+        with self.assertLogs('q2_decontam', level='INFO') as logs:
+            tracker.update(4)
+            tracker.update(4)  # no progress, no event
+            tracker.update(10)
+
+        self.assertEqual([e.scored for e in self.events], [4, 10])
+        self.assertIsInstance(self.events[0], ProgressEvent)
+        self.assertEqual(self.events[0].total, 10)
+        self.assertGreaterEqual(self.events[0].eta, 0)
+        self.assertEqual(self.events[1].eta, 0)
+        self.assertIn('scored 10/10 features', logs.output[-1])
+
+    def test_eta_unknown_before_progress(self):
+        self.assertIsNone(_ProgressTracker('example', 10).event().eta)
+
+    def test_file_watcher_partial_line(self):
+        tracker = _ProgressTracker('example', 100)
+        with tempfile.TemporaryDirectory() as temp_dir_name:
+            progress_fp = os.path.join(temp_dir_name, 'progress.tsv')
+            watcher = _ProgressFileWatcher(progress_fp, tracker)
+            watcher.poll()  # file not written yet
+            with open(progress_fp, 'w') as fh:
+                fh.write('20\t100\n5')
+            watcher.poll()
+            self.assertEqual(tracker.scored, 20)
+            with open(progress_fp, 'a') as fh:
+                fh.write('0\t100\n')
+            watcher.poll()
+        self.assertEqual([e.scored for e in self.events], [20, 50])
+
+    def test_chunking(self):
+        self.assertEqual(_progress_chunk_size(847), 0)
+        self.assertEqual(_progress_chunk_size(12345), 124)
+        self.assertEqual(_feature_ranges(5, 0), [(0, 5)])
+        self.assertEqual(_feature_ranges(5, 2), [(0, 2), (2, 4), (4, 5)])
+
+
+class TestChunkedScoring(TestPluginBase):
+    package = 'q2_decontam.tests'
+
+    def setUp(self):
+        super().setUp()
+        table = qiime2.Artifact.load(
+            self.get_data_path('expected/decon_default_ASV_table.qza'))
+        self.asv_table = table.view(qiime2.Metadata).to_dataframe()
+        self.metadata_input = qiime2.Metadata.load(
+            self.get_data_path('expected/test_metadata.tsv'))
+        self.args = (self.asv_table, self.metadata_input, 'combined',
+                     'quant_reading', 'Sample_or_ConTrol', 'Control')
+        self.events = []
+        add_progress_listener(self.events.append)
+
+    def tearDown(self):
+        remove_progress_listener(self.events.append)
+        super().tearDown()
+
+    def test_native_chunks_match_single_pass(self):
+        exp = _score_with_native(*self.args, chunk_size=0)
+        self.events.clear()
+        obs = _score_with_native(*self.args, chunk_size=100)
+
+        pd.testing.assert_frame_equal(obs, exp)
+        self.assertEqual([e.scored for e in self.events],
+                         list(range(100, 847, 100)) + [847])
+
+    def test_r_chunks_match_single_pass(self):
+        exp = _score_with_r(*self.args, chunk_size=0)
+        self.events.clear()
+        obs = _score_with_r(*self.args, chunk_size=300)
+
+        pd.testing.assert_frame_equal(obs, exp, check_exact=False,
+                                      rtol=1e-10)
+        self.assertEqual(self.events[-1].scored, 847)
+
+
+if __name__ == '__main__':
+    unittest.main()
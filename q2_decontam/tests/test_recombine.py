@@ -0,0 +1,96 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2016-2022, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import unittest
+
+import numpy as np
+import pandas as pd
+import qiime2
+from qiime2.plugin.testing import TestPluginBase
+
+from q2_decontam import decontam_identify, decontam_recombine
+from q2_decontam._scoring import _combine_pvalues
+
+
+class TestRecombine(TestPluginBase):
+    package = 'q2_decontam.tests'
+
+    def setUp(self):
+        super().setUp()
+        table = qiime2.Artifact.load(
+            self.get_data_path('expected/decon_default_ASV_table.qza'))
+        self.asv_table = table.view(qiime2.Metadata).to_dataframe()
+        self.metadata_input = qiime2.Metadata.load(
+            self.get_data_path('expected/test_metadata.tsv'))
+        ff = decontam_identify(
+            self.asv_table, self.metadata_input, decon_method='all',
+            freq_concentration_column='quant_reading',
+            prev_control_or_exp_sample_column='Sample_or_ConTrol',
+            prev_control_sample_indicator='Control',
+            scoring_backend='native')
+        self.scores = pd.read_csv(str(ff), sep='\t', index_col=0)
+
+    def _recombine(self, combination):
+        ff = decontam_recombine(self.scores, combination)
+        return pd.read_csv(str(ff), sep='\t', index_col=0)
+
+    def test_rules(self):
+        p_freq = np.array([0.2, 0.01, np.nan, 0.5])
+        p_prev = np.array([0.05, 0.3, 0.4, np.nan])
+        np.testing.assert_array_equal(
+            _combine_pvalues(p_freq, p_prev, 'minimum'),
+            [0.05, 0.01, 0.4, 0.5])
+        np.testing.assert_array_equal(
+            _combine_pvalues(p_freq, p_prev, 'either'),
+            _combine_pvalues(p_freq, p_prev, 'minimum'))
+        np.testing.assert_array_equal(
+            _combine_pvalues(p_freq, p_prev, 'both'),
+            [0.2, 0.3, np.nan, np.nan])
+
+    def test_combined_round_trips(self):
+        obs = self._recombine('combined')
+        np.testing.assert_allclose(obs['p'], self.scores['p'])
+
+    def test_minimum_and_both(self):
+        minimum = self._recombine('minimum')
+        both = self._recombine('both')
+        tested = ((self.scores['p.freq'] > 0)
+                  & (self.scores['p.prev'] > 0))
+
+        np.testing.assert_allclose(
+            minimum['p'][tested], np.fmin(self.scores['p.freq'],
+                                          self.scores['p.prev'])[tested])
+        np.testing.assert_allclose(
+            both['p'][tested], np.maximum(self.scores['p.freq'],
+                                          self.scores['p.prev'])[tested])
+        # the other columns are carried over untouched
+        np.testing.assert_allclose(minimum['p.prev'], self.scores['p.prev'])
+        self.assertTrue((minimum['p'][tested] <= both['p'][tested]).all())
+
+    def test_untested_features_judged_on_the_other_test(self):
+        # features in too few true samples have no frequency test, which
+        # the combined table writes as p.freq 0
+        untested = self.scores.index[(self.scores['p.freq'] == 0)
+                                     & (self.scores['p.prev'] > 0)]
+        self.assertGreater(len(untested), 0)
+        minimum = self._recombine('minimum')
+        both = self._recombine('both')
+
+        np.testing.assert_allclose(minimum.loc[untested, 'p'],
+                                   self.scores.loc[untested, 'p.prev'])
+        self.assertTrue((minimum.loc[untested, 'p'] > 0).all())
+        # 'both' cannot call a feature on one test
+        self.assertTrue(both.loc[untested, 'p'].isna().all())
+
+    def test_needs_both_pvalues(self):
+        with self.assertRaisesRegex(ValueError, 'p.freq'):
+            decontam_recombine(self.scores.drop(columns='p.freq'), 'minimum')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2016-2022, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import os
+import json
+import inspect
+import glob
+import tempfile
+import unittest
+from unittest import mock
+
+import qiime2
+from qiime2.plugin.testing import TestPluginBase
+
+from q2_decontam import decontam_identify, decontam_score_viz
+from q2_decontam._report import (RunReport, REPORT_DIR_ENV, _stage,
+                                 _reported)
+
+
+class TestRunReport(TestPluginBase):
+    package = 'q2_decontam.tests'
+
+    def setUp(self):
+        super().setUp()
+        table = qiime2.Artifact.load(
+            self.get_data_path('expected/decon_default_ASV_table.qza'))
+        self.asv_table = table.view(qiime2.Metadata).to_dataframe()
+        self.metadata_input = qiime2.Metadata.load(
+            self.get_data_path('expected/test_metadata.tsv'))
+
+    def test_stages_and_log_line(self):
+        with self.assertLogs('q2_decontam', level='INFO') as logs:
+            with RunReport('example', answer=42) as report:
+                with report.stage('first'):
+                    pass
+                with _stage('second'):
+                    pass
+        _stage('outside')  # no active report, a no-op
+
+        self.assertEqual([s['stage'] for s in report.stages],
+                         ['first', 'second'])
+        payload = json.loads(logs.output[-1].split('run report: ', 1)[1])
+        self.assertEqual(payload['action'], 'example')
+        self.assertEqual(payload['answer'], 42)
+        self.assertEqual(payload['status'], 'ok')
+        self.assertGreater(payload['peak_rss_mb'], 0)
+        self.assertGreater(payload['process_peak_rss_mb'], 0)
+
+    def test_reports_in_the_same_second_keep_their_files(self):
+        with tempfile.TemporaryDirectory() as report_dir, \
+                mock.patch.dict(os.environ, {REPORT_DIR_ENV: report_dir}), \
+                mock.patch('time.time', return_value=1e9), \
+                self.assertLogs('q2_decontam', level='INFO'):
+            with RunReport('example') as first:
+                pass
+            with RunReport('example') as second:
+                pass
+            self.assertNotEqual(first.path, second.path)
+            self.assertEqual(len(os.listdir(report_dir)), 2)
+
+    def test_reported_decorator(self):
+        @_reported('example', lambda args: {'doubled': 2 * args['value']})
+        def action(value, scale: float = 1.0):
+            with _stage('work'):
+                return value * scale
+
+        with self.assertLogs('q2_decontam', level='INFO') as logs:
+            self.assertEqual(action(3), 3)
+        payload = json.loads(logs.output[-1].split('run report: ', 1)[1])
+        self.assertEqual(payload['doubled'], 6)
+        self.assertEqual([s['stage'] for s in payload['stages']], ['work'])
+        # qiime2 registers actions by their signature
+        self.assertEqual(list(inspect.signature(decontam_score_viz)
+                              .parameters)[:3],
+                         ['output_dir', 'decon_identify_table',
+                          'asv_or_otu_table'])
+
+    def test_failed_run_is_reported(self):
+        with self.assertLogs('q2_decontam', level='INFO'):
+            with self.assertRaises(KeyError):
+                with RunReport('example') as report:
+                    raise KeyError('boom')
+        self.assertEqual(report.info['status'], 'KeyError')
+
+    def test_identify_side_file(self):
+        with tempfile.TemporaryDirectory() as report_dir, \
+                mock.patch.dict(os.environ, {REPORT_DIR_ENV: report_dir}):
+            decontam_identify(asv_or_otu_table=self.asv_table,
+                              meta_data=self.metadata_input,
+                              decon_method='prevalence',
+                              prev_control_or_exp_sample_column='Sample_or_ConTrol',
+                              prev_control_sample_indicator='Control',
+                              scoring_backend='native')
+            report_fps = glob.glob(os.path.join(report_dir,
+                                                'decontam_identify-*.json'))
+            self.assertEqual(len(report_fps), 1)
+            with open(report_fps[0]) as fh:
+                report = json.load(fh)
+
+        self.assertEqual(report['matrix']['features'],
+                         self.asv_table.shape[0])
+        self.assertEqual(report['matrix']['samples'],
+                         self.asv_table.shape[1])
+        self.assertEqual([s['stage'] for s in report['stages']],
+                         ['deduplicate', 'pack_presence', 'score_presence',
+                          'transform'])
+        for stage in report['stages']:
+            self.assertGreaterEqual(stage['seconds'], 0)
+            self.assertGreater(stage['peak_rss_mb'], 0)
+
+    def test_identify_r_stages(self):
+        with self.assertLogs('q2_decontam', level='INFO') as logs:
+            decontam_identify(asv_or_otu_table=self.asv_table,
+                              meta_data=self.metadata_input,
+                              decon_method='frequency',
+                              freq_concentration_column='quant_reading')
+        report = json.loads(logs.output[-1].split('run report: ', 1)[1])
+
+        stages = [s['stage'] for s in report['stages']]
+        for stage in ['write_table', 'write_metadata', 'run_decontam.R',
+                      'r_startup', 'isContaminant', 'parse_track',
+                      'transform']:
+            self.assertIn(stage, stages)
+        self.assertTrue(report['r_version'].startswith('R version'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,148 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2016-2022, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import os
+import json
+import tempfile
+import unittest
+import urllib.error
+import urllib.request
+
+import pandas as pd
+import qiime2
+from qiime2.plugin.testing import TestPluginBase
+
+from q2_decontam import decontam_identify
+from q2_decontam._service import DecontamService, _FairQueue, _Job
+
+
+def _job(project, name):
+    return _Job('identify', project, {}, {'name': name}, name)
+
+
+class TestFairQueue(TestPluginBase):
+    package = 'q2_decontam.tests'
+
+    def test_round_robin_across_projects(self):
+        queue = _FairQueue()
+        for name in ['a1', 'a2', 'a3']:
+            queue.put(_job('a', name))
+        queue.put(_job('b', 'b1'))
+        queue.put(_job('c', 'c1'))
+        queue.put(_job('b', 'b2'))
+
+        order = [queue.get().params['name'] for _ in range(len(queue))]
+        self.assertEqual(order, ['a1', 'b1', 'c1', 'a2', 'b2', 'a3'])
+
+    def test_closed_queue_releases_workers(self):
+        queue = _FairQueue()
+        queue.close()
+        self.assertIsNone(queue.get())
+
+
+class TestDecontamService(TestPluginBase):
+    package = 'q2_decontam.tests'
+
+    def setUp(self):
+        super().setUp()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.table_fp = self.get_data_path(
+            'expected/decon_default_ASV_table.qza')
+        self.metadata_fp = self.get_data_path('expected/test_metadata.tsv')
+        self.score_fp = self.get_data_path(
+            'expected/decon_default_score_table.qza')
+        self.identify = {
+            'action': 'identify', 'project': 'p1',
+            'inputs': {'table': self.table_fp,
+                       'metadata': self.metadata_fp},
+            'params': {'prev_control_or_exp_sample_column':
+                       'Sample_or_ConTrol',
+                       'prev_control_sample_indicator': 'Control',
+                       'scoring_backend': 'native'}}
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+        super().tearDown()
+
+    def test_identical_requests_are_deduplicated(self):
+        service = DecontamService(self.temp_dir.name, workers=0)
+        first, joined_first = service.submit(self.identify)
+        second, joined_second = service.submit(dict(self.identify,
+                                                    project='p2'))
+        other, _ = service.submit(dict(self.identify, params=dict(
+            self.identify['params'], decon_method='prevalence')))
+
+        self.assertFalse(joined_first)
+        self.assertTrue(joined_second)
+        self.assertIs(first, second)
+        self.assertEqual(first.submissions, 2)
+        self.assertIsNot(other, first)
+        self.assertEqual(service.health()['queued'], 2)
+
+    def test_invalid_requests(self):
+        service = DecontamService(self.temp_dir.name, workers=0)
+        with self.assertRaisesRegex(ValueError, 'Unknown action'):
+            service.submit({'action': 'frobnicate'})
+        with self.assertRaisesRegex(ValueError, 'metadata'):
+            service.submit({'action': 'identify',
+                            'inputs': {'table': self.table_fp}})
+
+    def _call(self, service, method, path, payload=None):
+        data = None if payload is None else json.dumps(payload).encode()
+        request = urllib.request.Request(
+            'http://127.0.0.1:%d%s' % (service.port, path), data=data,
+            method=method)
+        try:
+            with urllib.request.urlopen(request) as response:
+                return response.status, json.load(response)
+        except urllib.error.HTTPError as e:
+            return e.code, json.load(e)
+
+    def test_http_round_trip(self):
+        with DecontamService(self.temp_dir.name, workers=2) as service:
+            status, job = self._call(service, 'POST', '/jobs', self.identify)
+            self.assertIn(status, {200, 202})
+            status, viz = self._call(service, 'POST', '/jobs', {
+                'action': 'viz', 'project': 'p2',
+                'inputs': {'score_table': self.score_fp,
+                           'table': self.table_fp}})
+            for job_id in [job['job_id'], viz['job_id']]:
+                service.jobs[job_id].done.wait(120)
+
+            status, job = self._call(service, 'GET',
+                                     '/jobs/%s' % job['job_id'])
+            self.assertEqual(status, 200)
+            self.assertEqual(job['state'], 'done', job['error'])
+            status, viz = self._call(service, 'GET',
+                                     '/jobs/%s' % viz['job_id'])
+            self.assertEqual(viz['state'], 'done', viz['error'])
+            self.assertTrue(os.path.exists(
+                os.path.join(viz['output'], 'index.html')))
+
+            status, health = self._call(service, 'GET', '/health')
+            self.assertEqual(health['done'], 2)
+            # the viz job reused the table the identify job loaded
+            self.assertGreaterEqual(health['cache_hits'], 1)
+            status, _ = self._call(service, 'GET', '/jobs/nope')
+            self.assertEqual(status, 404)
+            status, error = self._call(service, 'POST', '/jobs',
+                                       {'action': 'frobnicate'})
+            self.assertEqual(status, 400)
+
+        obs = qiime2.Artifact.load(job['output']).view(pd.DataFrame)
+        table = qiime2.Artifact.load(self.table_fp)
+        exp = decontam_identify(table.view(qiime2.Metadata).to_dataframe(),
+                                qiime2.Metadata.load(self.metadata_fp),
+                                **self.identify['params'])
+        pd.testing.assert_frame_equal(
+            obs, qiime2.Artifact.import_data(
+                'FeatureData[DecontamScore]', exp).view(pd.DataFrame))
+
+
+if __name__ == '__main__':
+    unittest.main()
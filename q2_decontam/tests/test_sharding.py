@@ -0,0 +1,135 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2016-2022, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import os
+import time
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+import qiime2
+from qiime2.plugin.testing import TestPluginBase
+
+from q2_decontam import decontam_identify
+from q2_decontam._scoring import _scoring_inputs, _score_counts
+from q2_decontam._sharding import (_score_sharded, _write_shards,
+                                   _run_worker, _shard_path, _attempts)
+
+
+class TestSharding(TestPluginBase):
+    package = 'q2_decontam.tests'
+
+    def setUp(self):
+        super().setUp()
+        table = qiime2.Artifact.load(
+            self.get_data_path('expected/decon_default_ASV_table.qza'))
+        self.asv_table = table.view(qiime2.Metadata).to_dataframe()
+        self.metadata_input = qiime2.Metadata.load(
+            self.get_data_path('expected/test_metadata.tsv'))
+        self.inputs = _scoring_inputs(
+            self.asv_table, self.metadata_input.to_dataframe(), 'combined',
+            'quant_reading', 'Sample_or_ConTrol', 'Control')
+        self.exp = _score_counts(*self.inputs, 'combined')
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.shard_dir = os.path.join(self.temp_dir.name, 'shards')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+        super().tearDown()
+
+    def test_local_workers_match_single_pass(self):
+        events = []
+        obs = _score_sharded(*self.inputs, 'combined', self.shard_dir,
+                             local_workers=2, shard_size=100,
+                             progress=events.append, poll_interval=0.05)
+
+        np.testing.assert_array_equal(obs, self.exp)
+        self.assertEqual(events[-1], 847)
+        self.assertTrue(os.path.exists(_shard_path(self.shard_dir, 8,
+                                                   '.npy')))
+
+    def test_streamed_table_matches_matrix(self):
+        inputs = _scoring_inputs(
+            self.asv_table, self.metadata_input.to_dataframe(), 'combined',
+            'quant_reading', 'Sample_or_ConTrol', 'Control', stream=True)
+        self.assertEqual(inputs[0].shape, self.inputs[0].shape)
+        obs = _score_sharded(*inputs, 'combined', self.shard_dir,
+                             shard_size=300, poll_interval=0.05)
+        np.testing.assert_allclose(obs, self.exp, rtol=1e-12)
+
+    def test_coordinator_scores_without_workers(self):
+        obs = _score_sharded(*self.inputs, 'combined', self.shard_dir,
+                             shard_size=300, poll_interval=0.05)
+        np.testing.assert_array_equal(obs, self.exp)
+
+    def test_stale_lock_is_reclaimed(self):
+        _write_shards(self.shard_dir, *self.inputs, 'combined',
+                      shard_size=500, lock_timeout=5)
+        lock = _shard_path(self.shard_dir, 0, '.lock')
+        with open(lock, 'w') as fh:
+            fh.write('dead-host:1')
+        past = time.time() - 60
+        os.utime(lock, (past, past))
+
+        self.assertEqual(_run_worker(self.shard_dir, poll_interval=0.05), 2)
+        self.assertFalse(os.path.exists(lock))
+        self.assertIn('dead-host:1', _attempts(self.shard_dir, 0)[0])
+
+    def test_live_lock_is_not_taken(self):
+        _write_shards(self.shard_dir, *self.inputs, 'combined',
+                      shard_size=500)
+        with open(_shard_path(self.shard_dir, 0, '.lock'), 'w') as fh:
+            fh.write('busy-host:1')
+
+        self.assertEqual(_run_worker(self.shard_dir, max_shards=1), 1)
+        self.assertFalse(os.path.exists(_shard_path(self.shard_dir, 0,
+                                                    '.npy')))
+        self.assertTrue(os.path.exists(_shard_path(self.shard_dir, 1,
+                                                   '.npy')))
+
+    def test_failed_shard_is_retried(self):
+        calls = []
+
+        def flaky(*args):
+            calls.append(args)
+            if len(calls) == 1:
+                raise MemoryError('worker ran out of memory')
+            return _score_counts(*args)
+
+        with mock.patch('q2_decontam._sharding._score_counts', flaky):
+            obs = _score_sharded(*self.inputs, 'combined', self.shard_dir,
+                                 shard_size=300, poll_interval=0.05)
+
+        np.testing.assert_array_equal(obs, self.exp)
+        self.assertEqual(len(calls), 4)
+        self.assertIn('MemoryError', _attempts(self.shard_dir, 0)[0])
+
+    def test_gives_up_after_max_attempts(self):
+        with mock.patch('q2_decontam._sharding._score_counts',
+                        side_effect=ValueError('bad shard')):
+            with self.assertRaisesRegex(RuntimeError, '3 times.*bad shard'):
+                _score_sharded(*self.inputs, 'combined', self.shard_dir,
+                               shard_size=300, poll_interval=0.05)
+
+    def test_shard_dir_must_be_unused(self):
+        _write_shards(self.shard_dir, *self.inputs, 'combined')
+        with self.assertRaisesRegex(ValueError, 'manifest'):
+            _write_shards(self.shard_dir, *self.inputs, 'combined')
+
+    def test_identify_requires_native_backend(self):
+        with self.assertRaisesRegex(ValueError, 'native'):
+            decontam_identify(asv_or_otu_table=self.asv_table,
+                              meta_data=self.metadata_input,
+                              prev_control_or_exp_sample_column='Sample_or_ConTrol',
+                              prev_control_sample_indicator='Control',
+                              shard_dir=self.shard_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2016-2022, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import unittest
+
+import pandas as pd
+import qiime2
+from scipy.spatial import distance
+from qiime2.plugin.testing import TestPluginBase
+from qiime2.plugin.util import transform
+
+from q2_decontam import decontam_control_similarity, ControlSimilarityFormat
+
+
+class TestControlSimilarity(TestPluginBase):
+    package = 'q2_decontam.tests'
+
+    def setUp(self):
+        super().setUp()
+        self.table = pd.DataFrame(
+            [[10, 0, 5, 0, 1],
+             [0, 4, 5, 2, 0],
+             [3, 3, 0, 2, 0],
+             [0, 0, 1, 0, 9]],
+            index=pd.Index(['f1', 'f2', 'f3', 'f4'], name='id'),
+            columns=['blank1', 'blank2', 's1', 's2', 's3'])
+        self.metadata = qiime2.Metadata(pd.DataFrame(
+            {'kind': ['Control', 'Control', 'True', 'True', 'True']},
+            index=pd.Index(self.table.columns, name='sampleid')))
+
+    def _expected(self, metric):
+        profiles = (self.table / self.table.sum(axis=0)).T
+        exp = {}
+        for control in ['blank1', 'blank2']:
+            for sample in profiles.index.drop(control):
+                if metric == 'braycurtis':
+                    value = 1 - distance.braycurtis(profiles.loc[control],
+                                                    profiles.loc[sample])
+                else:
+                    value = 1 - distance.jaccard(profiles.loc[control] > 0,
+                                                 profiles.loc[sample] > 0)
+                exp[control, sample] = value
+        return exp
+
+    def test_metrics_match_scipy(self):
+        for metric in ['braycurtis', 'jaccard']:
+            obs = decontam_control_similarity(self.table, self.metadata,
+                                              'kind', 'Control',
+                                              metric=metric, top_k=4)
+            exp = self._expected(metric)
+
+            self.assertEqual(len(obs), 8)
+            for row in obs.itertuples():
+                self.assertAlmostEqual(row.similarity,
+                                       exp[row.control, row.sample])
+                self.assertEqual(row.sample_is_control,
+                                 row.sample.startswith('blank'))
+            for _, ranked in obs.groupby('control'):
+                self.assertEqual(list(ranked['rank']), [1, 2, 3, 4])
+                self.assertTrue(ranked['similarity'].is_monotonic_decreasing)
+
+    def test_top_k(self):
+        obs = decontam_control_similarity(self.table, self.metadata, 'kind',
+                                          'Control', top_k=1)
+        self.assertEqual(list(obs['control']), ['blank1', 'blank2'])
+        # most of blank1's reads are f1, as are half of s1's
+        self.assertEqual(obs.loc[0, 'sample'], 's1')
+
+    def test_format_round_trip(self):
+        obs = decontam_control_similarity(self.table, self.metadata, 'kind',
+                                          'Control')
+        ff = transform(obs, from_type=pd.DataFrame,
+                       to_type=ControlSimilarityFormat)
+        ff.validate()
+        round_trip = transform(ff, from_type=ControlSimilarityFormat,
+                               to_type=pd.DataFrame)
+        pd.testing.assert_frame_equal(round_trip, obs)
+
+
+if __name__ == '__main__':
+    unittest.main()
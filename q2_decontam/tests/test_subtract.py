@@ -0,0 +1,83 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2016-2022, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import unittest
+
+import numpy as np
+import pandas as pd
+import qiime2
+import scipy.sparse
+from qiime2.plugin.testing import TestPluginBase
+
+from q2_decontam import decontam_remove
+from q2_decontam._mixing import _subtract_contaminants
+
+
+class TestSubtract(TestPluginBase):
+    package = 'q2_decontam.tests'
+
+    def setUp(self):
+        super().setUp()
+        # f0/f1 make up the controls, f2-f4 the true samples; most true
+        # samples are contaminated
+        self.table = pd.DataFrame(
+            {'c1': [50, 50, 0, 0, 0], 'c2': [100, 100, 0, 0, 0],
+             'clean': [0, 0, 40, 30, 30], 'mixed': [25, 25, 40, 30, 30],
+             'heavy': [90, 90, 8, 6, 6]},
+            index=pd.Index(['f%d' % i for i in range(5)], name='id'))
+        self.metadata = qiime2.Metadata(pd.DataFrame(
+            {'kind': ['Control', 'Control', 'True', 'True', 'True']},
+            index=pd.Index(self.table.columns, name='sampleid')))
+        # f1 is a contaminant candidate, f0 is not
+        self.scores = qiime2.Metadata(pd.DataFrame(
+            {'p': [0.5, 0.01, 0.9, 0.9, 0.9]},
+            index=pd.Index(self.table.index, name='#OTU ID')))
+
+    def test_subtract(self):
+        obs = decontam_remove(self.scores, self.table, threshold=0.1,
+                              removal_mode='subtract',
+                              meta_data=self.metadata,
+                              prev_control_or_exp_sample_column='kind',
+                              prev_control_sample_indicator='Control')
+        # samples are observations, as in the 'remove' output
+        obs = obs.to_dataframe(dense=True).T
+        obs = obs.loc[self.table.index, self.table.columns]
+
+        # every feature is kept; only the candidate row changes
+        unchanged = self.table.drop(index='f1')
+        np.testing.assert_array_equal(obs.drop(index='f1').to_numpy(),
+                                      unchanged.to_numpy())
+        self.assertTrue((obs.loc['f1'] >= 0).all())
+        self.assertEqual(obs.loc['f1', 'clean'], 0)
+        self.assertEqual(obs.loc['f1', 'c1'], 0)
+        self.assertLess(obs.loc['f1', 'mixed'], 25)
+        self.assertLess(obs.loc['f1', 'heavy'], 90)
+
+    def test_only_candidates_are_rounded(self):
+        counts = scipy.sparse.csr_matrix(
+            self.table.to_numpy(dtype=float) + [[0], [0], [0.4], [0], [0]])
+        candidates = np.array([False, True, False, False, False])
+        neg = np.array([True, True, False, False, False])
+
+        out, _ = _subtract_contaminants(counts, candidates, neg)
+
+        np.testing.assert_array_equal(out.toarray()[2], counts.toarray()[2])
+
+    def test_remove_is_default(self):
+        obs = decontam_remove(self.scores, self.table, threshold=0.1)
+        self.assertNotIn('f1', obs.ids(axis='sample'))
+        self.assertIn('f0', obs.ids(axis='sample'))
+
+    def test_subtract_needs_controls(self):
+        with self.assertRaisesRegex(ValueError, 'meta_data'):
+            decontam_remove(self.scores, self.table,
+                            removal_mode='subtract')
+
+
+if __name__ == '__main__':
+    unittest.main()